@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+"""
+Module: cache
+This module caches the responses of the read-heavy API endpoints in process.
+A cached response is reused while the data version it was built for is still
+the current one and it is younger than the TTL; the least recently used
+responses are dropped once the cache is full. Every cached response carries a
+weak ETag, so a client sending it back in If-None-Match gets a 304 without a body.
+Classes:
+    ResponseCache: An LRU and TTL cache of responses keyed by endpoint and arguments.
+Public Functions:
+    cached(view): Decorates a GET view so its responses are cached.
+Usage:
+    @api_views.route('/stores', methods=['GET'])
+    @cached
+    def all_stores():
+        ...
+Environment Variables:
+    FLAYERFX_CACHE_SIZE: Maximum number of cached responses. Defaults to 512.
+    FLAYERFX_CACHE_TTL: Seconds a response is reused. Defaults to 60.
+"""
+from collections import OrderedDict
+from functools import wraps
+from hashlib import md5
+from os import getenv
+from threading import Lock
+from time import monotonic
+
+from flask import make_response, request
+
+from models.engine.data_version import data_version
+
+# Maximum number of cached responses
+CACHE_SIZE = int(getenv('FLAYERFX_CACHE_SIZE', 512))
+# Seconds a cached response is reused even if the data did not change
+CACHE_TTL = int(getenv('FLAYERFX_CACHE_TTL', 60))
+# Response headers kept with a cached body
+CACHED_HEADERS = ('Content-Type', 'X-Total-Count', 'X-Next-Cursor', 'Link')
+
+
+class ResponseCache:
+    """
+    ResponseCache class holding response bodies by endpoint and arguments.
+    Attributes:
+        size (int): The maximum number of responses.
+        ttl (int): The seconds a response is reused.
+    Methods:
+        lookup(key, version): Returns the cached response of a key built for a data version.
+        store(key, version, response): Caches a response.
+        not_modified(): Counts a 304 response.
+        clear(): Drops every response.
+        stats(): Returns the hit, miss and eviction counters.
+    """
+
+    def __init__(self, size=CACHE_SIZE, ttl=CACHE_TTL):
+        """
+        Instantiate an empty cache.
+
+        Args:
+            size (int, optional): The maximum number of responses.
+            ttl (int, optional): The seconds a response is reused.
+        """
+        self.size = size
+        self.ttl = ttl
+        self.__entries = OrderedDict()
+        self.__counters = {'hits': 0, 'misses': 0, 'not_modified': 0, 'evictions': 0}
+        self.__lock = Lock()
+
+    def lookup(self, key, version):
+        """
+        Returns the cached response of a key.
+
+        Args:
+            key (tuple): The endpoint and arguments of the request.
+            version (str): The current data version.
+
+        Returns:
+            dict or None: The body, status, headers and etag, or None if missing,
+                          expired or built for another data version.
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and (entry['version'] != version or monotonic() - entry['time'] > self.ttl):
+                del self.__entries[key]
+                entry = None
+            if entry is None:
+                self.__counters['misses'] += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.__counters['hits'] += 1
+            return entry
+
+    def store(self, key, version, response):
+        """
+        Caches a successful response.
+
+        Args:
+            key (tuple): The endpoint and arguments of the request.
+            version (str): The data version the response was built for.
+            response (Response): The response.
+
+        Returns:
+            dict: The cached entry, with the etag of the body.
+        """
+        body = response.get_data()
+        entry = {'version': version, 'time': monotonic(), 'body': body, 'status': response.status_code,
+                 'headers': {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers},
+                 'etag': md5(body).hexdigest()}
+        if response.status_code != 200:
+            return entry
+        with self.__lock:
+            self.__entries[key] = entry
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.size:
+                self.__entries.popitem(last=False)
+                self.__counters['evictions'] += 1
+        return entry
+
+    def not_modified(self):
+        """
+        Counts a request answered with 304 Not Modified.
+        """
+        with self.__lock:
+            self.__counters['not_modified'] += 1
+
+    def clear(self):
+        """
+        Drops every cached response.
+        """
+        with self.__lock:
+            self.__entries.clear()
+
+    def stats(self):
+        """
+        Returns the counters of the cache.
+
+        Returns:
+            dict: The hits, misses, 304 responses and evictions, the number of cached
+                  responses, the size, the TTL and the current data version.
+        """
+        with self.__lock:
+            stats = dict(self.__counters)
+            stats['entries'] = len(self.__entries)
+        stats.update({'size': self.size, 'ttl': self.ttl, 'data_version': data_version.current()})
+        return stats
+
+
+# The cache of the API responses
+response_cache = ResponseCache()
+
+
+def cached(view):
+    """
+    Decorates a view so its GET responses are cached and validated with ETags.
+
+    The key is the endpoint, its URL arguments and the query string. Other
+    methods of the view are not cached.
+
+    Args:
+        view (function): The view.
+
+    Returns:
+        function: The caching view.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method != 'GET':
+            return view(*args, **kwargs)
+        key = (request.endpoint, tuple(sorted(request.view_args.items())),
+               tuple(sorted(request.args.items(multi=True))))
+        version = data_version.current()
+        entry = response_cache.lookup(key, version)
+        hit = entry is not None
+        if not hit:
+            entry = response_cache.store(key, version, make_response(view(*args, **kwargs)))
+        if entry['status'] == 200 and request.if_none_match.contains_weak(entry['etag']):
+            response_cache.not_modified()
+            response = make_response('', 304)
+        else:
+            response = make_response(entry['body'], entry['status'])
+            for name, value in entry['headers'].items():
+                response.headers[name] = value
+        response.set_etag(entry['etag'], weak=True)
+        response.headers['X-Cache'] = 'HIT' if hit else 'MISS'
+        return response
+    return wrapper
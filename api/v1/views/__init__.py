@@ -8,4 +8,5 @@ from api.v1.views.index import *
 from api.v1.views.stores import *
 from api.v1.views.products import *
 from api.v1.views.prices import *
-from api.v1.views.scrapers import *
\ No newline at end of file
+from api.v1.views.scrapers import *
+from api.v1.views.exports import *
\ No newline at end of file
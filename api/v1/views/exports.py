@@ -0,0 +1,46 @@
+#!/usr/bin/python3
+""" Streaming exports of the products, prices and product relations """
+from models.price import Price
+from models.product import Product
+from models.product_relation import ProductRelation
+from models.base_model import parse_time
+from models import storage
+from models.engine.export import FORMATS, export_lines, gzip_chunks
+from api.v1.views import api_views
+from flask import Response, abort, request, stream_with_context
+
+exportables = {'products': Product, 'prices': Price, 'relations': ProductRelation}
+export_mimetypes = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+@api_views.route('/export/<kind>', methods=['GET'], strict_slashes=False)
+def export(kind):
+    """
+    Streams every product, price or relation as NDJSON or CSV
+    Query arguments: format (ndjson or csv), gzip (1 to compress),
+    store_id, since and until (dates, on the fetch date of prices
+    and the creation date of products and relations)
+    """
+    if kind not in exportables:
+        abort(404, "Unknown export")
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in FORMATS:
+        abort(400, description="format must be one of " + ", ".join(FORMATS))
+    dates = {}
+    for arg in ('since', 'until'):
+        if request.args.get(arg):
+            try:
+                dates[arg] = parse_time(request.args[arg])
+            except ValueError:
+                abort(400, description="Invalid " + arg + " date")
+    rows = storage.export(exportables[kind], store_id=request.args.get('store_id'), **dates)
+    body = export_lines(rows, exportables[kind].__name__, fmt)
+    filename = kind + "." + fmt
+    mimetype = export_mimetypes[fmt]
+    if request.args.get('gzip', '').lower() in ('1', 'true', 'yes'):
+        body = gzip_chunks(body)
+        filename += ".gz"
+        mimetype = 'application/gzip'
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = 'attachment; filename=' + filename
+    return response
@@ -5,7 +5,9 @@ from models.store import Store
 from models.price import Price
 from models import storage
 from api.v1.views import api_views
-from flask import jsonify
+from models.engine.jobs import background_jobs
+from api.v1.cache import cached, response_cache
+from flask import abort, jsonify
 
 classes = {"Store": Store, "Product": Product,
                 "Price": Price}
@@ -17,9 +19,32 @@ def status():
 
 
 @api_views.route('/stats', methods=['GET'], strict_slashes=False)
+@cached
 def number_objects():
     """ Retrieves the number of each objects by type """
+    counts = storage.counts()
     num_objs = {}
-    for name, cl in classes.items():
-        num_objs[name] = storage.count(cl)
+    for name in classes:
+        num_objs[name] = counts.get(name, 0)
     return jsonify(num_objs)
+
+
+@api_views.route('/cache_stats', methods=['GET'], strict_slashes=False)
+def cache_stats():
+    """ Retrieves the hit and miss counters of the response cache """
+    return jsonify(response_cache.stats())
+
+
+@api_views.route('/jobs', methods=['GET'], strict_slashes=False)
+def all_jobs():
+    """ Retrieves the background jobs of this process, most recent first """
+    return jsonify(background_jobs.list())
+
+
+@api_views.route('/jobs/<job_id>', methods=['GET'], strict_slashes=False)
+def get_job(job_id):
+    """ Retrieves the status and progress of a background job """
+    job = background_jobs.get(job_id)
+    if job is None:
+        abort(404, "Job Not Found")
+    return jsonify(job)
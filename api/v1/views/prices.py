@@ -43,6 +43,24 @@ def get_prices(store_id, product_id):
     return jsonify(list_prices)
 
 
+@api_views.route('/products/<product_id>/price_segments', methods=['GET'],
+                 strict_slashes=False)
+def get_price_segments(product_id):
+    """
+    Retrieves the price history of a Product as segments,
+    one per run of consecutive equal prices, most recent first
+    """
+    product = storage.get(Product, id = product_id)
+    if not product:
+        abort(404, "Product Not Found")
+    segments = []
+    for segment in product[0].price_segments:
+        segment['first_seen'] = segment['first_seen'].strftime(time)
+        segment['last_seen'] = segment['last_seen'].strftime(time)
+        segments.append(segment)
+    return jsonify(segments)
+
+
 @api_views.route('/prices/<price_id>/', methods=['GET'], strict_slashes=False)
 #@swag_from('documentation/price/get_price.yml', methods=['GET'])
 def get_price(price_id):
@@ -3,21 +3,20 @@
 from models.product import Product
 from models.store import Store
 from models import storage
+from models.engine.jobs import background_jobs
 from api.v1.views import api_views
-from flask import abort, jsonify, make_response, request
+from api.v1.cache import cached
+from flask import abort, jsonify, make_response, request, url_for
 from flasgger.utils import swag_from
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+import json
 
 product_tp = {'link': str, 'name': str, 'reference': int}
 page_size = 100
+max_page_size = 1000
+orderings = ['id', 'name']
 
 
-def dictify(v):
-    if v is None:
-        return None
-    else:
-        return v.to_dict()
-    
-
 @api_views.route('/clean/products', methods=['GET'], strict_slashes=False)
 def clean_products():
     """
@@ -49,84 +48,126 @@ def clean_products():
     })
 
 
+@api_views.route('/merge/products', methods=['POST'], strict_slashes=False)
+@api_views.route('/stores/<store_id>/merge_products', methods=['POST'], strict_slashes=False)
+def merge_products(store_id=None):
+    """
+    Merges the products of a store, or of every store, sharing a reference
+    With ?dry_run=1 the merge report is returned without changing anything,
+    otherwise the merge runs as a background job whose ID is returned with a 202
+    """
+    store_ids = None
+    if store_id is not None:
+        if not storage.get(Store, id = store_id):
+            abort(404, "Store Not Found")
+        store_ids = [store_id]
+    if request.args.get('dry_run', '').lower() in ('1', 'true', 'yes'):
+        return jsonify(storage.merge_products(store_ids, dry_run=True))
+    job_id = background_jobs.submit('merge_products', storage.merge_products, store_ids)
+    return make_response(jsonify({'job_id': job_id}), 202)
+
+
+def encode_cursor(key):
+    """
+    Encodes the keyset of the last product of a page as an opaque cursor
+    """
+    return urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decodes a cursor produced by encode_cursor, aborting on malformed cursors
+    """
+    try:
+        key = json.loads(urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        abort(400, description="Invalid cursor")
+    if type(key) is not list or len(key) != 2:
+        abort(400, description="Invalid cursor")
+    return key
+
+
+def products_page(**kwargs):
+    """
+    Builds a keyset paginated list of the products matching kwargs
+
+    Query string parameters:
+        page_size: number of products per page (1 to max_page_size)
+        order: 'id' or 'name'
+        cursor: the X-Next-Cursor header of the previous page
+    The total count is returned in X-Total-Count and the next page in
+    X-Next-Cursor and the Link header.
+    """
+    size = request.args.get('page_size', page_size, type=int)
+    size = max(1, min(size, max_page_size))
+    order = request.args.get('order', 'id')
+    if order not in orderings:
+        abort(400, description="order must be one of {}".format(", ".join(orderings)))
+    cursor = request.args.get('cursor')
+    after = decode_cursor(cursor) if cursor else None
+    products = storage.page(Product, order_by=order, after=after, limit=size, **kwargs)
+    stats = storage.price_stats([i.id for i in products])
+    list_products = []
+    for i in products:
+        z = i.to_dict()
+        price_stats = dict(stats[i.id])
+        if price_stats['last_change'] is not None:
+            price_stats['last_change'] = price_stats['last_change'].isoformat()
+        z.update({'price_count':price_stats['count'], 'price_stats':price_stats})
+        list_products.append(z)
+    response = make_response(jsonify(list_products), 200)
+    response.headers['X-Total-Count'] = str(storage.count(Product, **kwargs))
+    if len(products) == size:
+        last = products[-1]
+        next_cursor = encode_cursor([getattr(last, order), last.id])
+        response.headers['X-Next-Cursor'] = next_cursor
+        next_url = url_for(request.endpoint, cursor=next_cursor, page_size=size,
+                           order=order, **request.view_args)
+        response.headers['Link'] = '<{}>; rel="next"'.format(next_url)
+    return response
+
+
 @api_views.route('/products/', methods=['GET','PUT'],
                  strict_slashes=False)
 #@swag_from('documentation/product/products_by_store.yml', methods=['GET'])
+@cached
 def all_products():
     """
-    Retrieves the list of all products objects
+    Retrieves one page of all products objects
     """
-    print(request.get_json('page'))
-    data = request.get_json()
-    if data is not None:
-        page = data.get('page',None)
-        list_products = []
-    for i in storage.all(Product).values():
-        z = i.to_dict()
-        z.update({'latest_price':dictify(i.latest_price), 'price_count':i.price_count})
-        list_products.append(z)
-    if page is not None and type(page) == int and page*page_size < len(list_products) and page >=1 :
-        list_products = list_products[(page-1)*page_size:(page)*page_size]
-    else:
-        list_products = list_products[:page_size]
-    return jsonify(list_products)
+    return products_page()
 
 @api_views.route('/stores/<store_id>/products/', methods=['GET','PUT'],
                  strict_slashes=False)
 #@swag_from('documentation/product/products_by_store.yml', methods=['GET'])
+@cached
 def get_products(store_id):
     """
-    Retrieves the list of all products objects
-    of a specific Store, or a specific product
+    Retrieves one page of the products objects
+    of a specific Store
     """
-    list_products = []
     store = storage.get(Store, id = store_id)
     if not store:
         abort(404, "Store Not Found")
-    store = store[0]
-    data = request.get_json()
-    if data is not None:
-        page = data.get('page',None)
-    list_products = []
-    for i in store.products:
-        z = i.to_dict()
-        z.update({'latest_price':dictify(i.latest_price), 'price_count':i.price_count})
-        list_products.append(z)
-    if page is not None and type(page) == int and page*page_size < len(list_products) and page >=1 :
-        list_products = list_products[(page-1)*page_size:(page)*page_size]
-    else:
-        list_products = list_products[:page_size]
-    return jsonify(list_products)
+    return products_page(store_id=store[0].id)
 
 @api_views.route('/stores_name/<store_name>/products/', methods=['GET','PUT'],
                  strict_slashes=False)
 #@swag_from('documentation/product/products_by_store_name.yml', methods=['GET'])
+@cached
 def get_products_by_name(store_name):
     """
-    Retrieves the list of all products objects
-    of a specific Store, or a specific product
+    Retrieves one page of the products objects
+    of a specific Store
     """
-    list_products = []
     store = storage.get(Store, name = store_name)
     if not store:
         abort(404, "Store Not Found")
-    store = store[0]
-    data = request.get_json()
-    if data is not None:
-        page = data.get('page',None)
-    list_products = []
-    for i in store.products:
-        z = i.to_dict()
-        z.update({'latest_price':dictify(i.latest_price), 'price_count':i.price_count})
-        list_products.append(z)
-    if page is not None and type(page) == int and page*page_size < len(list_products) and page >=1 :
-        list_products = list_products[(page-1)*page_size:(page)*page_size]
-    else:
-        list_products = list_products[:page_size]
-    return jsonify(list_products)
+    return products_page(store_id=store[0].id)
 
 @api_views.route('/products/<product_id>/', methods=['GET'], strict_slashes=False)
 #@swag_from('documentation/product/get_product.yml', methods=['GET'])
+@cached
 def get_product(product_id):
     """
     Retrieves a specific product based on id
@@ -147,8 +188,7 @@ def delete_product(product_id):
 
     if not product:
         abort(404, "Product Not Found")
-    storage.delete(product[0])
-    storage.save()
+    storage.bulk_delete(Product, [product_id])
 
     return make_response(jsonify({}), 200)
 
@@ -226,5 +266,5 @@ def put_product(product_id):
         if key not in ignore:
             if key in product_tp.keys() and type(value) == product_tp[key]:
                 setattr(product, key, value)
-    storage.save()
+    product.save()
     return make_response(jsonify(product.to_dict()), 200)
\ No newline at end of file
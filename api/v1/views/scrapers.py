@@ -5,13 +5,13 @@
    Naivas
    QuickMart
 """
-from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from difflib import SequenceMatcher
 
-from flask import abort, jsonify, request
+from flask import abort, jsonify, make_response, request
 
-from models import storage
+from models import storage, storage_t
+from models.engine.ingest_queue import IngestQueue, QueueFull
+from models.engine.similarity import SimilarityIndex, similarity_score
 from models.price import Price
 from models.product import Product
 from models.store import Store
@@ -19,11 +19,14 @@ from models.store import Store
 from api.v1.views import api_views
 from logger import logHandler
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
-# DOCS https://docs.python.org/3/library/concurrent.futures.html#concurrent.futures.ThreadPoolExecutor
-executor = ThreadPoolExecutor(3)
+# Durable queue consumed by ingest_worker.py processes
+ingest_queue = IngestQueue()
+# Seconds a client should wait before retrying when the queue is full
+retry_after = int(os.getenv('FLAYERFX_QUEUE_RETRY_AFTER', 30))
+# Name trigram matrices of the stores used by /products/<id>/similar
+similarity_index = SimilarityIndex()
 
 data_structure = """
     {
@@ -48,7 +51,9 @@ def threaded_database_updater(crt):
     Inserts the scraped data into the database.
 
     This function processes the scraped data contained in the `crt` dictionary and updates the database accordingly. 
-    It handles both new and existing products and their prices, ensuring that the latest prices are stored.
+    The store is fetched or created, then all items are handed to `storage.bulk_ingest`, which resolves the
+    products by reference, bumps the fetched_at of unchanged latest prices and inserts new products and prices
+    with batched statements in a single transaction.
 
     Args:
         crt (dict): A dictionary containing the scraped data. Expected keys are:
@@ -61,13 +66,13 @@ def threaded_database_updater(crt):
                 - 'item_link' (str, optional): The link to the product.
                 - 'item_reference' (str, optional): The reference identifier for the product.
 
+    Returns:
+        dict or None: The ingestion report of `storage.bulk_ingest`, or None if the ingestion failed.
+
     Logs:
         - Debug logs for the start and end of the scraping process.
-        - Debug logs for the number of items being processed.
-        - Error logs for any exceptions encountered during the processing of products and prices.
-
-    Raises:
-        Exception: If there is an error during the bulk addition of products or prices to the database.
+        - Info logs with the ingestion counts and wall times.
+        - Error logs for any exceptions encountered during the ingestion.
     """
     store_name = crt.get('store')
     logHandler.debug(f"Started {store_name} Scraper")
@@ -83,63 +88,20 @@ def threaded_database_updater(crt):
         logHandler.debug(f"Store {store_name} found")
         store_obj = store_obj[0]
     
-    # Fetch existing products
-    try:
-        prs = crt.get('prices', [])
-        logHandler.debug(f"Fetching existing products for store {store_name}")
-        references = [int(i['item_reference']) for i in prs]
-        logHandler.debug(f"Fetching products with references: {references}")
-        all_know_products = store_obj.get_by_reference(references)
-        logHandler.debug(f"Found {len(all_know_products)} out of {len(prs)} existing products for store {store_name}")
-        products = {int(i.reference): i for i in all_know_products}
-    except Exception as e:
-        logHandler.error(f"An error occurred while fetching existing products: {repr(e)}")
-        return
-    # Process prices
-    new_prices = []
-    new_products = []
+    prs = crt.get('prices', [])
     logHandler.debug(f"Processing {len(prs)} items")
-    for item in prs:
-        logHandler.debug(f"Processing item: {item['item_name']} with reference: {item['item_reference']}")
-        if products.get(item['item_reference'], None) is not None:
-            logHandler.debug(f"Item {item['item_name']} exists in the database")
-            try:
-                lp = products[item['item_reference']].latest_price
-                if lp is not None and lp.amount == item['item_price'] and lp.fetched_at < item.get('fetched_at', datetime.now()):
-                    logHandler.debug(f"Updating latest price for item {item['item_name']}")
-                    lp.update(item.get('fetched_at', datetime.now()))
-                    lp.save()
-                else:
-                    logHandler.debug(f"Adding new price for existing item {item['item_name']}")
-                    newprice = Price(product_id=products[item['item_reference']].id,
-                                     amount=item['item_price'], is_discount=item['item_discount'] is not None)
-                    new_prices.append(newprice)
-            except Exception as e:
-                logHandler.error(f"An error occurred while trying to import the product price: {item['item_name']} for an existing product\n{repr(e)}")
-        else:
-            logHandler.debug(f"Item {item['item_name']} does not exist in the database, creating new product")
-            try:
-                newproduct = Product(store_id=store_obj.id, link=item['item_link'],
-                                     name=item['item_name'], reference=item['item_reference'])
-                new_products.append(newproduct)
-                newprice = Price(product_id=newproduct.id,
-                                 amount=item['item_price'], is_discount=item['item_discount'] is not None)
-                new_prices.append(newprice)
-            except Exception as e:
-                storage.rollback()
-                logHandler.error(f"An error occurred while trying to import the product price: {item['item_name']} for a new product\n{repr(e)}")
-    
-    # Bulk add new products and prices
     try:
-        logHandler.debug(f"Bulk adding {len(new_products)} products to {store_name}")
-        storage.new(new_products)
-        logHandler.debug(f"Bulk adding {len(new_prices)} prices to {store_name}")
-        storage.new(new_prices)
-        storage.save()
+        stats = storage.bulk_ingest(store_obj.id, prs)
     except Exception as e:
-        logHandler.error(f"An error occurred while attempting to bulk add the products:\n{repr(e)}")
-    
+        logHandler.error(f"An error occurred while attempting to bulk ingest the products of {store_name}:\n{repr(e)}")
+        return None
+    for number, batch in enumerate(stats['batches'], 1):
+        logHandler.debug(f"{store_name} batch {number}: {batch}")
+    logHandler.info(f"Ingested {stats['items']} items for {store_name} in {stats['seconds']}s: "
+                    f"{stats['products_created']} new products, {stats['prices_created']} new prices, "
+                    f"{stats['prices_bumped']} prices bumped, {stats['skipped']} skipped")
     logHandler.debug(f"Finished {store_name} Scraper")
+    return stats
 
 def ValidAPIKEY(apiKey):
     """
@@ -195,21 +157,27 @@ def ValidateScrapeJSON(crt):
 @api_views.route('/generic_scrape', methods=['GET', 'POST'], strict_slashes=False)
 def generic_scrape():
     """
-    Retrieves the number of each objects by type.
+    Queues a scrape payload for ingestion.
 
     This function handles a request to scrape data based on a JSON payload.
     It performs the following steps:
     1. Logs the request initiation.
     2. Retrieves and validates the JSON payload from the request.
     3. If the payload is invalid or not present, it logs the error and aborts the request with a 400 status code.
-    4. If the payload is valid, it submits the data to a thread pool for processing.
-    5. Returns an empty JSON response.
+    4. If the payload is valid, it is stored in the durable ingestion queue, keyed by the
+       `Idempotency-Key` header or by the payload hash, for the ingest workers to process.
+       With the JSON storage, whose file only the API process may write, it is ingested
+       right away instead.
+    5. Returns the ID of the queued job.
 
     Returns:
-        Response: An empty JSON response.
+        Response: A 202 JSON response with the job ID and whether the payload was a duplicate,
+                  or with the JSON storage a 200 JSON response with the ingestion report.
 
     Raises:
         400: If the request does not contain a valid JSON payload.
+        500: If the ingestion failed, with the JSON storage.
+        503: If the ingestion queue is full. The response carries a Retry-After header.
     """
     logHandler.debug("Request made to Scarper")
     crt = request.get_json()
@@ -220,9 +188,39 @@ def generic_scrape():
     if validationResponse != 0:
         logHandler.debug("Request recieved JSON was not valid.")
         abort(400, description=f"Not a valid JSON. Expected structure:{data_structure}")    
-    logHandler.debug("JSON sent to thread pool")
-    executor.submit(threaded_database_updater, crt)
-    return jsonify({})
+    payload = {key: value for key, value in crt.items() if key != 'api_key'}
+    if 'db' not in storage_t:
+        stats = threaded_database_updater(payload)
+        if stats is None:
+            abort(500, description="Ingestion failed")
+        stats.pop('batches', None)
+        return make_response(jsonify({'job_id': None, 'duplicate': False, 'result': stats}), 200)
+    try:
+        job_id, created = ingest_queue.enqueue(payload, request.headers.get('Idempotency-Key'))
+    except QueueFull as e:
+        logHandler.warning(f"Rejected scrape of {crt['store']}: {e}")
+        response = make_response(jsonify({'error': "Ingestion queue is full"}), 503)
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+    logHandler.debug(f"JSON sent to ingestion queue as job {job_id} (new: {created})")
+    return make_response(jsonify({'job_id': job_id, 'duplicate': not created}), 202)
+
+@api_views.route('/ingest_jobs/<int:job_id>', methods=['GET'], strict_slashes=False)
+def get_ingest_job(job_id):
+    """
+    Retrieves the status of a queued scrape ingestion
+    """
+    job = ingest_queue.get(job_id)
+    if job is None:
+        abort(404, "Job Not Found")
+    return jsonify(job)
+
+@api_views.route('/ingest_jobs', methods=['GET'], strict_slashes=False)
+def ingest_queue_stats():
+    """
+    Retrieves the number of queued scrape ingestions by status
+    """
+    return jsonify(ingest_queue.stats())
 
 def calculate_similarity_score(product1, product2):
     """
@@ -233,43 +231,36 @@ def calculate_similarity_score(product1, product2):
     Returns:
         float: A similarity score where a higher score indicates greater similarity.
     """
-    name_similarity = SequenceMatcher(None, product1['name'], product2['name']).ratio()
-    if product1['latest_price'] is None or product2['latest_price'] is None:
-        return name_similarity
-    price_difference = abs(product1['latest_price']['amount'] - product2['latest_price']['amount'])
-    
-    # Adjust the weight of name similarity and price difference as needed
-    score = name_similarity - (price_difference / max(product1['latest_price']['amount'], product2['latest_price']['amount']))
-    return score
+    amount1 = product1['latest_price']['amount'] if product1['latest_price'] else None
+    amount2 = product2['latest_price']['amount'] if product2['latest_price'] else None
+    return similarity_score(product1['name'], amount1, product2['name'], amount2)
 
-def find_similar_products(product, stores, threshold=0.5):
+def find_similar_products(product, stores, threshold=0.5, limit=10):
     """
     Find similar products in specified stores based on name and price.
     
+    Every store is scored at once against its cached name trigram matrix, and
+    the best candidates are rescored with `calculate_similarity_score` semantics.
+    
     :param product: The product to find similar products for.
     :param stores: List of stores to search in.
     :param threshold: The minimum score to consider a product as similar.
-    :return: A list of similar products.
+    :param limit: The maximum number of similar products per store.
+    :return: A dictionary mapping store names to the similar products, best first.
     """
     similar_products = {}
-    
-    def find_similar_products_in_store(store_name, s_products, product, threshold):
-        similar_products = []
-        logHandler.debug(f"Finding similar products for {product} in {store_name}")
-        # Use a list comprehension for faster execution
-        similar_products = [
-            other_product for other_product in s_products
-            if (score := calculate_similarity_score(product, other_product)) >= threshold
-        ]
-        logHandler.debug(f"Found {len(similar_products)} similar products in {store_name}")
-        return store_name, similar_products
-
-    with ThreadPoolExecutor() as executor:
-        future_to_store = {executor.submit(find_similar_products_in_store, store.name, list([i.to_dict() for i in store.products]) , product, threshold): store for store in stores}
-        for future in as_completed(future_to_store):
-            store_name, similar_products_list = future.result()
-            similar_products[store_name] = similar_products_list
-
+    for store in stores:
+        logHandler.debug(f"Finding similar products for {product.name} in {store.name}")
+        matches = similarity_index.matrix(store.id).top(product.name, product.latest_amount,
+                                                         limit, threshold, exclude=product.id)
+        similar_products[store.name] = []
+        for product_id, score in matches:
+            match = storage.get(Product, id=product_id)
+            if match:
+                match = match[0].to_dict()
+                match['similarity_score'] = round(score, 4)
+                similar_products[store.name].append(match)
+        logHandler.debug(f"Found {len(similar_products[store.name])} similar products in {store.name}")
     return similar_products
 
 @api_views.route('/products/<product_id>/similar', methods=['GET'])
@@ -277,6 +268,9 @@ def get_similar_products_in_other_stores(product_id):
     """
     Get similar products in other stores based on name and price.
     
+    The `limit` (default 10, at most 100) and `threshold` (default 0.5) query
+    parameters bound the number and the score of the products per store.
+    
     :param product_id: The ID of the product to find similar products for.
     :return: A dictionary mapping store names to similar products.
     """
@@ -284,9 +278,9 @@ def get_similar_products_in_other_stores(product_id):
     if not product:
         abort(404, "{Product not found}")
     product = product[0]
-    stores = list(storage.all(Store).values())
-    stores.remove(product.store)
-    product = product.to_dict()
-    similar_products = find_similar_products(product, stores)
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    threshold = request.args.get('threshold', 0.5, type=float)
+    stores = [store for store in storage.all(Store).values() if store.id != product.store_id]
+    similar_products = find_similar_products(product, stores, threshold, limit)
     
     return jsonify(similar_products)
\ No newline at end of file
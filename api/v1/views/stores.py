@@ -1,14 +1,18 @@
 #!/usr/bin/python3
 """ objects that handle all default RestFul API actions for Store """
 from models.store import Store
+from models.product import Product
 from models import storage
+from models.engine.jobs import BACKGROUND_DELETE, background_jobs
 from api.v1.views import api_views
+from api.v1.cache import cached
 from flask import abort, jsonify, make_response, request
 from flasgger.utils import swag_from
 
 
 @api_views.route('/stores', methods=['GET'], strict_slashes=False)
 #@swag_from('documentation/store/all_stores.yml')
+@cached
 def all_stores():
     """
     Retrieves the list of all store objects
@@ -23,6 +27,7 @@ def all_stores():
 
 @api_views.route('/stores/<store_id>/', methods=['GET'], strict_slashes=False)
 #@swag_from('documentation/store/get_store.yml', methods=['GET'])
+@cached
 def get_store(store_id):
     """
     Retrieves an store
@@ -38,14 +43,18 @@ def get_store(store_id):
 #@swag_from('documentation/store/delete_store.yml', methods=['DELETE'])
 def delete_store(store_id):
     """
-    Deletes a store Object
+    Deletes a store Object with its products and their prices
+    A store with many products is deleted by a background job
+    whose ID is returned with a 202
     """
     store = storage.get(Store, id = store_id)
     if not store:
         abort(404)
 
-    storage.delete(store[0])
-    storage.save()
+    if storage.count(Product, store_id=store_id) > BACKGROUND_DELETE:
+        job_id = background_jobs.submit('delete_store', storage.bulk_delete, Store, [store_id])
+        return make_response(jsonify({'job_id': job_id}), 202)
+    storage.bulk_delete(Store, [store_id])
 
     return make_response(jsonify({}), 200)
 
@@ -91,5 +100,5 @@ def put_store(store_id):
     for key, value in data.items():
         if key not in ignore:
             setattr(store, key, value)
-    storage.save()
+    store.save()
     return make_response(jsonify(store.to_dict()), 200)
\ No newline at end of file
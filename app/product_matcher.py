@@ -1,22 +1,220 @@
-from models import storage
-from models.product import Product
-from models.store import Store
-
-def update_all_product_relations():
-    """Updates product relations for all products."""
-    all_products = storage.all(Product).values()
-    all_stores = storage.all(Store).values()
-    
-    for product in all_products:
-        potential_matches = []
-        for store in all_stores:
-            if store.id != product.store_id:
-                # This is a simple example. You might want to use more sophisticated
-                # methods to find potential matches, such as text similarity on product names.
-                store_products = store.products
-                potential_matches.extend(store_products)
-        
-        Product.update_product_relations(product, potential_matches)
-
-# Run this function periodically, e.g., daily or weekly
-update_all_product_relations()
+#!/usr/bin/python3
+"""
+Module: product_matcher
+This module matches the products of different stores and stores the pairs
+as ProductRelation objects. Instead of comparing every product with every
+product of the other stores, a token inverted index over the normalized
+product names picks a small set of candidates for each product, optionally
+restricted to a price band, and only those are scored.
+Classes:
+    CandidateIndex: Token inverted index returning the matching candidates of a product.
+Public Functions:
+    in_price_band(product1, product2, price_band): Checks whether two latest prices are close enough.
+    update_all_product_relations(since=None, threshold=0.7, price_band=None, max_candidates=50):
+        Scores the candidates of the products and writes the relations in bulk.
+    main(): Parses the command line and runs the matching.
+Usage:
+    Run it periodically, e.g. daily, with --since last to only match the
+    products created or edited since the previous run.
+    Example:
+        $ python -m app.product_matcher
+        $ python -m app.product_matcher --since last --price-band 0.5
+Environment Variables:
+    FLAYERFX_MATCHER_STATE: File holding the start time of the last run. Defaults to "product_matcher.state".
+"""
+
+import argparse
+from datetime import datetime
+import heapq
+import os
+from time import perf_counter
+
+# File holding the start time of the last run, read by --since last
+STATE_PATH = os.getenv('FLAYERFX_MATCHER_STATE', 'product_matcher.state')
+
+
+def in_price_band(product1, product2, price_band):
+    """
+    Checks whether the latest prices of two products are within a price band.
+
+    Args:
+        product1 (Product): A product.
+        product2 (Product): The other product.
+        price_band (float): The allowed relative difference, e.g. 0.5 lets the
+                            higher price be up to 1.5 times the lower one.
+
+    Returns:
+        bool: True if the prices are close enough or one of them is unknown.
+    """
+    if not product1.latest_amount or not product2.latest_amount:
+        return True
+    low, high = sorted((product1.latest_amount, product2.latest_amount))
+    return high <= low * (1 + price_band)
+
+
+class CandidateIndex:
+    """
+    CandidateIndex class mapping the name tokens of products to the products holding them.
+    Attributes:
+        products (dict): The indexed products by ID.
+        tokens (dict): The name tokens of each product by ID.
+        postings (dict): The IDs of the products holding each token.
+        max_postings (int): Tokens held by more products are too common to select candidates.
+        tokenize (function): Returns the tokens of a product name.
+    Methods:
+        candidates(product, price_band=None, limit=50): Returns the candidates of a product.
+    """
+
+    def __init__(self, products, max_share=0.05, min_postings=50):
+        """
+        Builds the index.
+
+        Args:
+            products (iterable): The products to index.
+            max_share (float, optional): Share of the products above which a token is too common.
+            min_postings (int, optional): Number of products under which a token is never too common.
+        """
+        from models.engine.matchscore import name_tokens
+        self.tokenize = name_tokens
+        self.products = {}
+        self.tokens = {}
+        self.postings = {}
+        for product in products:
+            tokens = self.tokenize(product.name)
+            self.products[product.id] = product
+            self.tokens[product.id] = tokens
+            for token in tokens:
+                self.postings.setdefault(token, []).append(product.id)
+        self.max_postings = max(min_postings, int(len(self.products) * max_share))
+
+    def candidates(self, product, price_band=None, limit=50):
+        """
+        Returns the products of other stores sharing name tokens with a product.
+
+        Candidates are ranked by the sum of the inverse posting sizes of the
+        tokens they share, so sharing a rare word counts more than sharing a
+        common one. Tokens that are too common are skipped, unless the product
+        has no other token, in which case its rarest token is used.
+
+        Args:
+            product (Product): The product to find candidates for.
+            price_band (float, optional): If given, candidates must pass `in_price_band`.
+            limit (int, optional): The maximum number of candidates.
+
+        Returns:
+            list: The candidate products, best ranked first.
+        """
+        tokens = self.tokens.get(product.id)
+        if tokens is None:
+            tokens = self.tokenize(product.name)
+        postings = sorted((self.postings[token] for token in tokens if token in self.postings), key=len)
+        usable = [ids for ids in postings if len(ids) <= self.max_postings] or postings[:1]
+        scores = {}
+        for ids in usable:
+            weight = 1.0 / len(ids)
+            for other_id in ids:
+                scores[other_id] = scores.get(other_id, 0.0) + weight
+        found = []
+        for other_id, score in scores.items():
+            other = self.products[other_id]
+            if other.store_id == product.store_id:
+                continue
+            if price_band is not None and not in_price_band(product, other, price_band):
+                continue
+            found.append((score, other_id))
+        if limit:
+            found = heapq.nlargest(limit, found)
+        else:
+            found.sort(reverse=True)
+        return [self.products[other_id] for score, other_id in found]
+
+
+def update_all_product_relations(since=None, threshold=0.7, price_band=None, max_candidates=50):
+    """
+    Updates the product relations of all products, or of the products changed since a date.
+
+    Every product is only scored against its candidates from the index, each
+    pair is scored once per run, and the new and updated relations are
+    written with a single bulk insert and save.
+
+    Args:
+        since (datetime, optional): Only match products created or updated after this date.
+        threshold (float, optional): Minimum similarity score to create a relation.
+        price_band (float, optional): The price band of `in_price_band` applied to candidates.
+        max_candidates (int, optional): The maximum number of candidates scored per product.
+
+    Returns:
+        dict: The number of products, matched products, comparisons and written relations,
+              and the seconds the run took.
+    """
+    from models import storage
+    from models.product import Product
+    from models.product_relation import ProductRelation
+
+    started = perf_counter()
+    products = list(storage.all(Product).values())
+    index = CandidateIndex(products)
+    if since is None:
+        targets = products
+    else:
+        targets = [product for product in products
+                   if (product.created_at and product.created_at >= since) or
+                   (product.updated_at and product.updated_at >= since)]
+    existing = {Product.relation_key(r.product_id, r.related_product_id): r
+                for r in storage.all(ProductRelation).values()}
+    evaluated = set()
+    relations = []
+    comparisons = 0
+    for product in targets:
+        matches = []
+        for candidate in index.candidates(product, price_band, max_candidates):
+            key = Product.relation_key(product.id, candidate.id)
+            if key not in evaluated:
+                evaluated.add(key)
+                matches.append(candidate)
+        comparisons += len(matches)
+        relations.extend(Product.update_product_relations(product, matches, threshold,
+                                                          existing=existing, commit=False))
+    if relations:
+        storage.new(relations)
+    # Also saves the relations deleted for falling below the threshold
+    storage.save()
+    return {'products': len(products), 'matched': len(targets), 'comparisons': comparisons,
+            'relations': len(relations), 'seconds': round(perf_counter() - started, 4)}
+
+
+def main():
+    """
+    Parses the command line, runs the matching and records the start time of the run.
+    """
+    parser = argparse.ArgumentParser(description="FLAYERFX cross-store product matching")
+    parser.add_argument('--since', default=None,
+                        help="only match products changed after this ISO date, or 'last' for the previous run")
+    parser.add_argument('--threshold', type=float, default=0.7, help="minimum similarity of a relation")
+    parser.add_argument('--price-band', type=float, default=None,
+                        help="maximum relative difference of the latest prices of candidates")
+    parser.add_argument('--max-candidates', type=int, default=50, help="candidates scored per product")
+    args = parser.parse_args()
+
+    from logger import init_logger
+    # The storage engines log through logHandler, which has to exist before models is imported
+    init_logger(None)
+    from models.base_model import parse_time
+
+    since = None
+    if args.since == 'last':
+        if os.path.exists(STATE_PATH):
+            with open(STATE_PATH) as f:
+                since = parse_time(f.read().strip())
+    elif args.since:
+        since = parse_time(args.since)
+    run_started = datetime.utcnow()
+    stats = update_all_product_relations(since, args.threshold, args.price_band, args.max_candidates)
+    with open(STATE_PATH, 'w') as f:
+        f.write(run_started.isoformat())
+    print(f"Matched {stats['matched']} of {stats['products']} products with {stats['comparisons']} "
+          f"comparisons, wrote {stats['relations']} relations in {stats['seconds']}s")
+
+
+if __name__ == '__main__':
+    main()
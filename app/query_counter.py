@@ -0,0 +1,41 @@
+#!/usr/bin/python3
+"""
+Module: query_counter
+This module counts the SQL statements executed by each request of a Flask
+application. The count is logged at the end of the request, as a warning
+above FLAYERFX_QUERY_WARN statements, and returned in the X-Query-Count header.
+Public Functions:
+    count_queries(app): Registers the request hooks counting the statements on an application.
+Usage:
+    from app.query_counter import count_queries
+    count_queries(app)
+"""
+from flask import request
+
+from logger import logHandler
+from models.engine.query_counter import query_counter
+
+
+def count_queries(app):
+    """
+    Registers the request hooks counting the SQL statements of every request.
+
+    Args:
+        app (Flask): The application.
+    """
+    @app.before_request
+    def start_counting_queries():
+        """ Start counting the statements of the request """
+        query_counter.start()
+
+    @app.after_request
+    def log_query_count(response):
+        """ Log the number of statements of the request """
+        count = query_counter.stop()
+        message = f"{request.method} {request.path} ran {count} SQL statements"
+        if count > query_counter.threshold:
+            logHandler.warning(message)
+        else:
+            logHandler.debug(message)
+        response.headers['X-Query-Count'] = str(count)
+        return response
@@ -1,17 +1,19 @@
 
-var count = 1;
-async function getContent(url, data)
+var cursor = null;
+var lastPage = false;
+async function getContent(url)
 {
     let response = await fetch(url, {
-        method: "PUT",
+        method: "GET",
         headers: {
-            "Content-type": "application/json"
-        },
-        data:data
+            "Accept": "application/json"
+        }
     });
     if(response.ok)
     {
         console.log("Got it");
+        cursor = response.headers.get("X-Next-Cursor");
+        lastPage = cursor === null;
         let jso = await response.json();
         console.log(jso);
         renderproducts(jso);
@@ -55,9 +57,12 @@ function renderproducts(products)
 }
 async function loadContent()
 {
-    data = {};
-    data.page = count;
-    console.log(data);
-        await  getContent(document.getElementById("api_products_in_store_url").innerText, data);
-        count++;
+    if (lastPage) {
+        return;
+    }
+    var url = document.getElementById("api_products_in_store_url").innerText;
+    if (cursor !== null) {
+        url += "?cursor=" + encodeURIComponent(cursor);
+    }
+    await getContent(url);
 }
\ No newline at end of file
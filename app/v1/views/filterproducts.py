@@ -32,18 +32,19 @@ def sort_products(product):
     fetched date of the latest price and the product's name. If the product 
     does not have a latest price, it returns a tuple with a default date 
     (January 1, 1970) and the product's name, ensuring such products are 
-    sorted at the end.
+    sorted at the end. The date is read from the latest price snapshot so
+    no price is loaded.
 
     Args:
         product (object): The product object to be sorted. It is expected 
-                          to have 'latest_price' and 'name' attributes.
+                          to have 'latest_fetched_at' and 'name' attributes.
 
     Returns:
         tuple: A tuple containing the fetched date of the latest price 
                (or a default date if no latest price) and the product's name.
     """
-    if product.latest_price is not None:
-        return product.latest_price.fetched_at, product.name
+    if product.latest_fetched_at is not None:
+        return product.latest_fetched_at, product.name
     else:
         # if not latest price, should be at the end
         return datetime(1970, 1, 1), product.name
@@ -89,9 +90,10 @@ def search_product():
         if form.validate_on_submit():
             products = []
             if form.product_stores.data == 0:
-                products = storage.search(Product, name=form.search_string.data)
+                products = storage.search(Product, load=('store',), name=form.search_string.data)
             else:
-                products = storage.search(Product, store_id=form.product_stores.data, name=form.search_string.data)
+                products = storage.search(Product, load=('store',), store_id=form.product_stores.data,
+                                          name=form.search_string.data)
             if products is not None:
                 logHandler.info("No of Products found: {}".format(len(products)))
                 #Use the names of the stores in choices to make a dictionary of lists
@@ -113,8 +115,10 @@ def todays_discount_product():
     """
     Retrieves the list of all products on discount today.
 
-    This function fetches all products from the storage and renders them
-    on the 'user/list_products.html' template.
+    This function reads the materialized daily deals of yesterday and today,
+    which hold the product name, deal price and rolling average, and the
+    price range and last change of their products in one batch, and renders
+    them on the 'user/list_products_deals.html' template.
 
     Returns:
         A rendered HTML template displaying the list of products on discount.
@@ -122,11 +126,10 @@ def todays_discount_product():
     splitProducts = { store.id:{ "store": store, "products": [] } for store in storage.all(Store).values() }
     yesterday = datetime.today().date() - timedelta(days=1)
     tommorow = datetime.today().date() + timedelta(days=1)
-    prices = storage.get_recent_discounted_prices(yesterday, tommorow)
-    logHandler.info("No of Prices found: {}".format(len(prices)))
-    for price in prices:
-        product = price.product
-        setattr(product, 'deal_price', price)
-        setattr(product, 'roll_avg', product.rolling_avg())
-        splitProducts[product.store_id]["products"].append(product)
-    return render_template('user/list_products_deals.html', splitProducts = splitProducts, daterange = "Today", today=datetime.today())
\ No newline at end of file
+    deals = storage.get_daily_deals(yesterday, tommorow)
+    logHandler.info("No of Deals found: {}".format(len(deals)))
+    stats = storage.price_stats([deal.product_id for deal in deals])
+    for deal in deals:
+        if deal.store_id in splitProducts:
+            splitProducts[deal.store_id]["products"].append(deal)
+    return render_template('user/list_products_deals.html', splitProducts = splitProducts, stats = stats, daterange = "Today", today=datetime.today())
\ No newline at end of file
@@ -47,8 +47,9 @@ def about():
         Response: The rendered template for the About page.
     """    
     logHandler.debug("Request for About Page")
+    counts = storage.counts()
     cls = {}
-    for name, cl in classes.items():
-        cls[name] = storage.count(cl)
+    for name in classes:
+        cls[name] = counts.get(name, 0)
     logHandler.debug(f"Site Statisctics Retrieved: {cls}")
     return render_template("user/about.html", cls=cls, storage_t=storage_t)
@@ -33,6 +33,9 @@ from models.product import Product
 from models.store import Store
 from flask import request
 
+# Number of orphaned prices listed per page
+orphans_per_page = 100
+
 @app_views.route('/prices', methods=['GET'], strict_slashes=False)
 @app_views.route('/prices?<int:page>&<int:per_page>', methods=['GET'], strict_slashes=False)
 #TODO: Restrict this entry point
@@ -47,7 +50,7 @@ def all_prices(page=1, per_page=50):
         Response: Renders the 'user/list_prices.html' template with the paginated prices, 
                   total price count, current page, and items per page.
     """
-    all_prices = list(storage.all(Price).values())
+    all_prices = list(storage.all(Price, load=('product',)).values())
     prices = sorted(all_prices, key=lambda i: (i.product_id, i.fetched_at), reverse=True)
     
     start = (page - 1) * per_page
@@ -56,27 +59,30 @@ def all_prices(page=1, per_page=50):
     
     return render_template('user/list_prices.html', prices=paginated_prices, price_count=len(prices), page=page, per_page=per_page)
 
-@app_views.route('/orphaned/prices', methods=['GET', 'DELETE'], strict_slashes=False)
+@app_views.route('/orphaned/prices', methods=['GET', 'POST', 'DELETE'], strict_slashes=False)
 def orphaned_prices():
     """
-    Fetches all orphaned prices (prices without a corresponding product) and either displays them or deletes them.
-    If the request method is DELETE, the selected orphaned prices are deleted from the storage.
+    Fetches one page of orphaned prices (prices without a corresponding product) and either displays them or deletes them.
+    The page starts after the price ID given by the `after` query argument.
+    If the form is submitted, the selected orphaned prices, or all of them with the 'delete_all' action,
+    are deleted from the storage.
     Returns:
-        Response: Renders the 'user/orphaned_prices.html' template with the list of orphaned prices if the method is GET.
-                    Redirects to the orphaned prices view after deletion if the method is DELETE.
+        Response: Renders the 'user/orphaned_prices.html' template with the page of orphaned prices if the method is GET.
+                    Redirects to the orphaned prices view after deletion otherwise.
     """
-    all_prices = list(storage.all(Price).values())
-    orphaned_prices = [price for price in all_prices if storage.get(Product, id=price.product_id) is None]
-
-    if request.method == 'DELETE':
-        selected_price_ids = request.form.getlist('price_ids')
-        for price in orphaned_prices:
-            if str(price.id) in selected_price_ids:
-                price.delete()
-        storage.save()
+    if request.method != 'GET':
+        if request.form.get('action') == 'delete_all':
+            deleted = storage.delete_orphans(Price)
+        else:
+            deleted = storage.delete_orphans(Price, request.form.getlist('price_ids'))
+        logHandler.info(f"Deleted {deleted} orphaned prices")
         return redirect(url_for('app_views.orphaned_prices'))
 
-    return render_template('user/orphaned_prices.html', prices=orphaned_prices)
+    after = request.args.get('after')
+    prices = storage.orphans(Price, after=after, limit=orphans_per_page)
+    next_after = prices[-1].id if len(prices) == orphans_per_page else None
+    return render_template('user/orphaned_prices.html', prices=prices, total=storage.count_orphans(Price),
+                           next_after=next_after)
 
 
 @app_views.route('/stores/<store_id>/product/<product_id>/newprice', methods=['POST', 'GET'], strict_slashes=False)
@@ -188,6 +194,10 @@ def rud_price(store_id, product_id, price_id):
             if form.price_products.data != product_obj.id and form.price_products.data in \
                 [i[0] for i in choices]:
                     price_obj.product_id = form.price_products.data
+                    # The price may have been the latest price of the product it leaves
+                    product_obj.refresh_latest_price(ignore=[price_obj.id])
+                    product_obj.save()
+                    storage.get(Product, id=price_obj.product_id)[0].record_price(price_obj)
             price_obj.save()
         else:
             logHandler.warning("Form not valid")
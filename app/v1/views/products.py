@@ -1,8 +1,10 @@
 #!/usr/bin/python3
 """ objects that handles all default RestFul API actions for products """
+from models.base_model import parse_time
 from models.product import Product
 from models.store import Store
 from models import storage
+from models.engine.jobs import background_jobs
 from app.v1.forms import BaseProductForm
 from app.v1.views import app_views
 from flask import abort,redirect, render_template, request, url_for
@@ -10,6 +12,8 @@ from flasgger.utils import swag_from
 from datetime import datetime
 
 product_tp = {'link': str, 'name': str, 'reference': int}
+# Number of orphaned products listed per page
+orphans_per_page = 100
 
 @app_views.route('/products', methods=['GET'], strict_slashes=False)
 #@swag_from('documentation/product/products_by_store.yml', methods=['GET'])
@@ -20,7 +24,7 @@ def all_products():
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 100, type=int)
     
-    products = list(storage.all(Product).values())
+    products = list(storage.all(Product, load=('store',)).values())
     total = len(products)
     start = (page - 1) * per_page
     end = start + per_page
@@ -36,35 +40,29 @@ def all_products():
 @app_views.route('/orphaned/products', methods=['GET', 'POST'], strict_slashes=False)
 def orphaned_products():
     """
-    Retrieves the list of orphaned products (products without a valid store_id)
-    and allows updating or deleting them.
+    Retrieves one page of orphaned products (products without a valid store_id)
+    and allows assigning them to a store or deleting them.
+    The page starts after the product ID given by the `after` query argument.
     """
-    products = list(storage.all(Product).values())
-    stores = set([store.id for store in storage.all(Store).values()])
-    orphaned = [product for product in products if product.store_id not in stores]
-    
     if request.method == 'POST':
         action = request.form.get('action')
         selected_products = request.form.getlist('product_ids')
         if action == 'delete':
-            for product_id in selected_products:
-                product = storage.get(Product, id=product_id)
-                if product:
-                    product.delete()
-                    storage.save()
+            storage.delete_orphans(Product, selected_products)
+        elif action == 'delete_all':
+            storage.delete_orphans(Product)
         elif action == 'assign':
             new_store_id = request.form.get('store_id')
-            if new_store_id in stores:
-                for product_id in selected_products:
-                    product = storage.get(Product, id=product_id)
-                    if product:
-                        product.store_id = new_store_id
-                        product.save()
-                        storage.save()
+            if new_store_id and storage.get(Store, id=new_store_id):
+                storage.reassign_orphans(Product, selected_products, new_store_id)
         return redirect(url_for('app_views.orphaned_products'))
 
+    after = request.args.get('after')
+    orphaned = storage.orphans(Product, after=after, limit=orphans_per_page)
+    next_after = orphaned[-1].id if len(orphaned) == orphans_per_page else None
     all_stores = storage.all(Store).values()
-    return render_template('user/orphaned_products.html', products=orphaned, stores=all_stores)
+    return render_template('user/orphaned_products.html', products=orphaned, stores=all_stores,
+                           total=storage.count_orphans(Product), next_after=next_after)
 
 @app_views.route('/stores/<store_id>/newproduct', methods=['POST', 'GET'], strict_slashes=False)
 def create_product(store_id):
@@ -105,8 +103,7 @@ def rud_product(store_id, product_id):
     else:
         product_obj = product_obj[0]
     if '_method' in request.form.keys() and request.form['_method'] == 'DELETE':
-        product_obj.delete()
-        storage.save()
+        storage.bulk_delete(Product, [product_obj.id])
         return redirect(url_for('app_views.all_products'))
     if request.method == 'POST':
         if form.validate_on_submit():
@@ -122,54 +119,32 @@ def rud_product(store_id, product_id):
     form.product_link.data = product_obj.link
     form.product_stores.data = product_obj.store_id
     form.submit.label.text = "Save Changes"
-    prices=product_obj.prices_sorted
+    since = request.args.get('since')
+    if since:
+        # A long range also reads the prices moved to the archive
+        try:
+            prices = product_obj.price_history(since=parse_time(since))
+        except ValueError:
+            abort(400, "Invalid since date")
+    else:
+        prices = product_obj.prices_sorted
     return render_template('user/product_view.html', product=product_obj, prices=prices, today=datetime.today(), form=form)
 
 
-@app_views.route('/stores/<store_id>/merge_products', methods=['GET'])
+@app_views.route('/stores/<store_id>/merge_products', methods=['GET', 'POST'])
 def merge_products(store_id):
     """
     Merge products with the same reference number into one product entry
+    GET shows the dry run report, POST runs the merge as a background job,
+    see /api/v1/jobs
     """
     store_obj = storage.get(Store, id=store_id)
     if store_obj is None:
         abort(404, "Store not Found")
     store_obj = store_obj[0]
-    
-    products = store_obj.products
-    products_by_reference = {}
-    
-    for product in products:
-        if product.reference not in products_by_reference:
-            products_by_reference[product.reference] = []
-        products_by_reference[product.reference].append(product)
-    
-    from models.price import Price
-    changes_count = {
-        'prices_moved': 0,
-        'products_deleted': 0,
-        'prices_deleted': 0
-    }
-    count = 1
-    for reference, product_list in products_by_reference.items():
-        products_deleted = []
-        if len(product_list) > 1:
-            main_product = product_list[0]
-            for product in product_list[1:]:
-                for price in product.prices:
-                    price.product_id = main_product.id
-                    price.save()
-                    changes_count['prices_moved'] += 1
-                products_deleted.append(product.name)
-                product.delete()
-                changes_count['products_deleted'] += 1
-            main_product.save()
-            print(f"Merged products with reference {reference}: {changes_count}")
-            print(f"Products deleted: {products_deleted}")
-        print(f"Product number {count} of {len(products_by_reference)}")
-        count += 1
 
-    print(f"Total changes made: {changes_count}")
-    
-    storage.save()
-    return redirect(url_for('app_views.rud_store', store_id=store_id))
\ No newline at end of file
+    if request.method == 'POST':
+        background_jobs.submit('merge_products', storage.merge_products, [store_obj.id])
+        return redirect(url_for('app_views.rud_store', store_id=store_id))
+    report = storage.merge_products([store_obj.id], dry_run=True)
+    return render_template('user/merge_products.html', store=store_obj, report=report)
\ No newline at end of file
@@ -1,7 +1,9 @@
 #!/usr/bin/python3
 """ objects that handle all default RestFul API actions for Store """
 from models.store import Store
+from models.product import Product
 from models import storage
+from models.engine.jobs import BACKGROUND_DELETE, background_jobs
 from app.v1.forms import BaseStoreForm
 from app.v1.views import app_views
 from flask import abort, redirect, render_template ,request, url_for
@@ -42,8 +44,11 @@ def rud_store(store_id):
         abort(404, "Store not Found")
     store_obj = store_obj[0]
     if '_method' in request.form.keys() and request.form['_method'] == 'DELETE':
-        store_obj.delete()
-        storage.save()
+        # A large store keeps being deleted in the background after the redirect
+        if storage.count(Product, store_id=store_obj.id) > BACKGROUND_DELETE:
+            background_jobs.submit('delete_store', storage.bulk_delete, Store, [store_obj.id])
+        else:
+            storage.bulk_delete(Store, [store_obj.id])
         return redirect(url_for('app_views.all_stores'))
     form = BaseStoreForm()
     if request.method == 'POST':
@@ -61,10 +66,12 @@ def rud_store(store_id):
     start = (page - 1) * per_page
     end = start + per_page
     paginated_products = products[start:end]
+    stats = storage.price_stats([product.id for product in paginated_products])
 
     return render_template('user/store_view.html',\
                            store=store_obj,\
                            products=paginated_products,\
+                           stats=stats,\
                            form=form, page=page,\
                            per_page=per_page,\
                            total=total,\
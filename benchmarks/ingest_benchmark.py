@@ -0,0 +1,334 @@
+#!/usr/bin/python3
+"""
+Module: ingest_benchmark
+This module measures how scrape ingestion scales. It generates synthetic
+scrape payloads in the `data_structure` format of `api/v1/views/scrapers.py`
+and runs them through `ValidateScrapeJSON` and `threaded_database_updater`
+against the SQLite and JSON storage engines.
+Every engine runs in its own process, in an empty temporary directory, so it
+starts from an empty file.db/file.json and its peak RSS is its own.
+Public Functions:
+    make_catalogs(stores, products, seed): Generates the synthetic store catalogs.
+    make_payload(catalog, round_number, change_rate, discount_rate, rng): Builds one scrape payload.
+    run_engine(engine, args): Runs the benchmark of an engine in a child process.
+    run_child(args): Runs the benchmark in the current process.
+    compare(results, baseline): Prints the throughput change against a previous run.
+    main(): Parses the command line and runs the benchmark.
+Usage:
+    The first round creates the products; every following round changes the
+    price of a `--change-rate` fraction of them, the rest only bump the
+    fetched_at of their latest price.
+    Example:
+        $ python benchmarks/ingest_benchmark.py --stores 3 --products 5000 --rounds 4
+        $ python benchmarks/ingest_benchmark.py --engines json --output run.json --compare baseline.json
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+# Root of the repository, added to the path of the child processes
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Storage engines and the FLAYERFX_TYPE_STORAGE value selecting them
+ENGINES = {'sqlite': 'db_sqlite', 'json': 'json'}
+
+
+def make_catalogs(stores, products, seed=0):
+    """
+    Generates the synthetic store catalogs.
+
+    Args:
+        stores (int): The number of stores.
+        products (int): The number of products per store.
+        seed (int, optional): The seed of the random generator.
+
+    Returns:
+        list: One dictionary per store with its name and its products
+              (reference, name, link and current price).
+    """
+    rng = random.Random(seed)
+    catalogs = []
+    for number in range(stores):
+        items = []
+        for reference in range(1, products + 1):
+            items.append({'reference': 100000 + reference,
+                          'name': f"Benchmark product {number}-{reference} {rng.randint(1, 5) * 250}g",
+                          'link': f"https://store{number}.example.com/p/{reference}",
+                          'price': round(rng.uniform(20, 5000), 2)})
+        catalogs.append({'store': f"Benchmark Store {number}", 'items': items})
+    return catalogs
+
+
+def make_payload(catalog, round_number, change_rate, discount_rate, rng):
+    """
+    Builds the scrape payload of a store for one round.
+
+    From the second round on, a `change_rate` fraction of the products get a
+    new price. A `discount_rate` fraction of the items carry a discount.
+
+    Args:
+        catalog (dict): The catalog of the store, updated with the new prices.
+        round_number (int): The number of the round, starting at 0.
+        change_rate (float): The fraction of the products whose price changes.
+        discount_rate (float): The fraction of the items with a discount.
+        rng (random.Random): The random generator.
+
+    Returns:
+        dict: The payload in the `data_structure` format.
+    """
+    fetched_at = (datetime(2024, 1, 1) + timedelta(hours=round_number)).isoformat()
+    prices = []
+    for item in catalog['items']:
+        if round_number > 0 and rng.random() < change_rate:
+            item['price'] = round(item['price'] * rng.uniform(0.8, 1.2), 2)
+        price = {'item_name': item['name'],
+                 'item_link': item['link'],
+                 'item_price': item['price'],
+                 'item_reference': str(item['reference']),
+                 'fetched_at': fetched_at}
+        if rng.random() < discount_rate:
+            price['item_discount'] = round(item['price'] * 0.1, 2)
+        prices.append(price)
+    return {'store': catalog['store'],
+            'api_key': os.getenv('FLAYERFX_VALID_API_KEY', 'benchmark'),
+            'prices': prices}
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size of the current process.
+
+    Returns:
+        int or None: The peak RSS in kilobytes, or None where the resource module is missing.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def count_writes(storage):
+    """
+    Counts the commits and statements issued by the storage engine.
+
+    SQLAlchemy engines are counted through their commit and cursor events;
+    FileStorage is counted through its save method, which writes the file or journal.
+
+    Args:
+        storage: The storage engine instance.
+
+    Returns:
+        dict: The 'commits' and 'statements' counters, updated as the storage is used.
+    """
+    counters = {'commits': 0, 'statements': 0}
+    if 'db' in type(storage).__module__:
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        def on_commit(conn):
+            counters['commits'] += 1
+
+        def on_execute(conn, cursor, statement, parameters, context, executemany):
+            counters['statements'] += 1
+        event.listen(Engine, 'commit', on_commit)
+        event.listen(Engine, 'before_cursor_execute', on_execute)
+    else:
+        save = storage.save
+
+        def counted_save(*args, **kwargs):
+            counters['commits'] += 1
+            return save(*args, **kwargs)
+        storage.save = counted_save
+    return counters
+
+
+def run_child(args):
+    """
+    Runs the benchmark against the storage engine selected by FLAYERFX_TYPE_STORAGE.
+
+    Args:
+        args (Namespace): The parsed command line.
+
+    Returns:
+        dict: The per-round and total timings, counters and peak RSS.
+    """
+    sys.path.insert(0, ROOT)
+    from logger import init_logger
+    init_logger(None)
+    from logger import logHandler
+    logHandler.logger.setLevel(getattr(logging, args.log_level))
+    logging.getLogger().setLevel(getattr(logging, args.log_level))
+
+    started = perf_counter()
+    from models import storage
+    from api.v1.views.scrapers import ValidateScrapeJSON, threaded_database_updater
+    import_seconds = perf_counter() - started
+    counters = count_writes(storage)
+
+    rng = random.Random(args.seed)
+    catalogs = make_catalogs(args.stores, args.products, args.seed)
+    rounds = []
+    for round_number in range(args.rounds):
+        phases = {'generate': 0.0, 'validate': 0.0, 'ingest': 0.0, 'close': 0.0}
+        commits = counters['commits']
+        statements = counters['statements']
+        items = 0
+        created = bumped = 0
+        for catalog in catalogs:
+            phase = perf_counter()
+            payload = make_payload(catalog, round_number, args.change_rate, args.discount_rate, rng)
+            phases['generate'] += perf_counter() - phase
+
+            phase = perf_counter()
+            if ValidateScrapeJSON(payload) != 0:
+                raise SystemExit(f"Generated payload of {catalog['store']} is not valid")
+            phases['validate'] += perf_counter() - phase
+
+            phase = perf_counter()
+            stats = threaded_database_updater(payload)
+            phases['ingest'] += perf_counter() - phase
+            if stats is None:
+                raise SystemExit(f"Ingestion of {catalog['store']} failed")
+
+            phase = perf_counter()
+            storage.close()
+            phases['close'] += perf_counter() - phase
+            items += len(payload['prices'])
+            created += stats['prices_created']
+            bumped += stats['prices_bumped']
+        rounds.append({'round': round_number,
+                       'items': items,
+                       'prices_created': created,
+                       'prices_bumped': bumped,
+                       'items_per_second': round(items / phases['ingest'], 1) if phases['ingest'] else None,
+                       'commits': counters['commits'] - commits,
+                       'statements': counters['statements'] - statements,
+                       'phases': {name: round(seconds, 4) for name, seconds in phases.items()}})
+
+    ingest_seconds = sum(r['phases']['ingest'] for r in rounds)
+    items = sum(r['items'] for r in rounds)
+    return {'import_seconds': round(import_seconds, 4),
+            'items': items,
+            'items_per_second': round(items / ingest_seconds, 1) if ingest_seconds else None,
+            'commits': counters['commits'],
+            'statements': counters['statements'],
+            'peak_rss_kb': peak_rss(),
+            'seconds': round(perf_counter() - started, 4),
+            'rounds': rounds}
+
+
+def run_engine(engine, args):
+    """
+    Runs the benchmark of a storage engine in a child process and a temporary directory.
+
+    Args:
+        engine (str): A key of ENGINES.
+        args (Namespace): The parsed command line.
+
+    Returns:
+        dict: The result of `run_child` in the child process.
+    """
+    env = dict(os.environ)
+    env['FLAYERFX_TYPE_STORAGE'] = ENGINES[engine]
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    command = [sys.executable, os.path.abspath(__file__), '--child',
+               '--stores', str(args.stores), '--products', str(args.products),
+               '--rounds', str(args.rounds), '--change-rate', str(args.change_rate),
+               '--discount-rate', str(args.discount_rate), '--seed', str(args.seed),
+               '--log-level', args.log_level]
+    with tempfile.TemporaryDirectory(prefix=f"flayerfx-bench-{engine}-") as cwd:
+        process = subprocess.run(command, cwd=cwd, env=env, stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE, text=True)
+        result_path = os.path.join(cwd, 'result.json')
+        if process.returncode != 0 or not os.path.exists(result_path):
+            raise SystemExit(f"Benchmark of {engine} failed:\n{process.stderr[-4000:]}")
+        with open(result_path) as f:
+            return json.load(f)
+
+
+def compare(results, baseline):
+    """
+    Prints the change of throughput and commits against a previous run.
+
+    Args:
+        results (dict): The engine results of this run.
+        baseline (dict): The engine results of the previous run.
+    """
+    for engine, result in results.items():
+        previous = baseline.get(engine)
+        if not previous or not previous.get('items_per_second') or not result.get('items_per_second'):
+            continue
+        change = (result['items_per_second'] / previous['items_per_second'] - 1) * 100
+        print(f"{engine:>8}: {previous['items_per_second']} -> {result['items_per_second']} items/s "
+              f"({change:+.1f}%), commits {previous['commits']} -> {result['commits']}")
+
+
+def main():
+    """
+    Parses the command line, runs the requested engines and saves the results.
+    """
+    parser = argparse.ArgumentParser(description="FLAYERFX scrape ingestion benchmark")
+    parser.add_argument('--stores', type=int, default=2, help="number of stores")
+    parser.add_argument('--products', type=int, default=2000, help="number of products per store")
+    parser.add_argument('--rounds', type=int, default=3, help="number of scrapes of every store")
+    parser.add_argument('--change-rate', type=float, default=0.1,
+                        help="fraction of the products whose price changes every round")
+    parser.add_argument('--discount-rate', type=float, default=0.05,
+                        help="fraction of the items with a discount")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the payload generator")
+    parser.add_argument('--engines', default=','.join(ENGINES),
+                        help=f"comma separated storage engines ({', '.join(ENGINES)})")
+    parser.add_argument('--output', default=None, help="path of the JSON results")
+    parser.add_argument('--compare', default=None, help="path of the JSON results of a previous run")
+    parser.add_argument('--log-level', default='WARNING', help="log level of the storage and views")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = run_child(args)
+        with open('result.json', 'w') as f:
+            json.dump(result, f)
+        return
+
+    engines = [engine.strip() for engine in args.engines.split(',') if engine.strip()]
+    for engine in engines:
+        if engine not in ENGINES:
+            parser.error(f"Unknown engine {engine}")
+    report = {'created_at': datetime.utcnow().isoformat(),
+              'python': platform.python_version(),
+              'config': {key: value for key, value in vars(args).items()
+                         if key not in ('child', 'output', 'compare')},
+              'results': {}}
+    for engine in engines:
+        print(f"Running {engine}...", flush=True)
+        result = run_engine(engine, args)
+        report['results'][engine] = result
+        print(f"{engine:>8}: {result['items']} items, {result['items_per_second']} items/s, "
+              f"{result['commits']} commits, {result['statements']} statements, "
+              f"peak RSS {result['peak_rss_kb']} kB")
+        for r in result['rounds']:
+            print(f"          round {r['round']}: {r['items_per_second']} items/s, "
+                  f"{r['prices_created']} prices created, {r['prices_bumped']} bumped, {r['phases']}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report['results'], json.load(f)['results'])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
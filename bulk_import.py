@@ -0,0 +1,477 @@
+#!/usr/bin/python3
+"""
+Module: bulk_import
+This module is the command line importer of historical scrape dumps. It reads
+NDJSON, JSON or CSV files, or directories of them, holding scrape payloads in
+the `data_structure` format of `api/v1/views/scrapers.py` or one scraped item
+per line or row, and streams the items in chunks through `storage.bulk_ingest`,
+without going through the API or the ingestion queue.
+Classes:
+    Checkpoint: The records of every file and store already ingested.
+    Importer: Dispatches chunks of items to the workers and advances the checkpoint.
+Public Functions:
+    iter_sources(paths): Expands directories to the files they hold.
+    read_records(path): Yields the records of a file with their position.
+    record_items(record, default_store): Returns the store name and the valid items of a record.
+    ingest_chunk(store_name, items, batch_size, stores): Ingests one chunk of items of a store.
+    run_worker(tasks, results, batch_size): Ingests the chunks of a task queue.
+    main(): Parses the command line and runs the import.
+Usage:
+    A line of an NDJSON file, a row of a CSV file and a payload of a JSON file each
+    count as one record. The items of a store are ingested in file order, by a
+    single worker, one chunk per transaction, and a chunk always ends on a record
+    boundary. The checkpoint keeps the last committed record of every file and
+    store, so an import interrupted and started again with the same checkpoint
+    resumes right after it; bulk_ingest is not idempotent, re-ingesting a record
+    would insert its prices again.
+    Example:
+        $ python bulk_import.py dumps/ --checkpoint import.checkpoint
+        $ python bulk_import.py prices.csv.gz --store Naivas --chunk-size 20000 --workers 4
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import multiprocessing
+import os
+from queue import Empty, Full
+import signal
+from time import perf_counter
+
+# File extensions read by the importer, optionally followed by .gz
+EXTENSIONS = ('.ndjson', '.jsonl', '.json', '.csv')
+# Number of items above which the buffered records of a store are ingested in one bulk_ingest call
+CHUNK_SIZE = 5000
+# Number of chunks waiting in the task queue of a worker
+QUEUED_CHUNKS = 2
+# Seconds between two throughput reports
+REPORT_EVERY = 10
+# Counters of the ingestion reports summed over the import
+COUNTERS = ('items', 'products_created', 'prices_created', 'prices_bumped', 'skipped')
+
+
+class Checkpoint:
+    """
+    Checkpoint class keeping the last ingested record of every file and store.
+    Attributes:
+        path (str or None): The path of the checkpoint file. None disables the checkpoint.
+        positions (dict): The last ingested record position by file path then store name.
+    Methods:
+        position(source, store_name): Returns the last ingested record of a store in a file.
+        commit(source, store_name, position): Records that the records up to a position were ingested.
+        save(): Writes the checkpoint file.
+    """
+
+    def __init__(self, path=None, restart=False):
+        """
+        Instantiate a checkpoint, reading its file unless restarting.
+
+        Args:
+            path (str, optional): The path of the checkpoint file.
+            restart (bool, optional): If True, ignore the positions of an existing file.
+        """
+        self.path = path
+        self.positions = {}
+        if path is not None and not restart and os.path.exists(path):
+            with open(path) as f:
+                self.positions = json.load(f)
+
+    def position(self, source, store_name):
+        """
+        Returns the last ingested record of a store in a file.
+
+        Args:
+            source (str): The path of the file.
+            store_name (str): The name of the store.
+
+        Returns:
+            int: The position of the record, 0 if none was ingested.
+        """
+        return self.positions.get(os.path.abspath(source), {}).get(store_name, 0)
+
+    def commit(self, source, store_name, position):
+        """
+        Records that the records of a store in a file up to a position were ingested.
+
+        Args:
+            source (str): The path of the file.
+            store_name (str): The name of the store.
+            position (int): The position of the last ingested record.
+        """
+        stores = self.positions.setdefault(os.path.abspath(source), {})
+        stores[store_name] = max(position, stores.get(store_name, 0))
+
+    def save(self):
+        """
+        Writes the checkpoint file, replacing it atomically.
+        """
+        if self.path is None:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.positions, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+def iter_sources(paths):
+    """
+    Expands directories to the files they hold.
+
+    Args:
+        paths (list): File and directory paths.
+
+    Yields:
+        str: Every file path given, and the files of every directory with one of
+             the EXTENSIONS, optionally gzipped, in name order.
+    """
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().removesuffix('.gz').endswith(EXTENSIONS):
+                    yield os.path.join(root, name)
+
+
+def read_records(path):
+    """
+    Yields the records of a file with their position.
+
+    NDJSON lines and CSV rows are read one at a time; a JSON file holds one payload
+    or a list of payloads.
+
+    Args:
+        path (str): The path of the file, gzipped if it ends with .gz.
+
+    Yields:
+        tuple: The 1-based position of the record and the record.
+
+    Raises:
+        ValueError: If the extension of the file is not one of the EXTENSIONS.
+    """
+    name = path.lower().removesuffix('.gz')
+    if not name.endswith(EXTENSIONS):
+        raise ValueError(f"Unsupported file {path}, expected one of {', '.join(EXTENSIONS)}")
+    opener = gzip.open if path.lower().endswith('.gz') else open
+    with opener(path, 'rt', newline='') as f:
+        if name.endswith('.csv'):
+            yield from enumerate(csv.DictReader(f), 1)
+        elif name.endswith('.json'):
+            data = json.load(f)
+            yield from enumerate(data if type(data) is list else [data], 1)
+        else:
+            for position, line in enumerate(f, 1):
+                if line.strip():
+                    yield position, json.loads(line)
+
+
+def record_items(record, default_store=None):
+    """
+    Returns the store name and the valid items of a record.
+
+    A record is either a scrape payload, whose 'fetched_at' applies to the items
+    without one, or a single item carrying its 'store'. Empty values are dropped,
+    so an empty CSV cell reads as a missing key. Items missing one of the keys
+    required by `ValidateScrapeJSON`, or whose price, discount or reference is
+    not a number, are invalid.
+
+    Args:
+        record (dict): The payload or item.
+        default_store (str, optional): The store of records without one.
+
+    Returns:
+        tuple: The store name, the list of valid items and the number of invalid items.
+               Every item of a record without a store is invalid.
+    """
+    if 'prices' in record:
+        items = record['prices'] or []
+        defaults = {'fetched_at': record['fetched_at']} if record.get('fetched_at') else {}
+    else:
+        items = [record]
+        defaults = {}
+    store_name = record.get('store') or default_store
+    if not store_name:
+        return None, [], len(items)
+    valid = []
+    for item in items:
+        item = dict(defaults, **{key: value for key, value in item.items()
+                                 if key != 'store' and value not in (None, '')})
+        try:
+            item['item_price'] = float(item['item_price'])
+            item['item_reference'] = int(str(item['item_reference']).strip())
+            if 'item_discount' in item:
+                item['item_discount'] = float(item['item_discount'])
+            if not item['item_name'] or not item['item_link']:
+                continue
+        except (KeyError, TypeError, ValueError):
+            continue
+        valid.append(item)
+    return store_name, valid, len(items) - len(valid)
+
+
+def ingest_chunk(store_name, items, batch_size, stores):
+    """
+    Ingests one chunk of items of a store in a single bulk_ingest transaction.
+
+    Args:
+        store_name (str): The name of the store, created if missing.
+        items (list): The scraped items.
+        batch_size (int): The number of items resolved and written per batch.
+        stores (dict): The IDs of the stores already resolved, by name.
+
+    Returns:
+        dict: The ingestion report, without its batches.
+    """
+    from models import storage
+    from models.store import Store
+    if store_name not in stores:
+        store = storage.get(Store, name=store_name)
+        if store is None:
+            store = [Store(name=store_name)]
+            store[0].save()
+        stores[store_name] = store[0].id
+    stats = storage.bulk_ingest(stores[store_name], items, batch_size)
+    stats.pop('batches', None)
+    return stats
+
+
+def run_worker(tasks, results, batch_size):
+    """
+    Ingests the chunks of a task queue until it receives None.
+
+    Once a chunk of a store failed, the later chunks of the store are answered
+    with an error without being ingested, so none of its records past the
+    checkpoint is committed. Interrupts are ignored, the importer stops its
+    workers once their queued chunks are ingested.
+
+    Args:
+        tasks (Queue): The (chunk ID, store name, items) tuples to ingest.
+        results (Queue): Receives a (chunk ID, report, error) tuple per chunk.
+        batch_size (int): The number of items resolved and written per batch.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from logger import init_logger
+    # The storage engines log through logHandler, which has to exist before models is imported
+    init_logger(None)
+    from models import storage
+    stores = {}
+    failed = set()
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        chunk_id, store_name, items = task
+        if store_name in failed:
+            results.put((chunk_id, None, "Skipped after a failed chunk of the store"))
+            continue
+        try:
+            results.put((chunk_id, ingest_chunk(store_name, items, batch_size, stores), None))
+        except Exception as e:
+            storage.rollback()
+            failed.add(store_name)
+            results.put((chunk_id, None, repr(e)))
+    storage.close()
+
+
+class Importer:
+    """
+    Importer class buffering the records of every store, dispatching them in
+    chunks to the workers, or ingesting them in process without workers, and
+    advancing the checkpoint as chunks are committed.
+    Attributes:
+        totals (dict): The COUNTERS summed over the committed chunks.
+        failed (set): The stores whose chunk failed; their later records are not ingested.
+    Methods:
+        add(source, position, store_name, items): Buffers the items of a record.
+        finish(flush): Waits for the dispatched chunks and stops the workers.
+    """
+
+    def __init__(self, checkpoint, chunk_size=CHUNK_SIZE, batch_size=None, workers=1):
+        """
+        Instantiate an importer and start its workers.
+
+        Args:
+            checkpoint (Checkpoint): The checkpoint to advance.
+            chunk_size (int, optional): The number of items above which the records of a store are ingested.
+            batch_size (int, optional): The number of items resolved and written per batch.
+                                        Defaults to the BATCH_SIZE of bulk_ingest.
+            workers (int, optional): The number of worker processes, none if 1 or less.
+        """
+        from models.engine.ingest import BATCH_SIZE
+        self.checkpoint = checkpoint
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size or BATCH_SIZE
+        self.totals = dict.fromkeys(COUNTERS, 0)
+        self.failed = set()
+        self.started = perf_counter()
+        self.__reported = self.started
+        self.__buffers = {}
+        self.__pending = {}
+        self.__chunks = 0
+        self.__stores = {}
+        self.__workers = []
+        if workers > 1:
+            # Spawned workers open their own storage instead of sharing the connections of this process
+            context = multiprocessing.get_context('spawn')
+            self.__results = context.Queue()
+            for number in range(workers):
+                tasks = context.Queue(maxsize=QUEUED_CHUNKS)
+                process = context.Process(target=run_worker, args=(tasks, self.__results, self.batch_size))
+                process.start()
+                self.__workers.append((process, tasks))
+
+    def add(self, source, position, store_name, items):
+        """
+        Buffers the items of a record, dispatching the chunk of its store once full.
+
+        Args:
+            source (str): The file of the record.
+            position (int): The position of the record in the file.
+            store_name (str): The store of the items.
+            items (list): The valid items of the record.
+        """
+        if store_name in self.failed:
+            return
+        key = (source, store_name)
+        buffer = self.__buffers.setdefault(key, {'source': source, 'store': store_name, 'first': position,
+                                                 'last': position, 'items': []})
+        buffer['last'] = position
+        buffer['items'].extend(items)
+        if len(buffer['items']) >= self.chunk_size:
+            self.__dispatch(key)
+
+    def __dispatch(self, key):
+        """Sends the buffered chunk of a store to its worker, or ingests it in process."""
+        buffer = self.__buffers.pop(key)
+        self.__chunks += 1
+        self.__pending[self.__chunks] = buffer
+        if not self.__workers:
+            try:
+                stats, error = ingest_chunk(buffer['store'], buffer['items'], self.batch_size, self.__stores), None
+            except Exception as e:
+                from models import storage
+                storage.rollback()
+                stats, error = None, repr(e)
+            self.__done(self.__chunks, stats, error)
+            return
+        # A store always goes to the same worker so its chunks are committed in order
+        tasks = self.__workers[hash(buffer['store']) % len(self.__workers)][1]
+        task = (self.__chunks, buffer['store'], buffer['items'])
+        while True:
+            try:
+                tasks.put(task, timeout=0.2)
+                break
+            except Full:
+                self.__collect()
+        self.__collect()
+
+    def __collect(self, wait=False):
+        """Processes the reports of the chunks the workers finished, or of every chunk if waiting."""
+        while self.__pending:
+            try:
+                report = self.__results.get(timeout=1) if wait else self.__results.get_nowait()
+            except Empty:
+                if wait:
+                    continue
+                return
+            self.__done(*report)
+
+    def __done(self, chunk_id, stats, error):
+        """Accounts a finished chunk and advances the checkpoint of its store."""
+        buffer = self.__pending.pop(chunk_id)
+        if error is not None and buffer['store'] not in self.failed:
+            # The records of the store from this chunk on are left to the next run
+            self.failed.add(buffer['store'])
+            print(f"** {len(buffer['items'])} items of {buffer['store']} from {buffer['source']} "
+                  f"records {buffer['first']}-{buffer['last']} failed: {error} **", flush=True)
+        if error is not None or buffer['store'] in self.failed:
+            return
+        for counter in COUNTERS:
+            self.totals[counter] += stats[counter]
+        self.checkpoint.commit(buffer['source'], buffer['store'], buffer['last'])
+        self.checkpoint.save()
+        self.__report()
+
+    def __report(self, final=False):
+        """Prints the throughput, every REPORT_EVERY seconds unless final."""
+        now = perf_counter()
+        if not final and now - self.__reported < REPORT_EVERY:
+            return
+        self.__reported = now
+        seconds = now - self.started
+        print(f"{self.totals['items']} items in {seconds:.1f}s "
+              f"({self.totals['items'] / max(seconds, 1e-9):.0f} items/s): "
+              f"{self.totals['products_created']} new products, {self.totals['prices_created']} new prices, "
+              f"{self.totals['prices_bumped']} prices bumped, {self.totals['skipped']} skipped", flush=True)
+
+    def finish(self, flush=True):
+        """
+        Dispatches the buffered chunks, waits for every dispatched chunk and stops the workers.
+
+        Args:
+            flush (bool, optional): If False, e.g. on an interrupt, the buffered records are
+                                    dropped and left to the next run.
+        """
+        if flush:
+            for key in list(self.__buffers):
+                self.__dispatch(key)
+        self.__buffers.clear()
+        if self.__workers:
+            self.__collect(wait=True)
+            for process, tasks in self.__workers:
+                tasks.put(None)
+            for process, tasks in self.__workers:
+                process.join()
+        self.__report(final=True)
+
+
+def main():
+    """
+    Parses the command line and imports the files.
+    """
+    parser = argparse.ArgumentParser(description="FLAYERFX bulk importer of historical scrape dumps")
+    parser.add_argument('paths', nargs='+', help="NDJSON, JSON or CSV files, optionally gzipped, or directories")
+    parser.add_argument('--store', help="store of the records without one")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help="items of a store committed per bulk_ingest call")
+    parser.add_argument('--batch-size', type=int, help="items resolved and written per batch of bulk_ingest")
+    parser.add_argument('--workers', type=int, default=1, help="number of worker processes")
+    parser.add_argument('--checkpoint', help="file recording the progress, read to resume an interrupted import")
+    parser.add_argument('--restart', action='store_true', help="ignore the progress recorded in the checkpoint")
+    args = parser.parse_args()
+
+    from logger import init_logger
+    # The storage engines log through logHandler, which has to exist before models is imported
+    init_logger(None)
+    if args.workers > 1 and os.getenv('FLAYERFX_TYPE_STORAGE') == 'json':
+        # Every process would load and save its own copy of the JSON file
+        print("** The JSON storage is imported without workers **")
+        args.workers = 1
+    checkpoint = Checkpoint(args.checkpoint, args.restart)
+    importer = Importer(checkpoint, args.chunk_size, args.batch_size, args.workers)
+    flush = True
+    try:
+        for source in iter_sources(args.paths):
+            print(f"Importing {source}", flush=True)
+            for position, record in read_records(source):
+                store_name, items, invalid = record_items(record, args.store)
+                if store_name is not None and position <= checkpoint.position(source, store_name):
+                    continue
+                importer.totals['skipped'] += invalid
+                if items:
+                    importer.add(source, position, store_name, items)
+    except KeyboardInterrupt:
+        print("** Interrupted, waiting for the chunks being ingested **", flush=True)
+        flush = False
+    finally:
+        importer.finish(flush)
+    if importer.failed:
+        print(f"** Ingestion failed for {', '.join(sorted(importer.failed))}, "
+              "run the import again with the same checkpoint to resume it **")
+
+
+if __name__ == '__main__':
+    main()
@@ -19,6 +19,7 @@ Public Functions:
     do_products(arg): Provides a list of all products in a store.
     do_search(arg): Searches for a product by name.
     do_price_history(arg): Gets the price history of a specific product.
+    do_refresh_latest(arg): Rebuilds the latest price snapshot of every product.
 Usage:
     This module is used to interact with and manage instances of Store, Product, and Price classes via a command-line interface.
     Example:
@@ -33,8 +34,14 @@ import cmd
 import shlex  # for splitting the line along spaces except in double quotes
 from datetime import datetime
 
+from logger import init_logger
+# The storage engines log through logHandler, which has to exist before models is imported
+init_logger(None)
+
 import models
 from models.class_store import *
+from models.deal import deals_since
+from models.engine.archive import archive_horizon
 
 class FLYRFXCommand(cmd.Cmd):
     """ FLAYERFX console """
@@ -133,8 +140,19 @@ class FLYRFXCommand(cmd.Cmd):
         elif args[0] in classes:
             if len(args) > 1:
                 key = args[0] + "." + args[1]
-                if key in models.storage.all():
-                    models.storage.all().pop(key)
+                if args[0] in ("Store", "Product"):
+                    if not models.storage.get(classes[args[0]], id=args[1]):
+                        print("** no instance found **")
+                        return
+                    stats = models.storage.bulk_delete(
+                        classes[args[0]], [args[1]],
+                        lambda done, total: print(f"{done}/{total} products deleted"))
+                    print(f"{stats['products']} products, {stats['prices']} prices, "
+                          f"{stats['archived_prices']} archived prices, "
+                          f"{stats['deals']} deals and {stats['relations']} relations deleted "
+                          f"in {stats['seconds']}s")
+                elif key in models.storage.all():
+                    models.storage.delete(models.storage.all()[key])
                     models.storage.save()
                 else:
                     print("** no instance found **")
@@ -218,9 +236,8 @@ class FLYRFXCommand(cmd.Cmd):
             print(f"{store.name} Products({len(store.products)})")
             count = 0
             for item in store.products:
-                lp = item.latest_price
-                if lp is not None:
-                    print(f"{item.name}\t({lp.amount})")
+                if item.latest_price_id is not None:
+                    print(f"{item.name}\t({item.latest_amount})")
                 else:
                     print(f"{item.name}\t(?)")
                 count = count + 1
@@ -257,9 +274,8 @@ class FLYRFXCommand(cmd.Cmd):
                 if storeid != item.store_id:
                     storeid = item.store_id
                     print(f"\n**{item.store.name}**")
-                lp = item.latest_price
-                if lp is not None:
-                    print(f"{item.name}\t({lp.amount})")
+                if item.latest_price_id is not None:
+                    print(f"{item.name}\t({item.latest_amount})")
                 else:
                     print(f"{item.name}\t(?)")
     def do_price_history(self, arg):
@@ -284,6 +300,100 @@ class FLYRFXCommand(cmd.Cmd):
             for price in prod.prices_sorted:
                 print(f"{price.fetched_at}-{price.amount}")
 
+    def do_refresh_latest(self, arg):
+        """Rebuild the latest price snapshot of every product"""
+        count = models.storage.refresh_latest_prices()
+        print(f"{count} products have a latest price")
+
+    def do_refresh_deals(self, arg):
+        """Rebuild the daily deals of the last days: refresh_deals [days]"""
+        args = shlex.split(arg)
+        try:
+            days = int(args[0]) if len(args) > 0 else 1
+        except ValueError:
+            print("** Number of days must be an integer **")
+            return
+        count = models.storage.refresh_deals(since=deals_since(days))
+        models.storage.save()
+        print(f"{count} daily deals since {deals_since(days).date()}")
+
+    def do_compact_prices(self, arg):
+        """Collapse runs of equal consecutive prices into segments: compact_prices [product_id ...]"""
+        args = shlex.split(arg)
+        stats = models.storage.compact_prices(args if len(args) > 0 else None)
+        print(f"{stats['deleted']} prices merged into {stats['segments']} segments "
+              f"of {stats['products']} products in {stats['seconds']}s")
+
+    def do_archive_prices(self, arg):
+        """Move the prices older than a number of days to the archive: archive_prices [days]"""
+        args = shlex.split(arg)
+        try:
+            before = archive_horizon(int(args[0])) if len(args) > 0 else None
+        except ValueError:
+            print("** Number of days must be an integer **")
+            return
+        stats = models.storage.archive_prices(before)
+        print(f"{stats['archived']} prices fetched before {stats['before']} archived in {stats['seconds']}s")
+
+    def do_merge_products(self, arg):
+        """Merge the products of stores sharing a reference: merge_products [--dry-run] [store_id ...]"""
+        args = shlex.split(arg)
+        dry_run = '--dry-run' in args
+        store_ids = [i for i in args if i != '--dry-run']
+        report = models.storage.merge_products(store_ids if len(store_ids) > 0 else None, dry_run=dry_run,
+                                               progress=lambda done, total: print(f"{done}/{total} groups merged"))
+        for group in report['merges']:
+            print(f"{group['store_id']} {group['reference']}: {', '.join(group['merge'])} -> {group['keep']}")
+        print(f"{'Would merge' if dry_run else 'Merged'} {report['products_deleted']} products into "
+              f"{report['groups']} products of {report['stores']} stores, {report['prices_moved']} prices "
+              f"moved, {report['deals_deleted']} deals and {report['relations_deleted']} relations deleted "
+              f"in {report['seconds']}s")
+
+    def do_orphans(self, arg):
+        """Count or delete the prices, products and relations without a parent: orphans [class] [--delete]"""
+        args = shlex.split(arg)
+        delete = '--delete' in args
+        names = [i for i in args if i != '--delete'] or ["Price", "Product", "ProductRelation"]
+        for name in names:
+            if name not in ("Price", "Product", "ProductRelation"):
+                print(f"** {name} objects cannot be orphaned **")
+                continue
+            if delete:
+                print(f"{models.storage.delete_orphans(classes[name])} orphaned {name} objects deleted")
+            else:
+                print(f"{models.storage.count_orphans(classes[name])} orphaned {name} objects")
+
+    def do_reconcile_counts(self, arg):
+        """Recount the object counters of the stats pages from the tables: reconcile_counts"""
+        if not hasattr(models.storage, 'reconcile_counts'):
+            print("** Object counters are only kept by the database storages **")
+            return
+        counts = models.storage.reconcile_counts()
+        print(", ".join(f"{name}: {count}" for name, count in counts.items()))
+
+    def do_explain(self, arg):
+        """Print the query plans of the main storage queries: explain [query name]"""
+        if not hasattr(models.storage, 'explain'):
+            print("** Query plans are only available with the database storages **")
+            return
+        plans = models.storage.explain()
+        args = shlex.split(arg)
+        if len(args) > 0 and args[0] not in plans:
+            print(f"** Unknown query, one of: {', '.join(plans)} **")
+            return
+        for name, rows in plans.items():
+            if len(args) == 0 or args[0] == name:
+                print(f"\n**{name}**")
+                for row in rows:
+                    print("\t".join(str(i) for i in row))
+
+    def do_rebuild_search(self, arg):
+        """Rebuild the full-text index of the product names"""
+        if models.storage.rebuild_search_index():
+            print(f"Search index rebuilt for {models.storage.count(Product)} products")
+        else:
+            print("** Full-text search is not available, searches use LIKE filters **")
+
 
 if __name__ == '__main__':
     FLYRFXCommand().cmdloop()
\ No newline at end of file
@@ -15,6 +15,7 @@ CORS(app, resources={r"/api/v1/*": {"origins": "*"}})
 #Any other modules that need logHandler must be imported after this line
 from logger import logHandler
 from models import storage
+from app.query_counter import count_queries
 
 
 logHandler.info("Starting the Application")
@@ -25,6 +26,8 @@ def wants_json_response():
     return request.accept_mimetypes['application/json'] >= \
     request.accept_mimetypes['text/html']
 
+count_queries(app)
+
 @app.teardown_appcontext
 def close_db(error):
     """ Close Storage """
@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+"""
+Module: ingest_worker
+This module is the entry point of the scrape ingestion workers. Every worker
+process claims payloads from the durable ingestion queue filled by
+`/api/v1/generic_scrape` and runs them through `threaded_database_updater`,
+so ingestion scales independently of the Flask API.
+Public Functions:
+    run_worker(name, poll, once): Processes queued jobs until stopped.
+    main(): Parses the command line and starts the worker processes.
+Usage:
+    The queue and storage are selected with the same environment variables as
+    the API (FLAYERFX_QUEUE_PATH, FLAYERFX_TYPE_STORAGE, ...). The workers do
+    not start with the JSON storage: every process would load and rewrite its
+    own copy of the file, so the API ingests the scrapes itself instead.
+    Example:
+        $ python ingest_worker.py --workers 4
+        $ python ingest_worker.py --once
+"""
+
+import argparse
+from multiprocessing import Process
+import os
+import socket
+from time import sleep
+
+
+def run_worker(name, poll=2.0, once=False):
+    """
+    Processes queued scrape payloads until stopped.
+
+    A job is acknowledged only after its payload was ingested, so a worker that
+    dies mid-job leaves it to be claimed again once its lease expires.
+
+    Args:
+        name (str): The name of the worker, stored on the jobs it claims.
+        poll (float, optional): Seconds to wait when the queue is empty.
+        once (bool, optional): If True, return as soon as the queue is empty.
+    """
+    from logger import init_logger
+    # The storage engines log through logHandler, which has to exist before models is imported
+    init_logger(None)
+    from logger import logHandler
+    from models import storage
+    from api.v1.views.scrapers import ingest_queue, threaded_database_updater
+
+    logHandler.info(f"Ingest worker {name} started on {ingest_queue.path}")
+    while True:
+        job = ingest_queue.claim(name)
+        if job is None:
+            if once:
+                break
+            sleep(poll)
+            continue
+        logHandler.info(f"Worker {name} processing job {job['id']} (attempt {job['attempts']})")
+        try:
+            stats = threaded_database_updater(job['payload'])
+            if stats is None:
+                ingest_queue.fail(job['id'], "Ingestion failed, see the worker log")
+            else:
+                stats.pop('batches', None)
+                ingest_queue.complete(job['id'], stats)
+        except Exception as e:
+            logHandler.error(f"Worker {name} failed job {job['id']}: {repr(e)}")
+            ingest_queue.fail(job['id'], repr(e))
+        finally:
+            storage.close()
+    logHandler.info(f"Ingest worker {name} stopped")
+
+
+def main():
+    """
+    Parses the command line and starts the requested number of worker processes.
+    """
+    parser = argparse.ArgumentParser(description="FLAYERFX scrape ingestion worker")
+    parser.add_argument('--workers', type=int, default=1, help="number of worker processes")
+    parser.add_argument('--poll', type=float, default=2.0, help="seconds between polls of an empty queue")
+    parser.add_argument('--once', action='store_true', help="exit when the queue is empty")
+    args = parser.parse_args()
+
+    if os.getenv('FLAYERFX_TYPE_STORAGE') == 'json':
+        # The API process is the only writer of the JSON file, and ingests the scrapes itself
+        parser.error("the JSON storage is ingested by the API process, ingest workers need a database storage")
+    prefix = f"{socket.gethostname()}-{os.getpid()}"
+    if args.workers <= 1:
+        run_worker(prefix, args.poll, args.once)
+        return
+    processes = [Process(target=run_worker, args=(f"{prefix}-{i}", args.poll, args.once))
+                 for i in range(args.workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,8 @@ base class for all future classes in the application. It provides common
 attributes and methods that will be inherited by other models.
 Classes:
     BaseModel: A base class for all models, providing common attributes and methods.
+Public Functions:
+    parse_time(value): Parses a date string, trying the ISO-8601 `time` format first.
 Usage:
     class MyModel(BaseModel):
         pass
@@ -31,6 +33,28 @@ if 'db' in storage_t:
 else:
     Base = object
 
+def parse_time(value):
+    """
+    Parses a date string.
+
+    Dates written by `to_dict` use the ISO-8601 `time` format, which
+    `datetime.fromisoformat` parses much faster than dateutil. Other
+    formats fall back to `dateutil.parser.parse`.
+
+    Args:
+        value (str): The date string.
+
+    Returns:
+        datetime: The parsed date.
+
+    Raises:
+        ValueError: If the string is not a date.
+    """
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return dateutil.parser.parse(value)
+
 class BaseModel:
     """
     BaseModel class
@@ -46,11 +70,24 @@ class BaseModel:
         save(): Updates the 'updated_at' attribute with the current datetime and saves the instance to storage.
         to_dict(save_fs=None): Returns a dictionary containing all keys/values of the instance.
         delete(): Deletes the current instance from the storage.
+        __setattr__(name, value): Sets an attribute and reports the change to the JSON storage.
     """
     if 'db' in storage_t:
         id = Column(String(60), primary_key=True)
         created_at = Column(DateTime, default=datetime.utcnow)
         updated_at = Column(DateTime, default=datetime.utcnow)
+    else:
+        # Called with every object an attribute is set on, registered by FileStorage
+        on_change = None
+
+        def __setattr__(self, name, value):
+            """
+            Sets an attribute and reports the change to the storage, so a save
+            in journal mode also writes the objects changed in place.
+            """
+            object.__setattr__(self, name, value)
+            if BaseModel.on_change is not None:
+                BaseModel.on_change(self)
 
     def __init__(self, *args, **kwargs):
         """
@@ -68,7 +105,8 @@ class BaseModel:
             Other attributes can be passed as keyword arguments.
 
         Notes:
-            - If `created_at` or `updated_at` are provided as strings, they will be parsed into datetime objects.
+            - If `created_at` or `updated_at` are provided as strings, they will be parsed into datetime objects;
+              datetimes are kept as given.
             - If `id` is not provided, a new UUID will be generated.
             - If `created_at` or `updated_at` are not provided, the current UTC time will be used.
         """
@@ -80,22 +118,21 @@ class BaseModel:
                 if key != "__class__":
                     if key[-3:] == '_at' and type(value) is str:
                         try:
-                            setattr(self, key, dateutil.parser.parse(value))
+                            setattr(self, key, parse_time(value))
                         except ValueError:
                             setattr(self, key, value)
-                        except dateutil.parser._parser.ParserError:
-                            setattr(self, key, value)
                     else:
                         setattr(self, key, value)
+            # Dates parsed above, e.g. reloaded from the JSON file, are kept
             if kwargs.get("created_at", None) and type(self.created_at) is str:
                 self.created_at = datetime.strptime(kwargs["created_at"], time)
-            else:
+            elif type(kwargs.get("created_at", None)) is not datetime \
+              and type(getattr(self, "created_at", None)) is not datetime:
                 self.created_at = datetime.utcnow()
             if kwargs.get("updated_at", None) and type(self.updated_at) is str:
                 self.updated_at = datetime.strptime(kwargs["updated_at"], time)
-            elif type(kwargs.get("updated_at", None)) is datetime:
-                self.updated_at = kwargs.get("updated_at", None)
-            else:
+            elif type(kwargs.get("updated_at", None)) is not datetime \
+              and type(getattr(self, "updated_at", None)) is not datetime:
                 self.updated_at = datetime.utcnow()
             if kwargs.get("id", None) is None:
                 self.id = str(uuid.uuid4())
@@ -129,6 +166,7 @@ class BaseModel:
         """
         from models import storage
         self.updated_at = datetime.utcnow()
+        storage.new(self)
         storage.save()
 
     def to_dict(self, save_fs=None):
@@ -5,13 +5,19 @@ Contains the class Store
 from models.store import Store
 from models.product import Product
 from models.price import Price
+from models.product_relation import ProductRelation
+from models.deal import Deal
 
 
 classes = {"Store": Store, "Product": Product,
-          "Price": Price}
+          "Price": Price, "ProductRelation": ProductRelation, "Deal": Deal}
 class_tables = {"Store": [ Store.name ],
           "Product": [ Product.store_id, Product.name, Product.link ],
-          "Price": [ Price.product_id, Price.amount, Price.is_discount ]}
+          "Price": [ Price.product_id, Price.amount, Price.is_discount ],
+          "ProductRelation": [ ProductRelation.product_id, ProductRelation.related_product_id,
+                               ProductRelation.similarity_score ],
+          "Deal": [ Deal.day, Deal.store_id, Deal.product_id, Deal.name, Deal.amount,
+                    Deal.rolling_avg, Deal.pct_off ]}
 fields = {"Store": [['name', 'str', 'Name of the Store']],
           "Product": [['store_id', 'str', 'ID of the Store'],
                        ['link', 'str', 'Link to the Product in the Store'],
@@ -19,4 +25,15 @@ fields = {"Store": [['name', 'str', 'Name of the Store']],
                        ['reference', 'int', 'Reference Number']],
           "Price": [['product_id','str','ID of the Product'],
                    ['amount', 'float', 'Price Amount'],
-                   ['is_discount', 'bool', 'The is price discounted']]}
\ No newline at end of file
+                   ['is_discount', 'bool', 'The is price discounted']],
+          "ProductRelation": [['product_id', 'str', 'ID of the Product'],
+                              ['related_product_id', 'str', 'ID of the matching Product in another Store'],
+                              ['similarity_score', 'float', 'Similarity of the two Products']],
+          "Deal": [['day', 'str', 'Day of the Deal, YYYY-MM-DD'],
+                   ['store_id', 'str', 'ID of the Store'],
+                   ['product_id', 'str', 'ID of the Product'],
+                   ['price_id', 'str', 'ID of the discounted Price'],
+                   ['name', 'str', 'Name of the Product'],
+                   ['amount', 'float', 'Discounted Price Amount'],
+                   ['rolling_avg', 'float', 'Average of the recent Prices'],
+                   ['pct_off', 'float', 'Percentage below the average']]}
\ No newline at end of file
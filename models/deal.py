@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+"""
+Module: deal
+This module defines the Deal class, the materialized daily deal of a product:
+its most recent discounted price of a day, next to the rolling average of its
+prices at that time, so the deals page is read without loading the products
+and their price history.
+Classes:
+    Deal: The discounted price of a product on a day with its rolling average.
+Public Functions:
+    deal_day(value): Returns the day key of a date.
+    deals_since(days=1): Returns the start of the first day refreshed by default.
+Usage:
+    The deals are kept up to date by the storages when discounted prices are
+    written, through `storage.refresh_deals`.
+    Example:
+        deals = storage.get_daily_deals(yesterday, tomorrow)
+        for deal in deals:
+            print(deal.name, deal.amount, deal.rolling_avg, deal.pct_off)
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Index, String
+from sqlalchemy.orm import relationship
+
+from models.base_model import BaseModel, Base
+from models import storage_t
+
+# Number of most recent prices averaged by the rolling average
+ROLLING_COUNT = 10
+
+
+def deal_day(value):
+    """
+    Returns the day key of a date, as stored in Deal.day.
+
+    Args:
+        value (datetime or date): The date.
+
+    Returns:
+        str: The day in the YYYY-MM-DD format.
+    """
+    if type(value) is datetime:
+        value = value.date()
+    return value.isoformat()
+
+
+def deals_since(days=1):
+    """
+    Returns the start of the first day whose deals are refreshed by default.
+
+    Args:
+        days (int, optional): The number of days before today. Defaults to 1, as
+                              the deals page shows the deals since yesterday.
+
+    Returns:
+        datetime: Midnight of that day.
+    """
+    return datetime.combine(datetime.today().date() - timedelta(days=days), datetime.min.time())
+
+
+class Deal(BaseModel, Base):
+    """
+    Deal Model
+    This class represents the most recent discounted price of a product on a day.
+    Attributes:
+        day (str): The day of the deal, YYYY-MM-DD.
+        store_id (str): The ID of the store of the product.
+        product_id (str): The ID of the product.
+        price_id (str): The ID of the discounted price.
+        name (str): The name of the product.
+        amount (float): The discounted price amount.
+        fetched_at (datetime): The fetch date of the discounted price.
+        rolling_avg (float): The average of the ROLLING_COUNT most recent prices at fetched_at.
+        pct_off (float): The percentage the amount is below the rolling average.
+    Methods:
+        from_prices(product, prices, day): Builds the deal of a product on a day.
+        plan(products, prices, since): Builds the deals of products on every day since a date.
+    """
+    if 'db' in storage_t:
+        __tablename__ = 'deals'
+        __table_args__ = (
+            # The deals page reads the deals of a few days
+            Index('ix_deals_day_storeid', 'day', 'storeid'),
+            # One deal per product and day
+            Index('ix_deals_productid_day', 'productid', 'day', unique=True),
+        )
+        day = Column('day', String(10), nullable=False)
+        store_id = Column('storeid', String(60), nullable=False)
+        product_id = Column('productid', String(60), ForeignKey('products.id'), nullable=False)
+        product = relationship('Product', back_populates='deals')
+        price_id = Column('priceid', String(60), nullable=False)
+        name = Column('name', String(255))
+        amount = Column('amount', Float)
+        fetched_at = Column('fetched_at', DateTime)
+        rolling_avg = Column('rolling_avg', Float)
+        pct_off = Column('pct_off', Float)
+    else:
+        day = ""
+        store_id = ""
+        product_id = ""
+        price_id = ""
+        name = ""
+        amount = 0.0
+        fetched_at = None
+        rolling_avg = 0.0
+        pct_off = 0.0
+
+    def __init__(self, *args, **kwargs):
+        """Initializes a new Deal instance."""
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def from_prices(cls, product, prices, day):
+        """
+        Builds the deal of a product on a day from its price history.
+
+        Args:
+            product (Product): The product.
+            prices (list): The prices of the product, sorted by descending fetched_at.
+            day (str): The day key of the deal.
+
+        Returns:
+            dict or None: The values of the deal, or None if the product has no
+                          discounted price that day.
+        """
+        for i, price in enumerate(prices):
+            if price.is_discount and price.fetched_at is not None and deal_day(price.fetched_at) == day:
+                window = [p.amount for p in prices[i:i + ROLLING_COUNT] if p.amount is not None]
+                rolling_avg = sum(window) / len(window) if window else 0
+                pct_off = round((rolling_avg - price.amount) / rolling_avg * 100, 2) if rolling_avg else 0.0
+                return {'day': day, 'store_id': product.store_id, 'product_id': product.id,
+                        'price_id': price.id, 'name': product.name, 'amount': price.amount,
+                        'fetched_at': price.fetched_at, 'rolling_avg': rolling_avg, 'pct_off': pct_off}
+        return None
+
+    @classmethod
+    def plan(cls, products, prices, since):
+        """
+        Builds the deals of products on every day since a date.
+
+        Args:
+            products (iterable): The products, with their id, store_id and name.
+            prices (dict): The prices of each product by product ID, sorted by descending fetched_at.
+            since (datetime): The start of the first day.
+
+        Returns:
+            dict: The values of the deals by (product ID, day).
+        """
+        since_day = deal_day(since)
+        planned = {}
+        for product in products:
+            history = prices.get(product.id, [])
+            days = {deal_day(p.fetched_at) for p in history if p.is_discount and p.fetched_at is not None}
+            for day in days:
+                if day < since_day:
+                    continue
+                values = cls.from_prices(product, history, day)
+                if values is not None:
+                    planned[(product.id, day)] = values
+        return planned
+
+    if 'db' not in storage_t:
+        @property
+        def product(self):
+            """
+            Returns:
+                Product or None: The product of the deal.
+            """
+            from models import storage
+            from models.product import Product
+            prdct = storage.related(Product, 'id', self.product_id)
+            return prdct[0] if prdct else None
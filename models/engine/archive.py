@@ -0,0 +1,385 @@
+#!/usr/bin/python3
+"""
+Module: archive
+This module holds the cold tier of the price history. Prices older than the
+archive horizon are moved out of the prices table into one gzip compressed
+file per month of fetched_at. A file stores its prices column by column,
+sorted by product, with the row range of each product, so the history of a
+product is read without decoding the rows of other products. An index file
+lists the months holding prices of each product and the date before which
+prices were archived.
+Classes:
+    PriceArchive: The monthly archive files of a directory.
+Public Functions:
+    archive_horizon(days=ARCHIVE_DAYS): Returns the date before which prices are archived.
+    to_price(row): Returns an archived price as a Price object that is not stored.
+Usage:
+    The storages move prices with `storage.archive_prices()` and read both tiers
+    with `storage.price_history(product_id, since)`.
+    Example:
+        price_archive.write(rows, archive_horizon())
+        rows = price_archive.history(product_id, since=datetime(2020, 1, 1))
+Environment Variables:
+    FLAYERFX_ARCHIVE_DIR: Directory of the archive files. Defaults to "archive".
+    FLAYERFX_ARCHIVE_DAYS: Age in days after which prices are archived. Defaults to 365.
+"""
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import gzip
+import json
+import os
+from threading import Lock
+
+from models.base_model import parse_time
+
+# Directory of the monthly archive files and their index
+ARCHIVE_DIR = os.getenv('FLAYERFX_ARCHIVE_DIR', 'archive')
+# Age in days after which prices are moved to the archive
+ARCHIVE_DAYS = int(os.getenv('FLAYERFX_ARCHIVE_DAYS', 365))
+# Number of decoded month files kept in memory
+MONTH_CACHE = 12
+# Columns of an archived price
+COLUMNS = ('id', 'product_id', 'amount', 'is_discount', 'fetched_at', 'first_seen_at',
+           'created_at', 'updated_at')
+DATE_COLUMNS = ('fetched_at', 'first_seen_at', 'created_at', 'updated_at')
+
+
+def archive_horizon(days=ARCHIVE_DAYS):
+    """
+    Returns the date before which prices are archived.
+
+    Args:
+        days (int, optional): The age in days of the oldest price kept in the prices table.
+
+    Returns:
+        datetime: The current UTC time minus `days`.
+    """
+    return datetime.utcnow() - timedelta(days=days)
+
+
+def to_price(row):
+    """
+    Returns an archived price as a Price object that is not added to the storage.
+
+    Args:
+        row (dict): The COLUMNS of the archived price.
+
+    Returns:
+        Price: The price, with its `archived` attribute set.
+    """
+    from models.price import Price
+    price = Price(id=row['id'], product_id=row['product_id'], amount=row['amount'],
+                  is_discount=row['is_discount'], archived=True)
+    for column in DATE_COLUMNS:
+        setattr(price, column, row[column])
+    return price
+
+
+class PriceArchive:
+    """
+    PriceArchive class reading and writing the monthly price archive files of a directory.
+    Attributes:
+        directory (str): The directory of the files.
+    Methods:
+        index(): Returns the archived months of each product and the archive cutoff.
+        cutoff(): Returns the date before which prices were archived.
+        write(rows, before): Adds prices to the files of their months.
+        drop(product_ids): Removes the archived prices of deleted products.
+        reassign(mapping): Moves the archived prices of products to other products.
+        count(product_ids): Counts the archived prices of products.
+        history(product_id, since=None, until=None): Returns the archived prices of a product.
+    """
+
+    def __init__(self, directory=ARCHIVE_DIR):
+        """
+        Instantiate the archive of a directory.
+
+        Args:
+            directory (str, optional): The directory of the files.
+        """
+        self.directory = directory
+        self.__cache = OrderedDict()
+        self.__index = (None, None)
+        self.__lock = Lock()
+        # Held while the files and the index are rewritten
+        self.__writing = Lock()
+
+    def __path(self, month):
+        """Returns the path of the file of a month, YYYY-MM."""
+        return os.path.join(self.directory, f"prices-{month}.json.gz")
+
+    def __index_path(self):
+        """Returns the path of the index file."""
+        return os.path.join(self.directory, "index.json")
+
+    def __replace(self, path, data, compress):
+        """
+        Writes a file atomically through a temporary file.
+
+        Args:
+            path (str): The path of the file.
+            data (bytes): The content.
+            compress (bool): Whether the content is gzip compressed.
+        """
+        tmp_path = path + ".tmp"
+        opener = gzip.open if compress else open
+        with opener(tmp_path, 'wb') as f:
+            f.write(data)
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def index(self):
+        """
+        Returns the index of the archive, reusing the decoded file while it is unchanged.
+        The returned dictionary must not be modified.
+
+        Returns:
+            dict: 'before', the ISO date before which prices were archived or None, and
+                  'months', the months holding prices of each product ID.
+        """
+        try:
+            mtime = os.stat(self.__index_path()).st_mtime_ns
+        except FileNotFoundError:
+            return {'before': None, 'months': {}}
+        if self.__index[0] != mtime:
+            with open(self.__index_path()) as f:
+                self.__index = (mtime, json.load(f))
+        return self.__index[1]
+
+    def cutoff(self):
+        """
+        Returns the date before which prices were archived.
+
+        Returns:
+            datetime or None: None if nothing was archived.
+        """
+        before = self.index()['before']
+        return parse_time(before) if before else None
+
+    def __read(self, month):
+        """
+        Reads the file of a month, using the decoded file while it is unchanged.
+
+        Args:
+            month (str): The month, YYYY-MM.
+
+        Returns:
+            dict: 'columns', the values of each column, and 'offsets', the
+                  [start, end) row range of each product ID.
+        """
+        path = self.__path(month)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return {'columns': {column: [] for column in COLUMNS}, 'offsets': {}}
+        with self.__lock:
+            cached = self.__cache.get(month)
+            if cached is not None and cached[0] == mtime:
+                self.__cache.move_to_end(month)
+                return cached[1]
+        with gzip.open(path, 'rb') as f:
+            data = json.loads(f.read())
+        with self.__lock:
+            self.__cache[month] = (mtime, data)
+            while len(self.__cache) > MONTH_CACHE:
+                self.__cache.popitem(last=False)
+        return data
+
+    def __rows(self, data, start=0, end=None):
+        """
+        Returns rows of a decoded month file as dictionaries.
+
+        Args:
+            data (dict): The decoded file.
+            start (int, optional): The first row.
+            end (int, optional): The row after the last one. Defaults to every row.
+
+        Returns:
+            list: The rows, with their dates parsed.
+        """
+        columns = data['columns']
+        if end is None:
+            end = len(columns['id'])
+        rows = []
+        for i in range(start, end):
+            row = {column: columns[column][i] for column in COLUMNS}
+            for column in DATE_COLUMNS:
+                if row[column] is not None:
+                    row[column] = parse_time(row[column])
+            rows.append(row)
+        return rows
+
+    def __write_month(self, month, rows, index):
+        """
+        Rewrites the file of a month with its rows sorted by product and lists its products in the index.
+
+        Args:
+            month (str): The month, YYYY-MM.
+            rows (iterable): Dictionaries with the COLUMNS of every price of the month.
+            index (dict): The index being updated.
+        """
+        ordered = sorted(rows, key=lambda r: (r['product_id'], r['fetched_at'], r['id']))
+        columns = {column: [] for column in COLUMNS}
+        offsets = {}
+        for i, row in enumerate(ordered):
+            for column in COLUMNS:
+                value = row[column]
+                if column in DATE_COLUMNS and value is not None:
+                    value = value.isoformat()
+                columns[column].append(value)
+            offsets.setdefault(row['product_id'], [i, i])[1] = i + 1
+        self.__replace(self.__path(month), json.dumps({'columns': columns, 'offsets': offsets}).encode(),
+                       compress=True)
+        for product_id in offsets:
+            product_months = index['months'].setdefault(product_id, [])
+            if month not in product_months:
+                product_months.append(month)
+                product_months.sort()
+
+    def write(self, rows, before):
+        """
+        Adds prices to the files of the months of their fetched_at.
+
+        Each touched file is rewritten with its previous rows, rows with an
+        already archived ID replacing them, so writing the same prices twice
+        after an interrupted move keeps a single copy. The index is written last.
+
+        Args:
+            rows (list): Dictionaries with the COLUMNS of the prices.
+            before (datetime): The date before which every price is now archived.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with self.__writing:
+            index = json.loads(json.dumps(self.index()))
+            months = {}
+            for row in rows:
+                months.setdefault(row['fetched_at'].strftime('%Y-%m'), []).append(row)
+            for month, new_rows in months.items():
+                merged = {row['id']: row for row in self.__rows(self.__read(month))}
+                for row in new_rows:
+                    merged[row['id']] = row
+                self.__write_month(month, merged.values(), index)
+            if index['before'] is None or parse_time(index['before']) < before:
+                index['before'] = before.isoformat()
+            self.__replace(self.__index_path(), json.dumps(index).encode(), compress=False)
+
+    def __rewrite(self, product_ids, change):
+        """
+        Rewrites the months holding prices of some products, changing their rows.
+
+        The products are removed from the index and the rewritten months list
+        the products of their remaining rows. The index is written last.
+
+        Args:
+            product_ids (iterable): The IDs of the products whose rows change.
+            change (callable): Called with each row of these products, returns the row
+                               to keep or None to remove it.
+
+        Returns:
+            int: The number of rows of these products.
+        """
+        with self.__writing:
+            product_ids = {product_id for product_id in product_ids if product_id in self.index()['months']}
+            if not product_ids:
+                return 0
+            index = json.loads(json.dumps(self.index()))
+            months = set()
+            for product_id in product_ids:
+                months.update(index['months'].pop(product_id))
+            count = 0
+            for month in sorted(months):
+                rows = []
+                for row in self.__rows(self.__read(month)):
+                    if row['product_id'] in product_ids:
+                        count += 1
+                        row = change(row)
+                    if row is not None:
+                        rows.append(row)
+                if rows:
+                    self.__write_month(month, rows, index)
+                else:
+                    os.remove(self.__path(month))
+            self.__replace(self.__index_path(), json.dumps(index).encode(), compress=False)
+            return count
+
+    def drop(self, product_ids):
+        """
+        Removes the archived prices of deleted products.
+
+        Args:
+            product_ids (iterable): The IDs of the deleted products.
+
+        Returns:
+            int: The number of archived prices removed.
+        """
+        return self.__rewrite(product_ids, lambda row: None)
+
+    def reassign(self, mapping):
+        """
+        Moves the archived prices of products to other products, e.g. merged duplicates.
+
+        Args:
+            mapping (dict): The ID of the product each product ID is merged into.
+
+        Returns:
+            int: The number of archived prices moved.
+        """
+        def change(row):
+            row['product_id'] = mapping[row['product_id']]
+            return row
+        return self.__rewrite(mapping, change)
+
+    def count(self, product_ids):
+        """
+        Counts the archived prices of products, reading only the months they are listed in.
+
+        Args:
+            product_ids (iterable): The IDs of the products.
+
+        Returns:
+            int: The number of archived prices.
+        """
+        months = self.index()['months']
+        count = 0
+        for product_id in set(product_ids):
+            for month in months.get(product_id, []):
+                start, end = self.__read(month)['offsets'].get(product_id, (0, 0))
+                count += end - start
+        return count
+
+    def history(self, product_id, since=None, until=None):
+        """
+        Returns the archived prices of a product.
+
+        Only the files of the months listed for the product in the index and
+        overlapping the requested range are read.
+
+        Args:
+            product_id (str): The ID of the product.
+            since (datetime, optional): The earliest fetched_at returned.
+            until (datetime, optional): The latest fetched_at returned.
+
+        Returns:
+            list: Dictionaries with the COLUMNS of the prices, sorted by ascending fetched_at.
+        """
+        rows = []
+        for month in self.index()['months'].get(product_id, []):
+            if since is not None and month < since.strftime('%Y-%m'):
+                continue
+            if until is not None and month > until.strftime('%Y-%m'):
+                continue
+            data = self.__read(month)
+            start, end = data['offsets'].get(product_id, (0, 0))
+            for row in self.__rows(data, start, end):
+                if since is not None and row['fetched_at'] < since:
+                    continue
+                if until is not None and row['fetched_at'] > until:
+                    continue
+                rows.append(row)
+        return sorted(rows, key=lambda r: r['fetched_at'])
+
+
+# The archive shared by the storages
+price_archive = PriceArchive()
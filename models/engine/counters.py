@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+"""
+Module: counters
+This module maintains the number of rows of each model class in the
+object_counts table, so counting the stores, products and prices does not
+scan their tables. The counters are moved by the inserts and deletes of every
+ORM flush, in the same transaction, and by the bulk statements of the
+storage, which report what they inserted or deleted. They are recounted from
+the tables when they are created and then periodically, in case a statement
+changed rows behind their back.
+Classes:
+    ObjectCounters: The counters of the classes of a database.
+Usage:
+    DBStorage registers the counters on its session factory and reads them in `count`.
+    Example:
+        counters = ObjectCounters(engine, classes)
+        counters.register(sess_factory)
+        counters.adjust(session, {'Price': 100})
+        print(counters.read(session))
+Environment Variables:
+    FLAYERFX_COUNTS_RECONCILE: Seconds after which the counters are recounted. Defaults to 3600.
+"""
+
+from datetime import datetime, timedelta
+from os import getenv
+
+from sqlalchemy import Column, DateTime, Integer, String, Table, delete, event, func, insert, select, update
+from sqlalchemy.orm import object_session
+
+from models.base_model import Base
+
+from logger import logHandler
+
+# Seconds after which the counters are recounted from the tables
+RECONCILE_AFTER = int(getenv('FLAYERFX_COUNTS_RECONCILE', 3600))
+
+object_counts = Table(
+    'object_counts', Base.metadata,
+    Column('name', String(60), primary_key=True),
+    Column('count', Integer, nullable=False, default=0),
+    Column('reconciled_at', DateTime),
+)
+
+
+class ObjectCounters:
+    """
+    ObjectCounters class keeping the row count of model classes in the object_counts table.
+    Attributes:
+        engine (Engine): The SQLAlchemy engine of the database.
+        classes (dict): The model classes by name.
+    Methods:
+        register(sess_factory): Counts the rows inserted and deleted by the flushes of a session factory.
+        adjust(session, deltas): Moves counters by the rows a bulk statement inserted or deleted.
+        read(session): Returns the counters, recounting them when they are due.
+        reconcile(): Recounts every counter from its table.
+    """
+
+    def __init__(self, engine, classes):
+        """
+        Instantiate the counters of a database.
+
+        Args:
+            engine (Engine): The SQLAlchemy engine of the database.
+            classes (dict): The model classes by name.
+        """
+        self.engine = engine
+        self.classes = classes
+
+    def register(self, sess_factory):
+        """
+        Counts the rows inserted and deleted by the ORM flushes of the sessions of a factory.
+
+        Args:
+            sess_factory (sessionmaker): The session factory.
+        """
+        for cls in self.classes.values():
+            if not event.contains(cls, 'after_insert', self.__inserted):
+                event.listen(cls, 'after_insert', self.__inserted)
+                event.listen(cls, 'after_delete', self.__deleted)
+        event.listen(sess_factory, 'after_flush_postexec', self.__flushed)
+        event.listen(sess_factory, 'after_rollback', self.__discard)
+
+    @staticmethod
+    def __track(target, delta):
+        """Adds a row of the class of target to the pending deltas of its session."""
+        session = object_session(target)
+        if session is not None:
+            deltas = session.info.setdefault('count_deltas', {})
+            name = target.__class__.__name__
+            deltas[name] = deltas.get(name, 0) + delta
+
+    @staticmethod
+    def __inserted(mapper, connection, target):
+        """Counts an inserted row."""
+        ObjectCounters.__track(target, 1)
+
+    @staticmethod
+    def __deleted(mapper, connection, target):
+        """Counts a deleted row."""
+        ObjectCounters.__track(target, -1)
+
+    def __flushed(self, session, flush_context):
+        """Writes the deltas of a flush to the counters, in the transaction of the flush."""
+        deltas = session.info.pop('count_deltas', None)
+        if deltas:
+            self.__write(session.connection(), deltas)
+
+    @staticmethod
+    def __discard(session):
+        """Drops the deltas of a flush that failed."""
+        session.info.pop('count_deltas', None)
+
+    @staticmethod
+    def __write(connection, deltas):
+        """
+        Moves counters with one UPDATE per class.
+
+        Args:
+            connection (Connection): The connection of the transaction.
+            deltas (dict): The number of rows inserted minus deleted by class name.
+        """
+        for name, delta in deltas.items():
+            if delta:
+                connection.execute(update(object_counts).where(object_counts.c.name == name).
+                                   values(count=object_counts.c.count + delta))
+
+    def adjust(self, session, deltas):
+        """
+        Moves counters by the rows a bulk statement inserted or deleted.
+
+        Bulk inserts and DELETE statements do not go through the ORM flush, so the
+        storage reports their rows here, in the transaction of the statement.
+
+        Args:
+            session (Session): The session running the statement.
+            deltas (dict): The number of rows inserted minus deleted by class name.
+        """
+        self.__write(session.connection(), deltas)
+
+    def read(self, session):
+        """
+        Returns the counters, recounting them first when they are older than RECONCILE_AFTER.
+
+        Args:
+            session (Session): The session the counters are read in.
+
+        Returns:
+            dict: The number of rows by class name.
+        """
+        rows = session.execute(select(object_counts)).all()
+        oldest = min((row.reconciled_at for row in rows if row.reconciled_at is not None), default=None)
+        if len(rows) < len(self.classes) or oldest is None or \
+                datetime.utcnow() - oldest > timedelta(seconds=RECONCILE_AFTER):
+            return self.reconcile()
+        return {row.name: row.count for row in rows}
+
+    def reconcile(self):
+        """
+        Recounts every counter from its table, in a transaction of its own.
+
+        Returns:
+            dict: The number of rows by class name.
+        """
+        counts = {}
+        with self.engine.begin() as conn:
+            for name, cls in self.classes.items():
+                counts[name] = conn.execute(select(func.count()).select_from(cls.__table__)).scalar()
+            conn.execute(delete(object_counts))
+            now = datetime.utcnow()
+            conn.execute(insert(object_counts), [{'name': name, 'count': count, 'reconciled_at': now}
+                                                 for name, count in counts.items()])
+        logHandler.info(f"Reconciled object counts: {counts}")
+        return counts
@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+"""
+Module: data_version
+This module holds the data version stamp, which changes whenever the stored
+data changes. The storages bump it when they commit changes, in whichever
+process they run, e.g. the ingest workers, by rewriting a small version file;
+the API processes compare the stamp of their cached responses with the
+current one to know whether they are still valid.
+Classes:
+    DataVersion: The version stamp of a version file.
+Usage:
+    Example:
+        stamp = data_version.current()
+        storage.save()
+        assert data_version.current() != stamp
+Environment Variables:
+    FLAYERFX_DATA_VERSION_PATH: Path of the version file. Defaults to "data.version".
+"""
+
+import os
+from threading import Lock
+from time import time_ns
+
+
+class DataVersion:
+    """
+    DataVersion class reading and bumping the version stamp of a file.
+    The stamp is the content of the file, the time of the last bump in nanoseconds
+    and the process ID, plus a counter of the bumps made by the current process.
+    Attributes:
+        path (str): The path of the version file.
+    Methods:
+        bump(): Records that the data changed.
+        current(): Returns the current version stamp.
+    """
+
+    def __init__(self, path=None):
+        """
+        Instantiate the version of a file.
+
+        Args:
+            path (str, optional): The path of the version file. Defaults to FLAYERFX_DATA_VERSION_PATH.
+        """
+        self.path = path or os.getenv('FLAYERFX_DATA_VERSION_PATH', 'data.version')
+        self.__local = 0
+        self.__cache = (None, '')
+        self.__lock = Lock()
+
+    def bump(self):
+        """
+        Records that the data changed by rewriting the version file.
+        """
+        with self.__lock:
+            self.__local += 1
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, 'w') as f:
+                    f.write(f"{time_ns()}-{os.getpid()}")
+                os.replace(tmp_path, self.path)
+            except OSError:
+                # The local counter still invalidates the responses of this process
+                pass
+
+    def current(self):
+        """
+        Returns the current version stamp.
+
+        The file is only read again when its modification time changed.
+
+        Returns:
+            str: The version stamp.
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self.__cache[0]:
+            stamp = ''
+            if mtime is not None:
+                try:
+                    with open(self.path) as f:
+                        stamp = f.read().strip()
+                except OSError:
+                    pass
+            self.__cache = (mtime, stamp)
+        return f"{self.__cache[1]}.{self.__local}"
+
+
+# The data version shared by the storages and the response cache
+data_version = DataVersion()
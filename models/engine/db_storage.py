@@ -7,29 +7,67 @@ Classes:
 Public Functions:
     __init__(self, engine=None): Instantiate a DBStorage object.
     all_select(self, cls, tables=[]): Query on the current database session with specific tables.
-    all(self, cls=None): Query on the current database session.
+    all(self, cls=None, load=()): Query on the current database session.
     new(self, obj): Add the object to the current database session.
     save(self): Commit all changes of the current database session.
     delete(self, obj=None): Delete from the current database session obj if not None.
+    bulk_delete(self, cls, ids, progress=None): Delete stores or products and everything attached with set-based statements.
+    merge_products(self, store_ids=None, dry_run=False, progress=None): Merge the products sharing a store and reference.
+    orphans(self, cls, after=None, limit=100): Return one page of the prices, products or relations without a parent.
+    count_orphans(self, cls): Count the prices, products or relations without a parent.
+    delete_orphans(self, cls, ids=None): Delete orphaned objects with set-based statements.
+    reassign_orphans(self, cls, ids, parent_id): Attach orphaned prices or products to a new parent.
+    export(self, cls, store_id=None, since=None, until=None, batch_size=EXPORT_BATCH_SIZE): Stream the rows of a class.
     reload(self): Reloads data from the database.
     close(self): Call remove() method on the private session attribute.
     rollback(self): Rollback the current session.
-    get(self, cls, **kwargs): Returns the object based on the class name and its ID, or None if not found.
+    get(self, cls, load=(), **kwargs): Returns the object based on the class name and its ID, or None if not found.
     count(self, cls=None): Count the number of objects in storage.
-    search(self, cls, **kwargs): Search for an object in the database by kwargs.
+    counts(self): Return the number of objects of every class from the maintained counters.
+    reconcile_counts(self): Recount the object counters from the tables.
+    search(self, cls, load=(), **kwargs): Search for an object in the database by kwargs.
+    rebuild_search_index(self): Rebuild the full-text index of the product names.
+    refresh_latest_prices(self): Rebuild the latest price snapshot of every product.
+    refresh_deals(self, product_ids=None, since=None): Rebuild the daily deals of products.
+    get_daily_deals(self, dateleft, dateright): Read the materialized daily deals between two dates.
+    explain(self): Return the query plans of the main storage queries.
+    price_segments(self, product_id): Return the price history of a product as segments.
+    compact_prices(self, product_ids=None): Collapse runs of equal prices into segments.
+    archive_prices(self, before=None): Move old prices to the monthly archive files.
+    price_history(self, product_id, since=None, until=None): Read the prices of a product from both tiers.
+    price_stats(self, product_ids, count=ROLLING_COUNT): Compute the price statistics of many products.
+    bulk_ingest(self, store_id, items, batch_size=BATCH_SIZE): Ingest scraped items with batched statements.
 Usage:
     This module is used to interact with the database by providing an interface to query, add, delete, and manage objects.
 """
 
+from datetime import datetime
 from os import getenv
-from sqlalchemy import or_, func, and_
-from sqlalchemy.orm import aliased, scoped_session, sessionmaker
+from time import perf_counter
+from sqlalchemy import event, inspect, or_, func, and_
+from sqlalchemy.orm import MANYTOONE, aliased, joinedload, scoped_session, selectinload, sessionmaker
 
 from models.base_model import Base
-from models.engine.matchscore import match_score, SCORETHRESHOLD
+from models.deal import Deal, deal_day, deals_since
+from models.engine.archive import COLUMNS, archive_horizon, price_archive, to_price
+from models.engine.counters import ObjectCounters, object_counts
+from models.engine.data_version import data_version
+from models.engine.export import EXPORT_BATCH_SIZE, EXPORT_COLUMNS, EXPORT_DATE_COLUMNS
+from models.engine.ingest import BATCH_SIZE, new_stats, plan_batch
+from models.engine.merge import new_report, newest_snapshot, plan_merge
+from models.engine.migrations import add_missing_columns, add_missing_indexes
+from models.engine.query_counter import query_counter
+from models.engine.price_stats import ROLLING_COUNT, empty_stats, stats_from_prices, \
+    supports_window_functions, window_stats_query
+from models.engine.search_index import SEARCH_LIMIT, rank, search_index_for
+from models.engine.segments import plan_compaction, price_runs, to_segment
 
 from logger import logHandler
 
+# Relationships loaded under another name than the one given to `load`
+LOAD_ALIASES = {'latest_price': 'latest_price_ref'}
+# Maximum number of bound parameters used in a single IN filter
+CHUNK_SIZE = 500
 
 
 class DBStorage:
@@ -43,7 +81,7 @@ class DBStorage:
             Instantiate a DBStorage object.
         all_select(self, cls, tables=[]):
             Query on the current database session with specific tables.
-        all(self, cls=None):
+        all(self, cls=None, load=()):
             Query on the current database session.
         new(self, obj):
             Add the object to the current database session.
@@ -51,23 +89,64 @@ class DBStorage:
             Commit all changes of the current database session.
         delete(self, obj=None):
             Delete from the current database session obj if not None.
+        bulk_delete(self, cls, ids, progress=None):
+            Delete stores or products with their products, prices, deals and relations in one transaction.
+        merge_products(self, store_ids=None, dry_run=False, progress=None):
+            Merge the products of a store sharing a reference, found with a GROUP BY.
+        orphans(self, cls, after=None, limit=100):
+            Return one page of the objects whose parent is missing, found with NOT EXISTS.
+        count_orphans(self, cls):
+            Count the objects whose parent is missing.
+        delete_orphans(self, cls, ids=None):
+            Delete the selected or all orphaned objects with set-based statements.
+        reassign_orphans(self, cls, ids, parent_id):
+            Attach orphaned prices to a product or orphaned products to a store.
+        export(self, cls, store_id=None, since=None, until=None, batch_size=EXPORT_BATCH_SIZE):
+            Stream the products, prices or relations as plain rows with a server-side cursor.
         reload(self):
             Reload data from the database.
         close(self):
             Call remove() method on the private session attribute.
         rollback(self):
             Rollback the current session.
-        get(self, cls, **kwargs):
+        get(self, cls, load=(), **kwargs):
             Returns the object based on the class name and its ID, or None if not found.
         count(self, cls=None):
             Count the number of objects in storage.
-        search(self, cls, **kwargs):
+        counts(self):
+            Return the number of objects of every class from the object_counts table.
+        reconcile_counts(self):
+            Recount the object counters from the tables.
+        search(self, cls, load=(), **kwargs):
             Search for an object in the database by kwargs.
         get_deals(self, dateleft, dateright):
             Get deals between two dates.
+        rebuild_search_index(self):
+            Rebuild the full-text index of the product names.
+        refresh_latest_prices(self):
+            Rebuild the latest price snapshot of every product.
+        refresh_deals(self, product_ids=None, since=None):
+            Rebuild the daily deals of products from their price history.
+        get_daily_deals(self, dateleft, dateright):
+            Read the materialized daily deals between two dates.
+        explain(self):
+            Return the query plans of the main storage queries.
+        price_segments(self, product_id):
+            Return the price history of a product as segments.
+        compact_prices(self, product_ids=None):
+            Collapse runs of consecutive equal prices into segments.
+        archive_prices(self, before=None):
+            Move the prices older than the archive horizon to the monthly archive files.
+        price_history(self, product_id, since=None, until=None):
+            Read the prices of a product from the prices table and the archive.
+        price_stats(self, product_ids, count=ROLLING_COUNT):
+            Compute the price statistics of many products, with window functions when available.
+        bulk_ingest(self, store_id, items, batch_size=BATCH_SIZE):
+            Ingest scraped items with batched statements in a single transaction.
     """
     __engine = None
     __session = None
+    __search_index = None
 
     def __init__(self, engine=None):
         """
@@ -80,6 +159,8 @@ class DBStorage:
             FLAYERFX_ENV: If set to "test", all metadata will be dropped from the engine.
         """
         self.__engine = engine
+        if engine is not None:
+            query_counter.attach(engine)
         FLAYERFX_ENV = getenv('FLAYERFX_ENV')
         if FLAYERFX_ENV == "test":
             Base.metadata.drop_all(self.__engine)
@@ -112,12 +193,46 @@ class DBStorage:
                         new_dict[key] = obj
         return (new_dict)
 
-    def all(self, cls=None):
+    def __loader_options(self, cls, load):
+        """
+        Returns the loader options eagerly loading relationships of a class.
+
+        Many-to-one relationships, such as the store of a product, are joined to
+        the query; collections and the latest price are read with one extra
+        IN query for all the objects. Nested relationships are separated by dots.
+
+        Args:
+            cls (type): The class of the queried objects.
+            load (iterable): The relationship names, e.g. ('store', 'latest_price', 'product.store').
+
+        Returns:
+            list: The SQLAlchemy loader options.
+
+        Raises:
+            ValueError: If a name is not a relationship.
+        """
+        options = []
+        for path in load:
+            loader = None
+            owner = cls
+            for name in path.split('.'):
+                attr = getattr(owner, LOAD_ALIASES.get(name, name), None)
+                prop = getattr(attr, 'property', None)
+                if prop is None or not hasattr(prop, 'direction'):
+                    raise ValueError(f"{name} is not a relationship of {owner.__name__}")
+                eager = joinedload if prop.direction is MANYTOONE and name not in LOAD_ALIASES else selectinload
+                loader = eager(attr) if loader is None else getattr(loader, eager.__name__)(attr)
+                owner = prop.mapper.class_
+            options.append(loader)
+        return options
+
+    def all(self, cls=None, load=()):
         """
         Query on the current database session and return a dictionary of objects.
 
         Args:
             cls (type, optional): The class type to filter the query. If None, query all classes.
+            load (iterable, optional): The relationships of cls loaded with the objects.
 
         Returns:
             dict: A dictionary where the key is a string in the format 'ClassName.id' and the value is the object instance.
@@ -126,7 +241,8 @@ class DBStorage:
         new_dict = {}
         for clss in classes:
             if cls is None or cls is classes[clss] or cls is clss:
-                objs = self.__session.query(classes[clss]).all()
+                options = self.__loader_options(classes[clss], load) if cls is not None else []
+                objs = self.__session.query(classes[clss]).options(*options).all()
                 for obj in objs:
                     key = obj.__class__.__name__ + '.' + obj.id
                     new_dict[key] = obj
@@ -138,14 +254,54 @@ class DBStorage:
 
         If the object is a list, all objects in the list will be added to the session.
         Otherwise, the single object will be added to the session.
+        The latest price snapshot of the products of any added prices is updated,
+        and so are the daily deals of the products of added discounted prices.
 
         Args:
             obj (object or list): The object or list of objects to add to the session.
         """
+        from models.price import Price
+        objs = obj if type(obj) == list else [obj]
+        prices = [i for i in objs if isinstance(i, Price)]
+        for price in prices:
+            if price.fetched_at is None:
+                price.fetched_at = datetime.utcnow()
         if type(obj) == list:
+            inserted = {}
+            for i in obj:
+                if not inspect(i).has_identity:
+                    inserted[i.__class__.__name__] = inserted.get(i.__class__.__name__, 0) + 1
             self.__session.bulk_save_objects(obj)
+            self.__counters.adjust(self.__session, inserted)
         else:
             self.__session.add(obj)
+        if len(prices) > 0:
+            self.__record_prices(prices)
+        discounted = [price for price in prices if price.is_discount]
+        if len(discounted) > 0:
+            self.refresh_deals({price.product_id for price in discounted},
+                               min(price.fetched_at for price in discounted))
+
+    def __record_prices(self, prices):
+        """
+        Moves the latest price snapshot of the products of the given prices.
+
+        The products are fetched in chunks with a single IN query per chunk.
+
+        Args:
+            prices (list): The Price objects that were added to the session.
+        """
+        from models.product import Product
+        product_ids = list({price.product_id for price in prices})
+        products = {}
+        for i in range(0, len(product_ids), CHUNK_SIZE):
+            chunk = product_ids[i:i + CHUNK_SIZE]
+            for product in self.__session.query(Product).filter(Product.id.in_(chunk)):
+                products[product.id] = product
+        for price in prices:
+            product = products.get(price.product_id)
+            if product is not None:
+                product.record_price(price)
 
     def save(self):
         """
@@ -162,9 +318,405 @@ class DBStorage:
 
         Args:
             obj: The object to be deleted from the session. If None, no action is taken.
+
+        Deleting the latest price of a product moves its snapshot to the previous price.
+        Deleting a discounted price refreshes the daily deals of its product from its day on.
         """
+        from models.price import Price
         if obj is not None:
+            if isinstance(obj, Price):
+                product = obj.product
+                if product is not None and product.latest_price_id == obj.id:
+                    product.refresh_latest_price(ignore=[obj.id])
             self.__session.delete(obj)
+            if isinstance(obj, Price) and obj.is_discount and obj.fetched_at is not None:
+                self.refresh_deals([obj.product_id], obj.fetched_at)
+
+    def bulk_delete(self, cls, ids, progress=None):
+        """
+        Deletes stores or products and everything attached to them in one transaction.
+
+        Unlike `delete`, which lets the ORM cascade load and delete every product and
+        price one by one, this issues set-based DELETE statements: the prices, deals
+        and relations of the products, then the products, then the stores. The
+        products are handled CHUNK_SIZE at a time, calling `progress` after each chunk.
+        The deleted objects are expunged from the session, and the archived prices
+        of the products are removed once the deletion is committed.
+
+        Args:
+            cls (type): Store or Product.
+            ids (iterable): The IDs of the objects to delete.
+            progress (callable, optional): Called with the number of products deleted so far
+                                           and the total.
+
+        Returns:
+            dict: The number of stores, products, prices, archived prices, deals and
+                  relations deleted, and the seconds it took.
+
+        Raises:
+            ValueError: If cls is neither Store nor Product.
+        """
+        from models.product import Product
+        from models.store import Store
+        if cls not in (Store, Product):
+            raise ValueError(f"Cannot bulk delete {cls.__name__} objects")
+        started = perf_counter()
+        ids = list(ids)
+        stats = {'stores': 0, 'products': 0, 'prices': 0, 'deals': 0, 'relations': 0}
+        try:
+            if cls is Store:
+                product_ids = []
+                for i in range(0, len(ids), CHUNK_SIZE):
+                    product_ids += [row[0] for row in self.__session.query(Product.id).
+                                    filter(Product.store_id.in_(ids[i:i + CHUNK_SIZE]))]
+            else:
+                product_ids = ids
+            for i in range(0, len(product_ids), CHUNK_SIZE):
+                chunk = product_ids[i:i + CHUNK_SIZE]
+                self.__delete_products(chunk, stats)
+                if progress is not None:
+                    progress(i + len(chunk), len(product_ids))
+            if cls is Store:
+                for i in range(0, len(ids), CHUNK_SIZE):
+                    stats['stores'] += self.__session.query(Store).filter(Store.id.in_(ids[i:i + CHUNK_SIZE])).\
+                        delete(synchronize_session=False)
+            self.__counters.adjust(self.__session, {'Store': -stats['stores']})
+            self.__session.commit()
+        except Exception:
+            self.__session.rollback()
+            raise
+        self.__expunge(set(product_ids), set(ids) if cls is Store else set())
+        stats['archived_prices'] = price_archive.drop(product_ids)
+        stats['seconds'] = round(perf_counter() - started, 4)
+        logHandler.info(f"Bulk deleted {cls.__name__} {ids[:5]}: {stats}")
+        return stats
+
+    def __delete_products(self, product_ids, stats):
+        """
+        Deletes products with their prices, deals and relations, one statement per table.
+
+        The object counters are adjusted; the caller commits.
+
+        Args:
+            product_ids (list): At most CHUNK_SIZE product IDs.
+            stats (dict): The 'prices', 'deals', 'relations' and 'products' counters to increment.
+        """
+        from models.price import Price
+        from models.product import Product
+        from models.product_relation import ProductRelation
+        deleted = {
+            'Price': self.__session.query(Price).filter(Price.product_id.in_(product_ids)).
+            delete(synchronize_session=False),
+            'Deal': self.__session.query(Deal).filter(Deal.product_id.in_(product_ids)).
+            delete(synchronize_session=False),
+            'ProductRelation': self.__session.query(ProductRelation).
+            filter(or_(ProductRelation.product_id.in_(product_ids),
+                       ProductRelation.related_product_id.in_(product_ids))).
+            delete(synchronize_session=False),
+            'Product': self.__session.query(Product).filter(Product.id.in_(product_ids)).
+            delete(synchronize_session=False)}
+        stats['prices'] += deleted['Price']
+        stats['deals'] += deleted['Deal']
+        stats['relations'] += deleted['ProductRelation']
+        stats['products'] += deleted['Product']
+        self.__counters.adjust(self.__session, {name: -count for name, count in deleted.items()})
+
+    def __expunge(self, product_ids, store_ids=()):
+        """
+        Removes deleted products, stores and the objects attached to them from the session.
+
+        Args:
+            product_ids (set): The IDs of the deleted products.
+            store_ids (set, optional): The IDs of the deleted stores.
+        """
+        for obj in list(self.__session.identity_map.values()):
+            if obj.id in product_ids or obj.id in store_ids or \
+                    getattr(obj, 'product_id', None) in product_ids or \
+                    getattr(obj, 'related_product_id', None) in product_ids:
+                self.__session.expunge(obj)
+
+    def merge_products(self, store_ids=None, dry_run=False, progress=None):
+        """
+        Merges the products of a store that share a reference number into one product.
+
+        The duplicate (store, reference) pairs are found with a GROUP BY. For each
+        group, one UPDATE moves the prices of the merged products to the kept one,
+        whose latest price snapshot becomes the newest of the group; the merged
+        products are then deleted with their deals and relations, CHUNK_SIZE at a
+        time, and the deals of the kept products are refreshed. Everything is
+        committed in one transaction, then the archived prices of the merged
+        products are moved to the kept ones.
+
+        Args:
+            store_ids (iterable, optional): The IDs of the stores. Defaults to every store.
+            dry_run (bool, optional): If True, only report what would be merged.
+            progress (callable, optional): Called with the number of groups merged so far
+                                           and the total.
+
+        Returns:
+            dict: The merge report, see `models.engine.merge.new_report`.
+        """
+        from models.price import Price
+        from models.product import Product
+        started = perf_counter()
+        duplicates = self.__session.query(Product.store_id, Product.reference).\
+            filter(Product.reference.isnot(None))
+        if store_ids is not None:
+            duplicates = duplicates.filter(Product.store_id.in_(list(store_ids)))
+        duplicates = duplicates.group_by(Product.store_id, Product.reference).\
+            having(func.count(Product.id) > 1).subquery()
+        rows = [row._asdict() for row in self.__session.query(
+            Product.id, Product.store_id, Product.reference, Product.created_at,
+            Product.latest_price_id, Product.latest_amount, Product.latest_fetched_at,
+            Product.latest_is_discount).
+            join(duplicates, and_(Product.store_id == duplicates.c.store_id,
+                                  Product.reference == duplicates.c.reference))]
+        groups = plan_merge(rows)
+        report = new_report(groups, dry_run)
+        merged = [product_id for group in groups for product_id in group['merge']]
+        try:
+            if dry_run:
+                for i in range(0, len(merged), CHUNK_SIZE):
+                    report['prices_moved'] += self.__session.query(func.count(Price.id)).\
+                        filter(Price.product_id.in_(merged[i:i + CHUNK_SIZE])).scalar()
+                report['prices_moved'] += price_archive.count(merged)
+            else:
+                by_id = {row['id']: row for row in rows}
+                snapshots = []
+                stats = {'prices': 0, 'deals': 0, 'relations': 0, 'products': 0}
+                first_day = None
+                for i in range(0, len(groups), CHUNK_SIZE):
+                    chunk = groups[i:i + CHUNK_SIZE]
+                    for group in chunk:
+                        report['prices_moved'] += self.__session.query(Price).\
+                            filter(Price.product_id.in_(group['merge'])).\
+                            update({Price.product_id: group['keep']}, synchronize_session='evaluate')
+                        snapshot = newest_snapshot([by_id[product_id] for product_id in [group['keep']] + group['merge']])
+                        if snapshot is not None and snapshot['latest_price_id'] != by_id[group['keep']]['latest_price_id']:
+                            snapshots.append(dict(snapshot, id=group['keep']))
+                    chunk_merged = [product_id for group in chunk for product_id in group['merge']]
+                    day = self.__session.query(func.min(Deal.day)).filter(Deal.product_id.in_(chunk_merged)).scalar()
+                    if day is not None and (first_day is None or day < first_day):
+                        first_day = day
+                    self.__delete_products(chunk_merged, stats)
+                    if progress is not None:
+                        progress(i + len(chunk), len(groups))
+                self.__session.bulk_update_mappings(Product, snapshots)
+                if first_day is not None:
+                    self.refresh_deals([group['keep'] for group in groups], datetime.fromisoformat(first_day))
+                report['deals_deleted'] = stats['deals']
+                report['relations_deleted'] = stats['relations']
+                self.__session.commit()
+        except Exception:
+            self.__session.rollback()
+            raise
+        if not dry_run:
+            report['prices_moved'] += price_archive.reassign({product_id: group['keep'] for group in groups
+                                                              for product_id in group['merge']})
+            self.__expunge(set(merged))
+            kept = {group['keep'] for group in groups}
+            for obj in list(self.__session.identity_map.values()):
+                if obj.id in kept:
+                    self.__session.expire(obj)
+        report['seconds'] = round(perf_counter() - started, 4)
+        logHandler.info(f"Merged {report['groups']} groups of duplicate products: "
+                        f"{ {k: v for k, v in report.items() if k != 'merges'} }")
+        return report
+
+    def export(self, cls, store_id=None, since=None, until=None, batch_size=EXPORT_BATCH_SIZE):
+        """
+        Streams the products, prices or relations as plain rows.
+
+        Only the EXPORT_COLUMNS of the class are selected, no object is built, and
+        the rows are fetched batch_size at a time from a server-side cursor, so the
+        memory used does not grow with the size of the table.
+
+        Args:
+            cls (type): Product, Price or ProductRelation.
+            store_id (str, optional): Only export the rows of the products of this store.
+            since (datetime, optional): Only export the rows dated at or after this date,
+                                        see EXPORT_DATE_COLUMNS.
+            until (datetime, optional): Only export the rows dated before this date.
+            batch_size (int, optional): The number of rows fetched per batch.
+
+        Yields:
+            dict: One row per object, by column name, ordered by ID.
+
+        Raises:
+            ValueError: If cls cannot be exported.
+        """
+        from models.price import Price
+        from models.product import Product
+        from models.product_relation import ProductRelation
+        if cls.__name__ not in EXPORT_COLUMNS:
+            raise ValueError(f"Cannot export {cls.__name__} objects")
+        query = self.__session.query(*[getattr(cls, column).label(column)
+                                       for column in EXPORT_COLUMNS[cls.__name__]])
+        if store_id is not None:
+            if cls is Product:
+                query = query.filter(Product.store_id == store_id)
+            else:
+                column = Price.product_id if cls is Price else ProductRelation.product_id
+                query = query.filter(column.in_(self.__session.query(Product.id).filter(Product.store_id == store_id)))
+        date_column = getattr(cls, EXPORT_DATE_COLUMNS[cls.__name__])
+        if since is not None:
+            query = query.filter(date_column >= since)
+        if until is not None:
+            query = query.filter(date_column < until)
+        query = query.order_by(cls.id).execution_options(stream_results=True, yield_per=batch_size)
+        for row in query:
+            yield row._asdict()
+
+    def __orphan_query(self, cls, columns=None):
+        """
+        Returns the query of the objects of a class whose parent object is missing.
+
+        Prices without a product, products without a store and relations missing
+        either product are found with correlated NOT EXISTS subqueries, which the
+        database runs as anti-joins on the primary keys of the parents.
+
+        Args:
+            cls (type): Price, Product or ProductRelation.
+            columns (list, optional): The columns to select instead of the objects.
+
+        Returns:
+            Query: The query of the orphaned objects.
+
+        Raises:
+            ValueError: If objects of cls have no parent.
+        """
+        from models.price import Price
+        from models.product import Product
+        from models.product_relation import ProductRelation
+        from models.store import Store
+        parents = {Price: [(Price.product_id, Product)], Product: [(Product.store_id, Store)],
+                   ProductRelation: [(ProductRelation.product_id, Product),
+                                     (ProductRelation.related_product_id, Product)]}
+        if cls not in parents:
+            raise ValueError(f"{cls.__name__} objects cannot be orphaned")
+        missing = [~self.__session.query(parent.id).filter(parent.id == column).exists()
+                   for column, parent in parents[cls]]
+        return self.__session.query(*(columns or [cls])).filter(or_(*missing))
+
+    def orphans(self, cls, after=None, limit=100):
+        """
+        Returns one page of the prices, products or relations whose parent is missing.
+
+        Args:
+            cls (type): Price, Product or ProductRelation.
+            after (str, optional): The ID of the last object of the previous page.
+            limit (int, optional): The maximum number of objects to return. Defaults to 100.
+
+        Returns:
+            list: The orphaned objects of the page, ordered by ID.
+        """
+        query = self.__orphan_query(cls)
+        if after is not None:
+            query = query.filter(cls.id > after)
+        return query.order_by(cls.id).limit(limit).all()
+
+    def count_orphans(self, cls):
+        """
+        Counts the prices, products or relations whose parent is missing.
+
+        Args:
+            cls (type): Price, Product or ProductRelation.
+
+        Returns:
+            int: The number of orphaned objects.
+        """
+        return self.__orphan_query(cls, [func.count(cls.id)]).scalar()
+
+    def delete_orphans(self, cls, ids=None):
+        """
+        Deletes orphaned prices, products or relations.
+
+        Only objects that are still orphaned are deleted, so a stale selection cannot
+        delete an object whose parent came back. Orphaned products are deleted with
+        their prices, deals and relations, see `bulk_delete`.
+
+        Args:
+            cls (type): Price, Product or ProductRelation.
+            ids (iterable, optional): The IDs of the objects to delete. Defaults to every orphan.
+
+        Returns:
+            int: The number of orphaned objects deleted.
+        """
+        from models.product import Product
+        if ids is None:
+            selected = [row[0] for row in self.__orphan_query(cls, [cls.id])]
+        else:
+            ids = list(ids)
+            selected = []
+            for i in range(0, len(ids), CHUNK_SIZE):
+                selected += [row[0] for row in self.__orphan_query(cls, [cls.id]).
+                             filter(cls.id.in_(ids[i:i + CHUNK_SIZE]))]
+        if cls is Product:
+            return self.bulk_delete(Product, selected)['products']
+        deleted = 0
+        try:
+            for i in range(0, len(selected), CHUNK_SIZE):
+                deleted += self.__session.query(cls).filter(cls.id.in_(selected[i:i + CHUNK_SIZE])).\
+                    delete(synchronize_session=False)
+            self.__counters.adjust(self.__session, {cls.__name__: -deleted})
+            self.__session.commit()
+        except Exception:
+            self.__session.rollback()
+            raise
+        selected = set(selected)
+        for obj in list(self.__session.identity_map.values()):
+            if obj.id in selected:
+                self.__session.expunge(obj)
+        return deleted
+
+    def reassign_orphans(self, cls, ids, parent_id):
+        """
+        Attaches orphaned prices to a product or orphaned products to a store.
+
+        One UPDATE per chunk of IDs sets the parent of the objects that are still
+        orphaned. The latest price snapshot and the deals of a product receiving
+        prices are refreshed.
+
+        Args:
+            cls (type): Price or Product.
+            ids (iterable): The IDs of the objects to reassign.
+            parent_id (str): The ID of the product or store.
+
+        Returns:
+            int: The number of objects reassigned.
+
+        Raises:
+            ValueError: If cls is neither Price nor Product, or the parent does not exist.
+        """
+        from models.price import Price
+        from models.product import Product
+        from models.store import Store
+        parents = {Price: (Price.product_id, Product), Product: (Product.store_id, Store)}
+        if cls not in parents:
+            raise ValueError(f"Cannot reassign {cls.__name__} objects")
+        column, parent_cls = parents[cls]
+        parent = self.__session.get(parent_cls, parent_id)
+        if parent is None:
+            raise ValueError(f"{parent_cls.__name__} {parent_id} not found")
+        ids = list(ids)
+        reassigned = 0
+        try:
+            for i in range(0, len(ids), CHUNK_SIZE):
+                orphaned = self.__orphan_query(cls, [cls.id]).filter(cls.id.in_(ids[i:i + CHUNK_SIZE])).subquery()
+                reassigned += self.__session.query(cls).filter(cls.id.in_(self.__session.query(orphaned.c.id))).\
+                    update({column: parent_id}, synchronize_session=False)
+            if cls is Price and reassigned > 0:
+                self.__session.expire(parent)
+                parent.refresh_latest_price()
+                self.refresh_deals([parent.id], datetime.min)
+            self.__session.commit()
+        except Exception:
+            self.__session.rollback()
+            raise
+        for obj in list(self.__session.identity_map.values()):
+            if obj.id in ids:
+                self.__session.expire(obj)
+        return reassigned
 
     def reload(self):
         """
@@ -174,14 +726,66 @@ class DBStorage:
         This method performs the following steps:
         1. Prints the current engine being used.
         2. Creates all tables defined in the Base metadata using the engine.
-        3. Configures a session factory with the engine and sets `expire_on_commit` to False.
-        4. Initializes a scoped session using the session factory and assigns it to `self.__session`.
+        3. Adds the columns and indexes missing from existing tables, and sets up the
+           full-text index of the product names.
+        4. Configures a session factory with the engine and sets `expire_on_commit` to False;
+           its sessions bump the data version when they commit changes.
+        5. Initializes a scoped session using the session factory and assigns it to `self.__session`.
+        6. Backfills the latest price snapshot if its columns were just added, the
+           recent daily deals if their table was just created, and the object counters
+           if theirs was.
         """
+        # Importing the models registers their tables on the metadata
+        from models.class_store import classes
         logHandler.debug(f"Engine = {self.__engine}")
+        inspector = inspect(self.__engine)
+        backfill_deals = inspector.has_table('prices') and not inspector.has_table(Deal.__tablename__)
+        backfill_counts = not inspector.has_table(object_counts.name)
         Base.metadata.create_all(self.__engine)
+        added = add_missing_columns(self.__engine, Base.metadata)
+        add_missing_indexes(self.__engine, Base.metadata)
+        self.__search_index = search_index_for(self.__engine)
+        if self.__search_index is not None:
+            self.__search_index.setup()
+        self.__window_functions = supports_window_functions(self.__engine)
         sess_factory = sessionmaker(bind=self.__engine, expire_on_commit=False)
+        event.listen(sess_factory, 'after_flush', self.__changed)
+        event.listen(sess_factory, 'do_orm_execute', self.__executed)
+        event.listen(sess_factory, 'after_commit', self.__committed)
+        event.listen(sess_factory, 'after_rollback', self.__rolled_back)
+        self.__counters = ObjectCounters(self.__engine, classes)
+        self.__counters.register(sess_factory)
         Session = scoped_session(sess_factory)
         self.__session = Session
+        if ('products', 'latest_price_id') in added:
+            self.refresh_latest_prices()
+        if backfill_deals:
+            self.refresh_deals()
+            self.__session.commit()
+        if backfill_counts:
+            self.__counters.reconcile()
+
+    @staticmethod
+    def __changed(session, flush_context):
+        """Marks a session whose flush wrote changes."""
+        session.info['changed'] = True
+
+    @staticmethod
+    def __executed(orm_execute_state):
+        """Marks a session running a bulk INSERT, UPDATE or DELETE statement."""
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            orm_execute_state.session.info['changed'] = True
+
+    @staticmethod
+    def __committed(session):
+        """Bumps the data version when a session committed changes."""
+        if session.info.pop('changed', False):
+            data_version.bump()
+
+    @staticmethod
+    def __rolled_back(session):
+        """Forgets the changes of a rolled back session."""
+        session.info.pop('changed', None)
 
     def close(self):
         """
@@ -200,12 +804,13 @@ class DBStorage:
         """
         self.__session.rollback()
 
-    def get(self, cls, **kwargs):
+    def get(self, cls, load=(), **kwargs):
         """
         Retrieves objects based on the class type and specified filter criteria.
 
         Args:
             cls (type): The class type of the objects to retrieve.
+            load (iterable, optional): The relationships loaded with the objects, see `all`.
             **kwargs: Arbitrary keyword arguments used as filter criteria.
 
         Returns:
@@ -214,39 +819,103 @@ class DBStorage:
         from models.class_store import classes  
         if cls not in classes.values():
             return None
-        filtered_cls = self.__session.query(cls).filter_by(**kwargs).all()
+        options = self.__loader_options(cls, load)
+        filtered_cls = self.__session.query(cls).options(*options).filter_by(**kwargs).all()
         if (len(filtered_cls) < 1):
             return None
         return filtered_cls
 
-    def count(self, cls=None):
+    def count(self, cls=None, **kwargs):
         """
         Count the number of objects in storage.
         Args:
             cls (type, optional): The class type to count objects for. If None, count all objects.
+            **kwargs: Arbitrary keyword arguments used as filter criteria when cls is given.
         Returns:
             int: The number of objects in storage.
         """
-        from models.class_store import classes
-        all_class = classes.values()
-
         if not cls:
-            count = 0
-            for clas in all_class:
-                count += self.__session.query(clas).count()
+            count = sum(self.counts().values())
+        elif not kwargs:
+            count = self.counts().get(cls.__name__)
+            if count is None:
+                count = self.__session.query(func.count(cls.id)).select_from(cls).scalar()
         else:
-            count = self.__session.query(cls).count()
+            count = self.__session.query(func.count(cls.id)).select_from(cls).filter_by(**kwargs).scalar()
 
         return count
+
+    def counts(self):
+        """
+        Returns the number of objects of every class.
+
+        The counts are read from the object_counts table, which the inserts and
+        deletes of the session keep up to date, so no model table is scanned. The
+        counters are recounted from the tables every FLAYERFX_COUNTS_RECONCILE seconds.
+
+        Returns:
+            dict: The number of objects by class name.
+        """
+        return self.__counters.read(self.__session)
+
+    def reconcile_counts(self):
+        """
+        Recounts the object counters from the tables, e.g. after rows were changed
+        outside of the storage.
+
+        Returns:
+            dict: The number of objects by class name.
+        """
+        return self.__counters.reconcile()
+
+    def page(self, cls, order_by='id', after=None, limit=100, load=(), **kwargs):
+        """
+        Retrieves one page of objects using keyset pagination.
+
+        The objects are ordered by `order_by` and then by id, and the page starts
+        right after the `after` key, so the cost of a page does not depend on how
+        many pages come before it. NULL values sort first, as in SQLite and MySQL.
+
+        Args:
+            cls (type): The class type of the objects to retrieve.
+            order_by (str, optional): The attribute to order by. Defaults to 'id'.
+            after (list, optional): The [order_by value, id] of the last object of the previous page.
+            limit (int, optional): The maximum number of objects to return. Defaults to 100.
+            load (iterable, optional): The relationships loaded with the objects, see `all`.
+            **kwargs: Arbitrary keyword arguments used as filter criteria.
+
+        Returns:
+            list: The objects of the page.
+        """
+        column = getattr(cls, order_by)
+        query = self.__session.query(cls).options(*self.__loader_options(cls, load)).filter_by(**kwargs)
+        if after is not None:
+            if order_by == 'id':
+                query = query.filter(cls.id > after[-1])
+            elif after[0] is None:
+                query = query.filter(or_(column.isnot(None),
+                                         and_(column.is_(None), cls.id > after[1])))
+            else:
+                query = query.filter(or_(column > after[0],
+                                         and_(column == after[0], cls.id > after[1])))
+        return query.order_by(column, cls.id).limit(limit).all()
     
-    def search(self, cls, **kwargs):
+    def search(self, cls, load=(), **kwargs):
         """
         Search for an object in the database by keyword arguments.
 
         Args:
             cls (type): The class type of the object to search for.
+            load (iterable, optional): The relationships loaded with the objects, see `all`.
             **kwargs: Arbitrary keyword arguments used as search filters.
 
+        The candidate products are read from the full-text index of the product
+        names (SQLite FTS5 or MySQL FULLTEXT) and filtered by the other keyword
+        arguments, then scored with `match_score`. If the index cannot be used
+        the candidates are found with LIKE filters on every keyword argument.
+        A search returning FLAYERFX_SEARCH_LIMIT candidates is logged, as products
+        past the limit are not scored.
+
         Returns:
             list: A list of objects that match the search criteria, sorted by match score.
                   Returns None if no objects match the criteria or if the match score is below the threshold.
@@ -255,14 +924,42 @@ class DBStorage:
             AttributeError: If the class does not have the specified attribute in kwargs.
         """
         from models.class_store import classes
+        from models.product import Product
         if cls not in classes.values():
             return None
-        filters = [getattr(cls, key).like(f"%{value}%") for key, value in kwargs.items()]
-        filtered_cls = self.__session.query(cls).filter(or_(*filters)).all()
-        filtered_results = [(match_score(kwargs['name'], value.name), value) for value in filtered_cls]
+        options = self.__loader_options(cls, load)
+        ids = None
+        if cls is Product and self.__search_index is not None and self.__search_index.available:
+            ids = self.__search_index.search(self.__session, kwargs['name'])
+            if ids is not None and len(ids) >= SEARCH_LIMIT:
+                logHandler.warning(f"Search for {kwargs['name']!r} reached FLAYERFX_SEARCH_LIMIT, "
+                                   f"only the {SEARCH_LIMIT} best indexed candidates are scored")
+        if ids is None:
+            filters = [getattr(cls, key).like(f"%{value}%") for key, value in kwargs.items()]
+            filtered_cls = self.__session.query(cls).options(*options).filter(or_(*filters)).all()
+        else:
+            filters = [getattr(cls, key) == value for key, value in kwargs.items() if key != 'name']
+            filtered_cls = []
+            for i in range(0, len(ids), CHUNK_SIZE):
+                chunk = ids[i:i + CHUNK_SIZE]
+                filtered_cls.extend(self.__session.query(cls).options(*options).filter(cls.id.in_(chunk), *filters))
+        filtered_results = rank(kwargs['name'], filtered_cls, inclusive=False)
         if (len(filtered_results) < 1):
             return None
-        return [i[1] for i in sorted(filtered_results, key=lambda a: a[0]) if i[0] > SCORETHRESHOLD]
+        return filtered_results
+
+    def rebuild_search_index(self):
+        """
+        Rebuilds the full-text index of the product names.
+
+        Returns:
+            bool: False if the database has no usable full-text index.
+        """
+        if self.__search_index is None or not self.__search_index.setup():
+            return False
+        self.__session.commit()
+        self.__search_index.rebuild()
+        return True
 
     def get_deals(self, dateleft, dateright):
         """
@@ -303,6 +1000,19 @@ class DBStorage:
         Returns:
             List[Price]: List of Price records.
         """
+        return self.__recent_discounted_query(dateleft, dateright).all()
+
+    def __recent_discounted_query(self, dateleft, dateright):
+        """
+        Builds the query of `get_recent_discounted_prices`.
+
+        Args:
+            dateleft (datetime): The start date for the fetched_at filter.
+            dateright (datetime): The end date for the fetched_at filter.
+
+        Returns:
+            Query: The query of the most recent discounted Price of each product.
+        """
         from models.price import Price
         # Create an alias for the Price table
         PriceAlias = aliased(Price)
@@ -334,11 +1044,444 @@ class DBStorage:
                 )
             )
             .order_by(Price.amount)
-            .all()
         )
 
         return recent_prices
     
+    def refresh_latest_prices(self):
+        """
+        Rebuilds the latest price snapshot of every product.
+
+        The most recent price of each product is found with a single grouped query
+        and written back to the products with a bulk update; the snapshot of the
+        products without any price is cleared with one UPDATE.
+
+        Returns:
+            int: The number of products that have a latest price.
+        """
+        from models.price import Price
+        from models.product import Product
+        subquery = (
+            self.__session.query(
+                Price.product_id,
+                func.max(Price.fetched_at).label('max_fetched_at')
+            )
+            .group_by(Price.product_id)
+            .subquery()
+        )
+        latest = (
+            self.__session.query(Price.id, Price.product_id, Price.amount,
+                                 Price.fetched_at, Price.is_discount)
+            .join(
+                subquery,
+                and_(
+                    Price.product_id == subquery.c.product_id,
+                    Price.fetched_at == subquery.c.max_fetched_at
+                )
+            )
+            .all()
+        )
+        mappings = {}
+        for row in latest:
+            mappings[row.product_id] = {'id': row.product_id,
+                                        'latest_price_id': row.id,
+                                        'latest_amount': row.amount,
+                                        'latest_fetched_at': row.fetched_at,
+                                        'latest_is_discount': row.is_discount}
+        logHandler.info(f"Refreshing the latest price of {len(mappings)} products")
+        self.__session.bulk_update_mappings(Product, list(mappings.values()))
+        has_prices = self.__session.query(Price.id).filter(Price.product_id == Product.id).exists()
+        self.__session.query(Product).filter(Product.latest_price_id.isnot(None), ~has_prices).\
+            update({Product.latest_price_id: None, Product.latest_amount: None,
+                    Product.latest_fetched_at: None, Product.latest_is_discount: None},
+                   synchronize_session=False)
+        self.__session.commit()
+        return len(mappings)
+
+    def refresh_deals(self, product_ids=None, since=None):
+        """
+        Rebuilds the daily deals of products from their price history.
+
+        The products, their prices and their deals are read with one IN query
+        each per chunk of products. Deals are added or updated for every day since
+        `since` with a discounted price, and deals of days without one are deleted.
+        The changes are committed by the next save.
+
+        Args:
+            product_ids (iterable, optional): The IDs of the products. Defaults to every
+                                              product with a discounted price since `since`.
+            since (datetime, optional): The start of the first day refreshed. Defaults to
+                                        the start of yesterday.
+
+        Returns:
+            int: The number of deals of the products since `since`.
+        """
+        from models.price import Price
+        from models.product import Product
+        if since is None:
+            since = deals_since()
+        since = datetime.combine(since.date(), datetime.min.time())
+        if product_ids is None:
+            product_ids = [row[0] for row in self.__session.query(Price.product_id).filter(
+                Price.is_discount == True, Price.fetched_at >= since).distinct()]
+        product_ids = list(set(product_ids))
+        count = 0
+        for i in range(0, len(product_ids), CHUNK_SIZE):
+            chunk = product_ids[i:i + CHUNK_SIZE]
+            products = self.__session.query(Product.id, Product.store_id, Product.name).\
+                filter(Product.id.in_(chunk)).all()
+            prices = {}
+            for row in self.__session.query(Price.id, Price.product_id, Price.amount,
+                                            Price.is_discount, Price.fetched_at).\
+                    filter(Price.product_id.in_(chunk)).order_by(Price.fetched_at.desc()):
+                prices.setdefault(row.product_id, []).append(row)
+            planned = Deal.plan(products, prices, since)
+            existing = {(deal.product_id, deal.day): deal for deal in self.__session.query(Deal).filter(
+                Deal.product_id.in_(chunk), Deal.day >= deal_day(since))}
+            for key, values in planned.items():
+                deal = existing.pop(key, None)
+                if deal is None:
+                    self.__session.add(Deal(**values))
+                else:
+                    for attr, value in values.items():
+                        setattr(deal, attr, value)
+            for deal in existing.values():
+                self.__session.delete(deal)
+            count += len(planned)
+        return count
+
+    def get_daily_deals(self, dateleft, dateright):
+        """
+        Reads the materialized daily deals between two dates.
+
+        Only the most recent deal of each product is kept.
+
+        Args:
+            dateleft (date or datetime): The first day.
+            dateright (date or datetime): The last day.
+
+        Returns:
+            list: The Deal objects, ordered by ascending amount.
+        """
+        deals = self.__session.query(Deal).\
+            filter(Deal.day.between(deal_day(dateleft), deal_day(dateright))).\
+            order_by(Deal.amount).all()
+        latest = {}
+        for deal in deals:
+            if deal.product_id not in latest or deal.day > latest[deal.product_id].day:
+                latest[deal.product_id] = deal
+        return [deal for deal in deals if latest[deal.product_id] is deal]
+
+    def bulk_ingest(self, store_id, items, batch_size=BATCH_SIZE):
+        """
+        Ingests scraped items of a store with set-based statements.
+
+        For every batch the products are resolved by (store_id, reference) with a
+        single query that also returns their latest price snapshot. The planned
+        product and price inserts, fetched_at bumps and snapshot updates are then
+        issued as executemany statements. The daily deals of the products whose
+        discounted prices were written are refreshed once all batches are applied.
+        All batches share one transaction.
+
+        Args:
+            store_id (str): The ID of the store the items belong to.
+            items (list): Scraped items in the `data_structure` format.
+            batch_size (int, optional): The number of items handled per batch.
+
+        Returns:
+            dict: The ingestion report with the per-batch counts and wall times.
+
+        Raises:
+            Exception: Any database error, after the transaction was rolled back.
+        """
+        from models.price import Price
+        from models.product import Product
+        stats = new_stats(store_id)
+        known = {}
+        deals = {}
+        started = perf_counter()
+        try:
+            for start in range(0, len(items), batch_size):
+                batch_started = perf_counter()
+                batch = items[start:start + batch_size]
+                references = set()
+                for item in batch:
+                    try:
+                        references.add(int(item['item_reference']))
+                    except (KeyError, TypeError, ValueError):
+                        continue
+                references = list(references.difference(known.keys()))
+                for i in range(0, len(references), CHUNK_SIZE):
+                    rows = self.__session.query(
+                        Product.id, Product.reference, Product.latest_price_id,
+                        Product.latest_amount, Product.latest_fetched_at,
+                        Product.latest_is_discount
+                    ).filter(
+                        Product.store_id == store_id,
+                        Product.reference.in_(references[i:i + CHUNK_SIZE])
+                    ).all()
+                    for row in rows:
+                        known[int(row.reference)] = {'id': row.id,
+                                                     'latest_price_id': row.latest_price_id,
+                                                     'latest_amount': row.latest_amount,
+                                                     'latest_fetched_at': row.latest_fetched_at,
+                                                     'latest_is_discount': row.latest_is_discount}
+                plan = plan_batch(store_id, batch, known, datetime.utcnow())
+                self.__session.bulk_insert_mappings(Product, plan['products'])
+                self.__session.bulk_insert_mappings(Price, plan['prices'])
+                self.__counters.adjust(self.__session, {'Product': len(plan['products']),
+                                                        'Price': len(plan['prices'])})
+                self.__session.bulk_update_mappings(Price, plan['bumps'])
+                self.__session.bulk_update_mappings(Product, list(plan['snapshots'].values()))
+                for product_id, fetched_at in plan['deals'].items():
+                    deals[product_id] = min(fetched_at, deals.get(product_id, fetched_at))
+                batch_stats = {'items': len(batch),
+                               'products_created': len(plan['products']),
+                               'prices_created': len(plan['prices']),
+                               'prices_bumped': len(plan['bumps']),
+                               'skipped': plan['skipped'],
+                               'seconds': round(perf_counter() - batch_started, 4)}
+                for key in ['items', 'products_created', 'prices_created', 'prices_bumped', 'skipped']:
+                    stats[key] += batch_stats[key]
+                stats['batches'].append(batch_stats)
+                logHandler.debug(f"Ingested batch {len(stats['batches'])} of store {store_id}: {batch_stats}")
+            if deals:
+                self.refresh_deals(deals.keys(), min(deals.values()))
+            self.__session.commit()
+        except Exception:
+            self.__session.rollback()
+            raise
+        stats['seconds'] = round(perf_counter() - started, 4)
+        return stats
+
+    def __price_rows(self, product_ids):
+        """
+        Reads the columns of the prices of products needed to build their segments.
+
+        Args:
+            product_ids (list): The IDs of the products.
+
+        Returns:
+            list: The price rows, sorted by product ID, fetched_at and ID.
+        """
+        from models.price import Price
+        return self.__session.query(
+            Price.id, Price.product_id, Price.amount, Price.is_discount,
+            Price.fetched_at, Price.first_seen_at, Price.created_at
+        ).filter(Price.product_id.in_(product_ids)).\
+            order_by(Price.product_id, Price.fetched_at, Price.id).all()
+
+    def price_segments(self, product_id):
+        """
+        Returns the price history of a product as segments.
+
+        Consecutive prices with the same amount and discount flag form one
+        segment, whether or not the history was compacted.
+
+        Args:
+            product_id (str): The ID of the product.
+
+        Returns:
+            list: The segments of `to_segment`, most recent first.
+        """
+        runs = price_runs(self.__price_rows([product_id]))
+        return [to_segment(run) for run in reversed(runs)]
+
+    def compact_prices(self, product_ids=None):
+        """
+        Collapses the runs of consecutive equal prices of products into single prices.
+
+        The last price of each run is kept with the start of the run as its
+        first_seen_at, and the other prices are deleted. Latest price snapshots
+        and daily deals pointing to a deleted price are moved to the kept one.
+        Products are handled in chunks, each committed on its own.
+
+        Args:
+            product_ids (iterable, optional): The IDs of the products. Defaults to every
+                                              product with more than one price.
+
+        Returns:
+            dict: The number of products, segments and deleted prices, and the seconds it took.
+        """
+        from models.price import Price
+        from models.product import Product
+        started = perf_counter()
+        if product_ids is None:
+            product_ids = [row[0] for row in self.__session.query(Price.product_id).
+                           group_by(Price.product_id).having(func.count(Price.id) > 1)]
+        product_ids = list(set(product_ids))
+        stats = {'products': len(product_ids), 'segments': 0, 'deleted': 0}
+        for i in range(0, len(product_ids), CHUNK_SIZE):
+            plan = plan_compaction(self.__price_rows(product_ids[i:i + CHUNK_SIZE]))
+            deleted = list(plan['deleted'])
+            try:
+                self.__session.bulk_update_mappings(Price, plan['updates'])
+                for j in range(0, len(deleted), CHUNK_SIZE):
+                    chunk = deleted[j:j + CHUNK_SIZE]
+                    for product in self.__session.query(Product).filter(Product.latest_price_id.in_(chunk)):
+                        product.latest_price_id = plan['deleted'][product.latest_price_id]
+                    for deal in self.__session.query(Deal).filter(Deal.price_id.in_(chunk)):
+                        deal.price_id = plan['deleted'][deal.price_id]
+                    removed = self.__session.query(Price).filter(Price.id.in_(chunk)).\
+                        delete(synchronize_session=False)
+                    self.__counters.adjust(self.__session, {'Price': -removed})
+                self.__session.commit()
+            except Exception:
+                self.__session.rollback()
+                raise
+            stats['segments'] += plan['segments']
+            stats['deleted'] += len(deleted)
+        stats['seconds'] = round(perf_counter() - started, 4)
+        logHandler.info(f"Compacted prices: {stats}")
+        return stats
+
+    def archive_prices(self, before=None, batch_size=BATCH_SIZE * 10):
+        """
+        Moves the prices fetched before a date to the monthly archive files.
+
+        The latest price of a product is never archived, so `latest_price` keeps
+        working. Prices are moved in batches, oldest first; each batch is written
+        to the archive before it is deleted and committed, so an interrupted move
+        is completed by the next one without losing or duplicating prices.
+
+        Args:
+            before (datetime, optional): Defaults to FLAYERFX_ARCHIVE_DAYS days ago.
+            batch_size (int, optional): The number of prices moved per batch.
+
+        Returns:
+            dict: The number of archived prices, the cutoff date and the seconds it took.
+        """
+        from models.price import Price
+        from models.product import Product
+        started = perf_counter()
+        if before is None:
+            before = archive_horizon()
+        is_latest = self.__session.query(Product.id).filter(Product.latest_price_id == Price.id).exists()
+        columns = [getattr(Price, column) for column in COLUMNS]
+        archived = 0
+        while True:
+            rows = self.__session.query(*columns).filter(
+                Price.fetched_at < before, ~is_latest
+            ).order_by(Price.fetched_at).limit(batch_size).all()
+            if not rows:
+                break
+            price_archive.write([dict(zip(COLUMNS, row)) for row in rows], before)
+            ids = [row.id for row in rows]
+            try:
+                for i in range(0, len(ids), CHUNK_SIZE):
+                    removed = self.__session.query(Price).filter(Price.id.in_(ids[i:i + CHUNK_SIZE])).\
+                        delete(synchronize_session=False)
+                    self.__counters.adjust(self.__session, {'Price': -removed})
+                self.__session.commit()
+            except Exception:
+                self.__session.rollback()
+                raise
+            archived += len(ids)
+            logHandler.debug(f"Archived {archived} prices fetched before {before}")
+        if archived == 0:
+            price_archive.write([], before)
+        return {'archived': archived, 'before': before.isoformat(),
+                'seconds': round(perf_counter() - started, 4)}
+
+    def price_history(self, product_id, since=None, until=None):
+        """
+        Returns the prices of a product fetched in a date range.
+
+        The archive is only read when the range starts before the archive cutoff.
+
+        Args:
+            product_id (str): The ID of the product.
+            since (datetime, optional): The earliest fetched_at. Defaults to the whole history.
+            until (datetime, optional): The latest fetched_at. Defaults to now.
+
+        Returns:
+            list: The Price objects, most recent first; archived ones have `archived` set.
+        """
+        from models.price import Price
+        query = self.__session.query(Price).filter(Price.product_id == product_id)
+        if since is not None:
+            query = query.filter(Price.fetched_at >= since)
+        if until is not None:
+            query = query.filter(Price.fetched_at <= until)
+        prices = query.order_by(Price.fetched_at.desc()).all()
+        cutoff = price_archive.cutoff()
+        if cutoff is not None and (since is None or since < cutoff):
+            archived = [to_price(row) for row in price_archive.history(product_id, since, until)]
+            prices = sorted(prices + archived, key=lambda p: p.fetched_at, reverse=True)
+        return prices
+
+    def price_stats(self, product_ids, count=ROLLING_COUNT):
+        """
+        Computes the price statistics of many products.
+
+        With window functions, the statistics of each chunk of products are
+        computed by the database in one query; otherwise the prices of the chunk
+        are read in one query and the statistics computed in Python.
+
+        Args:
+            product_ids (iterable): The IDs of the products.
+            count (int, optional): The number of most recent prices in the rolling average.
+
+        Returns:
+            dict: For each product ID, its price count, min, max, rolling_avg and last_change.
+        """
+        from models.price import Price
+        product_ids = list(set(product_ids))
+        stats = {product_id: empty_stats() for product_id in product_ids}
+        for i in range(0, len(product_ids), CHUNK_SIZE):
+            chunk = product_ids[i:i + CHUNK_SIZE]
+            if self.__window_functions:
+                for row in self.__session.execute(window_stats_query(Price, chunk, count)):
+                    stats[row.product_id] = {'count': row.count, 'min': row.min, 'max': row.max,
+                                             'rolling_avg': row.rolling_avg or 0,
+                                             'last_change': row.last_change}
+            else:
+                prices = {}
+                for row in self.__session.query(Price.id, Price.product_id, Price.amount,
+                                                Price.fetched_at, Price.first_seen_at).\
+                        filter(Price.product_id.in_(chunk)):
+                    prices.setdefault(row.product_id, []).append(row)
+                for product_id, rows in prices.items():
+                    stats[product_id] = stats_from_prices(rows, count)
+        return stats
+
+    def explain(self):
+        """
+        Returns the query plans of the main storage queries.
+
+        The queries are compiled for the dialect of the engine and prefixed with
+        EXPLAIN QUERY PLAN on SQLite or EXPLAIN on MySQL, with placeholder values.
+
+        Returns:
+            dict: The rows of the plan of each query by query name.
+        """
+        from models.price import Price
+        from models.product import Product
+        now = datetime.utcnow()
+        queries = {
+            'products_by_reference': self.__session.query(Product.id).filter(
+                Product.store_id == '', Product.reference.in_([0, 1])),
+            'product_prices': self.__session.query(Price).filter(
+                Price.product_id == '').order_by(Price.fetched_at.desc()),
+            'latest_price': self.__session.query(Price).filter(Price.id == ''),
+            'recent_discounted_prices': self.__recent_discounted_query(now, now),
+            'daily_deals': self.__session.query(Deal).filter(
+                Deal.day.between(deal_day(now), deal_day(now))).order_by(Deal.amount),
+            'orphaned_prices': self.__orphan_query(Price, [Price.id]),
+        }
+        dialect = self.__engine.dialect
+        prefix = 'EXPLAIN QUERY PLAN ' if dialect.name == 'sqlite' else 'EXPLAIN '
+        plans = {}
+        for name, query in queries.items():
+            compiled = query.statement.compile(dialect=dialect, compile_kwargs={'render_postcompile': True})
+            if compiled.positional:
+                params = tuple(compiled.params[key] for key in compiled.positiontup)
+            else:
+                params = compiled.params
+            rows = self.__session.connection().exec_driver_sql(prefix + str(compiled), params)
+            plans[name] = [tuple(row) for row in rows]
+        return plans
+
     def get_session(self):
         """
         Get the current session.
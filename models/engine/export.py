@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+"""
+Module: export
+This module holds the storage independent part of the dataset exports. The
+storage engines yield the rows of a class as plain dicts holding the
+EXPORT_COLUMNS of the class, one batch of objects at a time; the functions
+of this module turn that stream of rows into NDJSON or CSV lines, gzipped
+on the fly if asked, without ever holding more than one row.
+Public Functions:
+    export_lines(rows, name, fmt): Serializes rows to NDJSON or CSV lines.
+    gzip_chunks(chunks): Compresses a stream of text chunks to a gzip stream.
+Usage:
+    rows = storage.export(Price, store_id=store_id)
+    for chunk in gzip_chunks(export_lines(rows, 'Price', 'csv')):
+        out.write(chunk)
+"""
+
+import csv
+from datetime import datetime
+from io import StringIO
+import json
+import zlib
+
+# Number of objects read from the storage per batch of an export
+EXPORT_BATCH_SIZE = 1000
+# Export formats
+FORMATS = ('ndjson', 'csv')
+# Columns of the exported rows of each class, in CSV order
+EXPORT_COLUMNS = {
+    'Product': ['id', 'store_id', 'name', 'link', 'reference', 'latest_price_id', 'latest_amount',
+                'latest_fetched_at', 'latest_is_discount', 'created_at', 'updated_at'],
+    'Price': ['id', 'product_id', 'amount', 'is_discount', 'fetched_at', 'first_seen_at',
+              'created_at', 'updated_at'],
+    'ProductRelation': ['id', 'product_id', 'related_product_id', 'similarity_score',
+                        'created_at', 'updated_at'],
+}
+# Attribute filtered by the date range of an export of each class
+EXPORT_DATE_COLUMNS = {'Product': 'created_at', 'Price': 'fetched_at', 'ProductRelation': 'created_at'}
+
+
+def _value(value):
+    """Returns a row value in its exported form, dates in ISO-8601."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def export_lines(rows, name, fmt):
+    """
+    Serializes rows to NDJSON or CSV lines, one row at a time.
+
+    Args:
+        rows (iterable): The rows, as dicts holding the EXPORT_COLUMNS of the class.
+        name (str): The class name of the rows.
+        fmt (str): 'ndjson' or 'csv'. CSV starts with a header line.
+
+    Yields:
+        str: One line per row, ending with a newline.
+
+    Raises:
+        ValueError: If the format is unknown.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt}")
+    columns = EXPORT_COLUMNS[name]
+    if fmt == 'ndjson':
+        for row in rows:
+            yield json.dumps({column: _value(row.get(column)) for column in columns}) + '\n'
+        return
+    buffer = StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([_value(row.get(column)) for column in columns])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # The header of an export without rows
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def gzip_chunks(chunks, level=6):
+    """
+    Compresses a stream of text chunks to a gzip stream.
+
+    Args:
+        chunks (iterable): The text chunks.
+        level (int, optional): The compression level. Defaults to 6.
+
+    Yields:
+        bytes: The compressed data, whenever the compressor outputs some.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
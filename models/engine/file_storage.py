@@ -7,15 +7,37 @@ Classes:
     FileStorage: A class responsible for storing and retrieving objects
     from a JSON file.
 Public Functions:
-    all(cls=None): Returns the dictionary __objects.
+    all(cls=None, load=()): Returns the dictionary __objects.
     new(obj): Sets in __objects the obj with key <obj class name>.id.
-    save(): Serializes __objects to the JSON file (path: __file_path).
-    reload(): Deserializes the JSON file to __objects.
+    save(): Serializes __objects to the JSON file (path: __file_path), or appends the
+        changed objects to its journal when FLAYERFX_FILE_JOURNAL is set.
+    compact(): Rewrites the JSON file as NDJSON with every object and empties the journal.
+    reload(): Streams the JSON file and replays its journal to __objects.
+    load_timings(): Returns the time the last reload spent per class.
     delete(obj=None): Deletes obj from __objects if it’s inside.
+    bulk_delete(cls, ids, progress=None): Deletes stores or products and everything attached with a single save.
+    merge_products(store_ids=None, dry_run=False, progress=None): Merges the products sharing a store and reference.
+    orphans(cls, after=None, limit=100): Returns one page of the prices, products or relations without a parent.
+    count_orphans(cls): Counts the prices, products or relations without a parent.
+    delete_orphans(cls, ids=None): Deletes orphaned objects with a single save.
+    reassign_orphans(cls, ids, parent_id): Attaches orphaned prices or products to a new parent.
+    export(cls, store_id=None, since=None, until=None, batch_size=EXPORT_BATCH_SIZE): Streams the rows of a class.
     close(): Calls reload() method for deserializing the JSON file to objects.
-    get(cls, **kwargs): Returns the object based on the class name and its ID, or None if not found.
+    get(cls, load=(), **kwargs): Returns the object based on the class name and its ID, or None if not found.
+    related(cls, attr, value): Returns the related objects of a relationship property, cached until a change.
     count(cls=None): Counts the number of objects in storage.
-    search(cls, **kwargs): Searches for an object in the database by kwargs.
+    counts(): Returns the number of objects of every class.
+    search(cls, load=(), **kwargs): Searches for an object in the database by kwargs.
+    rebuild_search_index(): Rebuilds the word index of the product names.
+    refresh_latest_prices(): Rebuilds the latest price snapshot of every product.
+    refresh_deals(product_ids=None, since=None): Rebuilds the daily deals of products.
+    get_daily_deals(dateleft, dateright): Reads the materialized daily deals between two dates.
+    price_segments(product_id): Returns the price history of a product as segments.
+    compact_prices(product_ids=None): Collapses runs of equal prices into segments.
+    archive_prices(before=None): Moves old prices to the monthly archive files.
+    price_history(product_id, since=None, until=None): Reads the prices of a product from both tiers.
+    price_stats(product_ids, count=ROLLING_COUNT): Computes the price statistics of many products.
+    bulk_ingest(store_id, items, batch_size=BATCH_SIZE): Ingests scraped items with a single save.
 Usage:
     This module is used to manage the storage of objects in a JSON file,
     allowing for serialization and deserialization of objects.
@@ -29,14 +51,63 @@ Usage:
         result = storage.get(Store, id="123")
         count = storage.count(Product)
         search_results = storage.search(Product, name="example")
+Environment Variables:
+    FLAYERFX_FILE_JOURNAL: If "1", save() appends to file.json.journal instead of
+        rewriting file.json. Defaults to "0".
+    FLAYERFX_FILE_JOURNAL_COMPACT: Number of journal records after which the journal
+        is compacted into file.json. Defaults to 5000.
+    FLAYERFX_FILE_LAZY: If "1", reload() only instantiates the objects of a class
+        when the class is first accessed. Defaults to "0".
 """
 
+from functools import wraps
 import json
+from datetime import datetime, timedelta
 from hashlib import md5
+import os
+from threading import RLock, get_ident, local
+from time import perf_counter
 
-from models.class_store import classes
-from models.engine.matchscore import match_score, SCORETHRESHOLD
+from models.base_model import BaseModel
+from models.deal import Deal, deal_day, deals_since
+from models.engine.archive import COLUMNS, archive_horizon, price_archive, to_price
+from models.engine.data_version import data_version
+from models.engine.export import EXPORT_BATCH_SIZE, EXPORT_COLUMNS, EXPORT_DATE_COLUMNS
+from models.engine.ingest import BATCH_SIZE, new_stats, plan_batch
+from models.engine.merge import new_report, plan_merge
+from models.engine.price_stats import ROLLING_COUNT, stats_from_prices
+from models.engine.search_index import MemorySearchIndex, rank
+from models.engine.segments import plan_compaction, price_runs, to_segment
 
+# Attributes with a hash index, used by get to avoid scanning a whole class
+INDEXED_ATTRIBUTES = ('id', 'store_id', 'product_id', 'related_product_id', 'reference', 'name', 'day')
+# Append the objects changed since the last save to a journal instead of rewriting the file
+JOURNAL = os.getenv('FLAYERFX_FILE_JOURNAL', '0').lower() in ('1', 'true', 'yes')
+# Number of journal records after which the journal is compacted into the JSON file
+COMPACT_AFTER = int(os.getenv('FLAYERFX_FILE_JOURNAL_COMPACT', 5000))
+# Keep the records read by reload and instantiate the objects of a class on first access
+LAZY = os.getenv('FLAYERFX_FILE_LAZY', '0').lower() in ('1', 'true', 'yes')
+# Number of products deleted between two progress reports of bulk_delete
+PROGRESS_EVERY = 500
+# Held by the bulk operations and by save and reload, which the request teardowns of other threads call
+_lock = RLock()
+
+
+class _Building(local):
+    """Whether the current thread is instantiating stored records, whose attributes are not changes."""
+    active = False
+
+
+_building = _Building()
+
+
+def _serialized(method):
+    """Runs a method of FileStorage while holding _lock."""
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        with _lock:
+            return method(*args, **kwargs)
+    return wrapper
 
 
 class FileStorage:
@@ -44,33 +115,211 @@ class FileStorage:
     FileStorage class for serializing instances to a JSON file and deserializing back to instances.
     Attributes:
         __file_path (str): Path to the JSON file.
+        __journal_path (str): Path to the journal of the changes made since the JSON file was written.
         __objects (dict): Dictionary to store all objects by <class name>.id.
+        __classes (dict): The objects of each class by <class name>.id.
+        __indexes (dict): For each class and attribute of INDEXED_ATTRIBUTES, the objects
+                          by attribute value and <class name>.id.
+        __indexed (dict): The indexed attribute values of each object by <class name>.id.
+        __dirty (set): The keys of the objects added or changed since the last save.
+        __deleted (set): The keys of the objects deleted since the last save.
+        __pending (dict): The records of each class not materialized yet by a lazy reload.
+        __search (MemorySearchIndex): The words of the product names, used by search.
+        __timings (dict): The load timings of the last reload per class.
+        __related (dict): The objects returned by `related` since the last change or close.
     Methods:
-        all(cls=None):
+        all(cls=None, load=()):
             Returns the dictionary __objects. If cls is provided, returns a dictionary of objects of that class.
         new(obj):
             Sets in __objects the obj with key <obj class name>.id. If obj is a list, sets each item in the list.
+        changed(obj):
+            Marks a stored object changed in place for the next save.
         save():
-            Serializes __objects to the JSON file (path: __file_path).
+            Serializes __objects to the JSON file (path: __file_path), or appends the changes to the journal.
+        compact():
+            Rewrites the JSON file as NDJSON with every object and empties the journal.
         reload():
-            Deserializes the JSON file to __objects.
+            Streams the JSON file and replays the journal to __objects.
+        load_timings():
+            Returns the number of objects and the time the last reload spent per class.
         delete(obj=None):
-            Deletes obj from __objects if it’s inside.
+            Deletes obj from __objects if it’s inside, with the products, prices, deals and relations attached.
+        bulk_delete(cls, ids, progress=None):
+            Deletes stores or products with everything attached to them and saves once.
+        merge_products(store_ids=None, dry_run=False, progress=None):
+            Merges the products of a store sharing a reference into the oldest one and saves once.
+        orphans(cls, after=None, limit=100):
+            Returns one page of the objects whose parent is missing, from the attribute indexes.
+        count_orphans(cls):
+            Counts the objects whose parent is missing.
+        delete_orphans(cls, ids=None):
+            Deletes the selected or all orphaned objects and saves once.
+        reassign_orphans(cls, ids, parent_id):
+            Attaches orphaned prices to a product or orphaned products to a store and saves once.
+        export(cls, store_id=None, since=None, until=None, batch_size=EXPORT_BATCH_SIZE):
+            Streams the products, prices or relations as plain rows.
         close():
             Calls reload() method for deserializing the JSON file to objects.
-        get(cls, **kwargs):
+        get(cls, load=(), **kwargs):
             Returns the object based on the class name and its ID, or None if not found.
+        related(cls, attr, value):
+            Returns the objects of a relationship property from the indexes, cached until a change or close.
         count(cls=None):
             Counts the number of objects in storage. If cls is provided, counts the number of objects of that class.
-        search(cls, **kwargs):
+        counts():
+            Returns the number of objects of every class from the class indexes.
+        search(cls, load=(), **kwargs):
             Searches for an object in the database by kwargs. Returns a list of objects that match the search criteria.
+        rebuild_search_index():
+            Rebuilds the word index of the product names.
+        refresh_latest_prices():
+            Rebuilds the latest price snapshot of every product.
+        refresh_deals(product_ids=None, since=None):
+            Rebuilds the daily deals of products from their price history.
+        get_daily_deals(dateleft, dateright):
+            Reads the materialized daily deals between two dates.
+        price_segments(product_id):
+            Returns the price history of a product as segments.
+        compact_prices(product_ids=None):
+            Collapses runs of consecutive equal prices into segments.
+        archive_prices(before=None):
+            Moves the prices older than the archive horizon to the monthly archive files.
+        price_history(product_id, since=None, until=None):
+            Reads the prices of a product from the storage and the archive.
+        price_stats(product_ids, count=ROLLING_COUNT):
+            Computes the price statistics of many products from the product_id index.
+        bulk_ingest(store_id, items, batch_size=BATCH_SIZE):
+            Ingests scraped items of a store and writes the file once.
     """
     # string - path to the JSON file
     __file_path = "file.json"
+    # string - path to the journal appended to by save in journal mode
+    __journal_path = "file.json.journal"
     # dictionary - empty but will store all objects by <class name>.id
     __objects = {}
+    # dictionary - <class name> to the objects of the class by <class name>.id
+    __classes = {}
+    # dictionary - <class name> to attribute to value to the matching objects by <class name>.id
+    __indexes = {}
+    # dictionary - <class name>.id to the indexed attribute values of the object
+    __indexed = {}
+    # set - keys of the objects to write and to remove on the next save
+    __dirty = set()
+    __deleted = set()
+    # integer - number of object records in the journal
+    __journal_records = 0
+    # dictionary - <class name> to the records not materialized yet by <class name>.id
+    __pending = {}
+    # dictionary - <class name> to the number of objects loaded and the seconds it took
+    __timings = {}
+    # index - word to the keys of the products whose name holds it
+    __search = MemorySearchIndex()
+    # dictionary - (<class name>, attribute, value) to the related objects read during the request
+    __related = {}
+
+    def __init__(self):
+        """
+        Instantiate the storage and register it for the attribute changes of the models.
+        """
+        BaseModel.on_change = self.changed
+
+    def changed(self, obj):
+        """
+        Marks a stored object changed in place, so the next save writes it.
+
+        Called by `BaseModel.__setattr__`; objects that are not stored, e.g. objects
+        being instantiated, are ignored.
+
+        Args:
+            obj (BaseModel): The object an attribute was set on.
+        """
+        if _building.active:
+            return
+        key = obj.__class__.__name__ + '.' + str(obj.__dict__.get('id'))
+        if self.__objects.get(key) is obj:
+            self.__mark(key)
 
-    def all(self, cls=None):
+    def __index(self, key, obj):
+        """
+        Stores an object under its key and updates the class bucket and attribute indexes.
+
+        The index entries of an object previously stored under the key are replaced,
+        so registering an object again after changing an indexed attribute moves it.
+
+        Args:
+            key (str): The key of the object, <class name>.id.
+            obj (BaseModel): The object to store.
+        """
+        self.__unindex(key)
+        self.__related.clear()
+        name = obj.__class__.__name__
+        self.__objects[key] = obj
+        self.__classes.setdefault(name, {})[key] = obj
+        indexes = self.__indexes.setdefault(name, {})
+        values = {}
+        for attr in INDEXED_ATTRIBUTES:
+            value = getattr(obj, attr, None)
+            if value is None:
+                continue
+            try:
+                indexes.setdefault(attr, {}).setdefault(value, {})[key] = obj
+            except TypeError:
+                continue
+            values[attr] = value
+        self.__indexed[key] = values
+        if name == 'Product':
+            self.__search.add(key, values.get('name'))
+
+    def __unindex(self, key):
+        """
+        Removes the attribute index entries of the object stored under a key.
+
+        Args:
+            key (str): The key of the object, <class name>.id.
+        """
+        values = self.__indexed.pop(key, None)
+        if not values:
+            return
+        self.__related.clear()
+        name = key.split('.')[0]
+        if name == 'Product':
+            self.__search.remove(key, values.get('name'))
+        indexes = self.__indexes.get(name, {})
+        for attr, value in values.items():
+            objs = indexes.get(attr, {}).get(value)
+            if objs is not None:
+                objs.pop(key, None)
+                if not objs:
+                    del indexes[attr][value]
+
+    def __mark(self, key):
+        """
+        Marks the object stored under a key as changed since the last save.
+
+        Args:
+            key (str): The key of the object, <class name>.id.
+        """
+        self.__deleted.discard(key)
+        self.__dirty.add(key)
+
+    def __is_stale(self, key, obj):
+        """
+        Checks whether an indexed attribute of an object changed since it was indexed.
+
+        Args:
+            key (str): The key of the object, <class name>.id.
+            obj (BaseModel): The stored object.
+
+        Returns:
+            bool: True if the object has to be indexed again.
+        """
+        values = self.__indexed.get(key, {})
+        for attr in INDEXED_ATTRIBUTES:
+            if getattr(obj, attr, None) != values.get(attr):
+                return True
+        return False
+
+    def all(self, cls=None, load=()):
         """
         Returns a dictionary of objects currently stored.
 
@@ -79,16 +328,17 @@ class FileStorage:
 
         Args:
             cls (type or str, optional): The class or class name to filter objects by.
+            load (iterable, optional): Accepted for compatibility with DBStorage; the related
+                                       objects are always read from the indexes.
 
         Returns:
             dict: A dictionary of objects, filtered by the provided class if specified.
         """
         if cls is not None:
-            new_dict = {}
-            for key, value in self.__objects.items():
-                if cls == value.__class__ or cls == value.__class__.__name__:
-                    new_dict[key] = value
-            return new_dict
+            name = cls if type(cls) is str else cls.__name__
+            self.__materialize(name)
+            return dict(self.__classes.get(name, {}))
+        self.__materialize()
         return self.__objects
 
     def new(self, obj):
@@ -98,60 +348,332 @@ class FileStorage:
         If the input is a list of objects, each object is added to the storage
         with a key in the format <obj class name>.<obj id>. If the input is a 
         single object, it is added to the storage with a key in the same format.
+        Adding an object that is already stored refreshes its index entries.
+        The latest price snapshot of the products of any added prices is updated.
+        The daily deals of the products of added discounted prices are refreshed.
+        Added objects and updated products are written by the next save.
 
         Args:
             obj (object or list): The object or list of objects to be added to the storage.
         """
+        discounted = [price for price in self.__add(obj) if price.is_discount]
+        if len(discounted) > 0:
+            self.refresh_deals({price.product_id for price in discounted},
+                               min(price.fetched_at for price in discounted))
+
+    def __add(self, obj):
+        """
+        Stores an object or a list of objects and updates the latest price snapshots.
+
+        Args:
+            obj (object or list): The object or list of objects to be added to the storage.
+
+        Returns:
+            list: The added Price objects.
+        """
+        from models.price import Price
         if type(obj) == list:
             for i in obj:
-                key = i.__class__.__name__ + "." + i.id
-                self.__objects[key] = i
+                self.__materialize(key=i.__class__.__name__ + "." + i.id)
+                self.__index(i.__class__.__name__ + "." + i.id, i)
+                self.__mark(i.__class__.__name__ + "." + i.id)
+            prices = [i for i in obj if isinstance(i, Price)]
         elif obj is not None:
-            key = obj.__class__.__name__ + "." + obj.id
-            self.__objects[key] = obj
+            self.__materialize(key=obj.__class__.__name__ + "." + obj.id)
+            self.__index(obj.__class__.__name__ + "." + obj.id, obj)
+            self.__mark(obj.__class__.__name__ + "." + obj.id)
+            prices = [obj] if isinstance(obj, Price) else []
+        else:
+            prices = []
+        for price in prices:
+            if price.fetched_at is None:
+                price.fetched_at = datetime.utcnow()
+            self.__materialize(key="Product." + price.product_id)
+            product = self.__objects.get("Product." + price.product_id)
+            if product is not None:
+                product.record_price(price)
+                self.__mark("Product." + product.id)
+        return prices
 
+    @_serialized
     def save(self):
         """
         Serializes the __objects attribute to a JSON file specified by __file_path.
 
-        This method converts the __objects attribute to a dictionary of JSON-serializable
-        objects and writes it to a file in JSON format. If an object's key is "password",
-        it decodes the value before serialization.
+        Without FLAYERFX_FILE_JOURNAL this rewrites the whole file through `compact`.
+        In journal mode only the objects added, changed or deleted since the last save
+        are appended to the journal, followed by a commit record, so the cost of a save
+        depends on the number of changes rather than on the number of stored objects.
+        The journal is compacted into the file once it holds COMPACT_AFTER records.
+        Objects changed in place are marked through `changed` and journaled too.
+        The data version is bumped once the changes are written.
 
         Raises:
             IOError: If the file cannot be opened or written to.
         """
-        json_objects = {}
-        for key in self.__objects:
-            if key == "password":
-                json_objects[key].decode()
-            json_objects[key] = self.__objects[key].to_dict(save_fs=1)
-        with open(self.__file_path, 'w') as f:
-            json.dump(json_objects, f)
+        if not JOURNAL:
+            self.compact()
+            data_version.bump()
+            return
+        records = [json.dumps({'key': key, 'deleted': True}) for key in self.__deleted]
+        for key in self.__dirty:
+            obj = self.__objects.get(key)
+            if obj is None:
+                continue
+            if self.__is_stale(key, obj):
+                self.__index(key, obj)
+            records.append(json.dumps({'key': key, 'object': obj.to_dict(save_fs=1)}))
+        self.__dirty.clear()
+        self.__deleted.clear()
+        if not records:
+            return
+        records.append(json.dumps({'commit': len(records)}))
+        # The leading newline ends a line torn by an interrupted save
+        with open(self.__journal_path, 'a') as f:
+            f.write('\n' + '\n'.join(records) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        FileStorage.__journal_records += len(records) - 1
+        if FileStorage.__journal_records >= COMPACT_AFTER:
+            self.compact()
+        data_version.bump()
+
+    def compact(self):
+        """
+        Rewrites the JSON file with every stored object and removes the journal.
+
+        The file is written as NDJSON, one {"key": ..., "object": ...} record per line,
+        to a temporary file of the process and thread first and renamed over the JSON
+        file, so a crash leaves either the old or the new file. A journal left behind by a crash before its
+        removal only repeats what the file holds. Objects of classes that were not
+        materialized yet are written back from their deserialized records.
+        Objects whose indexed attributes were changed in place are indexed again.
+
+        Raises:
+            IOError: If the file cannot be opened or written to.
+        """
+        tmp_path = f"{self.__file_path}.{os.getpid()}.{get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            for key, obj in list(self.__objects.items()):
+                if self.__is_stale(key, obj):
+                    self.__index(key, obj)
+                f.write(json.dumps({'key': key, 'object': obj.to_dict(save_fs=1)}) + '\n')
+            for records in list(self.__pending.values()):
+                for key, record in list(records.items()):
+                    f.write(json.dumps({'key': key, 'object': record}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.__file_path)
+        if os.path.exists(self.__journal_path):
+            os.remove(self.__journal_path)
+        self.__dirty.clear()
+        self.__deleted.clear()
+        FileStorage.__journal_records = 0
+
+    def __read_journal(self):
+        """
+        Reads the committed records of the journal.
+
+        Records are only kept once the commit record of their save is read, so
+        the records of a save interrupted while appending are ignored.
+
+        Returns:
+            dict or None: The last record of each key, None for deleted objects,
+                          or None if there is no journal.
+        """
+        try:
+            f = open(self.__journal_path, 'r')
+        except FileNotFoundError:
+            return None
+        changes = {}
+        pending = []
+        with f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    pending = []
+                    continue
+                if 'commit' not in record:
+                    pending.append(record)
+                    continue
+                for item in pending:
+                    changes[item['key']] = None if item.get('deleted') else item['object']
+                pending = []
+        return changes
+
+    def __read_snapshot(self):
+        """
+        Yields the records of the JSON file one at a time.
+
+        NDJSON files written by `compact` are read line by line. Files in the
+        previous format, a single JSON object, are loaded at once.
+
+        Yields:
+            tuple: The key of an object, <class name>.id, and its dictionary.
+        """
+        if not os.path.exists(self.__file_path):
+            return
+        with open(self.__file_path, 'r') as f:
+            first = f.readline()
+            try:
+                record = json.loads(first)
+            except ValueError:
+                record = None
+            if type(record) is dict and set(record) == {'key', 'object'}:
+                yield record['key'], record['object']
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        record = json.loads(line)
+                        yield record['key'], record['object']
+                return
+            if record is None:
+                f.seek(0)
+                record = json.load(f)
+        for key, value in record.items():
+            yield key, value
+
+    def __materialize(self, name=None, key=None):
+        """
+        Instantiates objects that were deserialized but not materialized by a lazy reload.
+
+        Args:
+            name (str, optional): The class name to materialize. Defaults to every class.
+            key (str, optional): The key of the only object to materialize.
+        """
+        if not self.__pending:
+            return
+        if key is not None:
+            record = self.__pending.get(key.split('.')[0], {}).pop(key, None)
+            if record is not None:
+                self.__index(key, self.__build(record))
+            return
+        for name in [name] if name is not None else list(self.__pending):
+            records = self.__pending.pop(name, None)
+            if not records:
+                continue
+            started = perf_counter()
+            for key, record in records.items():
+                self.__index(key, self.__build(record))
+            self.__time(name, len(records), perf_counter() - started)
+
+    def __build(self, record):
+        """
+        Instantiates a deserialized record, without marking the attributes it sets as changes.
+
+        Args:
+            record (dict): The record, with its "__class__" key.
+
+        Returns:
+            BaseModel: The new object.
+        """
+        from models.class_store import classes
+        _building.active = True
+        try:
+            return classes[record["__class__"]](**record)
+        finally:
+            _building.active = False
+
+    def __time(self, name, count, seconds):
+        """
+        Adds the materialization of objects of a class to the load timings.
+
+        Args:
+            name (str): The class name.
+            count (int): The number of objects.
+            seconds (float): The time it took.
+        """
+        timing = self.__timings.setdefault(name, {'objects': 0, 'seconds': 0.0})
+        timing['objects'] += count
+        timing['seconds'] = round(timing['seconds'] + seconds, 4)
 
+    def load_timings(self):
+        """
+        Returns the timings of the last reload.
+
+        Returns:
+            dict: The number of objects and the seconds spent materializing them per
+                  class, plus the 'read' seconds spent reading the file and its journal.
+                  With FLAYERFX_FILE_LAZY, classes appear once they are first accessed.
+        """
+        return {name: dict(timing) if type(timing) is dict else timing
+                for name, timing in self.__timings.items()}
+
+    @_serialized
     def reload(self):
         """
         Deserializes the JSON file to __objects.
 
-        This method attempts to open a JSON file specified by the instance's
-        __file_path attribute. If the file is successfully opened and read,
-        it loads the JSON content into a dictionary. Each key-value pair in
-        the dictionary is then used to instantiate objects of the appropriate
-        class, as specified by the "__class__" attribute in the JSON data.
-        These objects are stored in the instance's __objects attribute.
+        This method streams the records of the JSON file specified by the
+        instance's __file_path attribute, skipping the objects the committed
+        records of the journal replace or delete, and then applies the journal.
+        Each record is used to instantiate an object of the appropriate
+        class, as specified by the "__class__" attribute in the JSON data,
+        whose dates are parsed with `parse_time`. With FLAYERFX_FILE_LAZY the
+        records are kept and the objects of a class are only instantiated when
+        the class is first accessed.
+        These objects replace the stored objects and their indexes, so objects
+        that were never saved are dropped. The time spent per class is available
+        from `load_timings`.
 
-        If any exception occurs during this process (e.g., the file does not
-        exist, the JSON is malformed, or the class cannot be found), the
+        If any exception occurs during this process (e.g., neither the file nor
+        the journal exist, the JSON is malformed, or the class cannot be found), the
         exception is silently ignored and the method exits without making
         any changes to __objects.
         """
+        started = perf_counter()
+        timings = {}
+        objs = {}
+        pending = {}
+
+        def load(key, record):
+            name = record["__class__"]
+            if LAZY:
+                pending.setdefault(name, {})[key] = record
+                return
+            obj_started = perf_counter()
+            objs[key] = self.__build(record)
+            timing = timings.setdefault(name, {'objects': 0, 'seconds': 0.0})
+            timing['objects'] += 1
+            timing['seconds'] += perf_counter() - obj_started
+
         try:
-            with open(self.__file_path, 'r') as f:
-                jo = json.load(f)
-            for key in jo:
-                self.__objects[key] = classes[jo[key]["__class__"]](**jo[key])
+            changes = self.__read_journal()
+            if changes is None and not os.path.exists(self.__file_path):
+                return
+            changes = changes or {}
+            for key, record in self.__read_snapshot():
+                if key not in changes:
+                    load(key, record)
+            for key, record in changes.items():
+                if record is not None:
+                    load(key, record)
         except:
-            pass
+            return
+        self.__objects.clear()
+        self.__classes.clear()
+        self.__indexes.clear()
+        self.__indexed.clear()
+        self.__related.clear()
+        self.__search.clear()
+        self.__pending.clear()
+        self.__pending.update(pending)
+        for key, obj in objs.items():
+            self.__index(key, obj)
+        self.__dirty.clear()
+        self.__deleted.clear()
+        FileStorage.__journal_records = len(changes)
+        self.__timings.clear()
+        for name, timing in timings.items():
+            self.__time(name, timing['objects'], timing['seconds'])
+        self.__timings['read'] = round(perf_counter() - started - sum(t['seconds'] for t in timings.values()), 4)
+        from logger import logHandler
+        if logHandler is not None:
+            logHandler.debug(f"Reloaded {self.__file_path}: {self.load_timings()}")
 
     def delete(self, obj=None):
         """
@@ -162,16 +684,356 @@ class FileStorage:
 
         Deletes the object from the internal storage dictionary if it exists.
         The key for the object is generated using the class name and the object's id.
+        Deleting the latest price of a product moves its snapshot to the previous price.
+        Deleting a discounted price refreshes the daily deals of its product from its day
+        on. Deleting a store deletes its products, and deleting a product deletes its
+        prices, deals and relations.
         """
         if obj is not None:
             key = obj.__class__.__name__ + '.' + obj.id
-            if key in self.__objects:
-                del self.__objects[key]
+            self.__materialize(key=key)
+            self.__remove(key)
+            if obj.__class__.__name__ == "Price":
+                self.__materialize(key="Product." + obj.product_id)
+                product = self.__objects.get("Product." + obj.product_id)
+                if product is not None and product.latest_price_id == obj.id:
+                    product.refresh_latest_price(ignore=[obj.id])
+                    self.__mark("Product." + product.id)
+                if obj.is_discount and obj.fetched_at is not None:
+                    self.refresh_deals([obj.product_id], obj.fetched_at)
+            elif obj.__class__.__name__ in ("Store", "Product"):
+                self.__cascade(obj.__class__.__name__, [obj.id])
+
+    @_serialized
+    def bulk_delete(self, cls, ids, progress=None):
+        """
+        Deletes stores or products and everything attached to them, then saves once.
+
+        The objects are found through the attribute indexes, and a single save writes
+        every removal, so in journal mode the deletion is one commit. The archived
+        prices of the products are removed too.
+
+        Args:
+            cls (type): Store or Product.
+            ids (iterable): The IDs of the objects to delete.
+            progress (callable, optional): Called with the number of products deleted so far
+                                           and the total, every PROGRESS_EVERY products.
+
+        Returns:
+            dict: The number of stores, products, prices, archived prices, deals and
+                  relations deleted, and the seconds it took.
+
+        Raises:
+            ValueError: If cls is neither Store nor Product.
+        """
+        if cls.__name__ not in ("Store", "Product"):
+            raise ValueError(f"Cannot bulk delete {cls.__name__} objects")
+        started = perf_counter()
+        stats = self.__cascade(cls.__name__, list(ids), progress)
+        self.save()
+        stats['seconds'] = round(perf_counter() - started, 4)
+        return stats
+
+    def __cascade(self, name, ids, progress=None):
+        """
+        Removes stores or products with their products, prices, deals and relations.
+
+        The archived prices of the products are removed from the archive files.
+
+        Args:
+            name (str): 'Store' or 'Product'.
+            ids (list): The IDs of the objects to remove.
+            progress (callable, optional): Called with the number of products removed and the total.
+
+        Returns:
+            dict: The number of stores, products, prices, archived prices, deals and relations removed.
+        """
+        from models.class_store import classes
+        stats = {'stores': 0, 'products': 0, 'prices': 0, 'archived_prices': 0, 'deals': 0, 'relations': 0}
+        if name == "Store":
+            product_ids = [product.id for store_id in ids
+                           for product in self.get(classes["Product"], store_id=store_id) or []]
+        else:
+            product_ids = ids
+        attached = (("Price", "product_id", 'prices'), ("Deal", "product_id", 'deals'),
+                    ("ProductRelation", "product_id", 'relations'),
+                    ("ProductRelation", "related_product_id", 'relations'))
+        for done, product_id in enumerate(product_ids, 1):
+            for cls_name, attr, stat in attached:
+                for obj in self.get(classes[cls_name], **{attr: product_id}) or []:
+                    self.__remove(cls_name + '.' + obj.id)
+                    stats[stat] += 1
+            stats['products'] += self.__drop("Product." + product_id)
+            if progress is not None and (done % PROGRESS_EVERY == 0 or done == len(product_ids)):
+                progress(done, len(product_ids))
+        if name == "Store":
+            for store_id in ids:
+                stats['stores'] += self.__drop("Store." + store_id)
+        stats['archived_prices'] = price_archive.drop(product_ids)
+        return stats
+
+    @_serialized
+    def merge_products(self, store_ids=None, dry_run=False, progress=None):
+        """
+        Merges the products of a store that share a reference number into one product.
+
+        The prices of the merged products are moved to the kept product, whose latest
+        price snapshot and deals are refreshed, and the merged products are deleted
+        with their deals and relations. A single save writes every change. The
+        archived prices of the merged products are moved first, as deleting a
+        product removes its archived prices.
+
+        Args:
+            store_ids (iterable, optional): The IDs of the stores. Defaults to every store.
+            dry_run (bool, optional): If True, only report what would be merged.
+            progress (callable, optional): Called with the number of groups merged so far
+                                           and the total, every PROGRESS_EVERY groups.
+
+        Returns:
+            dict: The merge report, see `models.engine.merge.new_report`.
+        """
+        from models.class_store import classes
+        started = perf_counter()
+        store_ids = None if store_ids is None else set(store_ids)
+        groups = plan_merge({'id': product.id, 'store_id': product.store_id, 'reference': product.reference,
+                             'created_at': product.created_at}
+                            for product in self.all(classes["Product"]).values()
+                            if store_ids is None or product.store_id in store_ids)
+        report = new_report(groups, dry_run)
+        mapping = {product_id: group['keep'] for group in groups for product_id in group['merge']}
+        if dry_run:
+            report['prices_moved'] += price_archive.count(mapping)
+        else:
+            report['prices_moved'] += price_archive.reassign(mapping)
+        for done, group in enumerate(groups, 1):
+            prices = [price for product_id in group['merge']
+                      for price in self.get(classes["Price"], product_id=product_id) or []]
+            report['prices_moved'] += len(prices)
+            if not dry_run:
+                for price in prices:
+                    price.product_id = group['keep']
+                    self.__index("Price." + price.id, price)
+                    self.__mark("Price." + price.id)
+                stats = self.__cascade("Product", group['merge'])
+                report['deals_deleted'] += stats['deals']
+                report['relations_deleted'] += stats['relations']
+                keep = self.__objects.get("Product." + group['keep'])
+                if keep is not None:
+                    keep.refresh_latest_price()
+                    self.__mark("Product." + keep.id)
+                discounted = [price.fetched_at for price in prices if price.is_discount and price.fetched_at is not None]
+                if discounted:
+                    self.refresh_deals([group['keep']], min(discounted))
+            if progress is not None and (done % PROGRESS_EVERY == 0 or done == len(groups)):
+                progress(done, len(groups))
+        if not dry_run and groups:
+            self.save()
+        report['seconds'] = round(perf_counter() - started, 4)
+        return report
+
+    def export(self, cls, store_id=None, since=None, until=None, batch_size=EXPORT_BATCH_SIZE):
+        """
+        Streams the products, prices or relations as plain rows.
+
+        The objects of a store are found through the attribute indexes, and the rows
+        are built one at a time from the objects already in memory.
+
+        Args:
+            cls (type): Product, Price or ProductRelation.
+            store_id (str, optional): Only export the rows of the products of this store.
+            since (datetime, optional): Only export the rows dated at or after this date,
+                                        see EXPORT_DATE_COLUMNS.
+            until (datetime, optional): Only export the rows dated before this date.
+            batch_size (int, optional): Accepted for compatibility with DBStorage.
+
+        Yields:
+            dict: One row per object, by column name, ordered by ID.
+
+        Raises:
+            ValueError: If cls cannot be exported.
+        """
+        from models.class_store import classes
+        name = cls.__name__
+        if name not in EXPORT_COLUMNS:
+            raise ValueError(f"Cannot export {name} objects")
+        if store_id is None:
+            objs = self.all(cls).values()
+        else:
+            products = self.get(classes["Product"], store_id=store_id) or []
+            if name == "Product":
+                objs = products
+            else:
+                objs = [obj for product in products for obj in self.get(cls, product_id=product.id) or []]
+        date_column = EXPORT_DATE_COLUMNS[name]
+        for obj in sorted(objs, key=lambda obj: obj.id):
+            date = getattr(obj, date_column, None)
+            if (since is not None or until is not None) and date is None:
+                continue
+            if (since is not None and date < since) or (until is not None and date >= until):
+                continue
+            yield {column: getattr(obj, column, None) for column in EXPORT_COLUMNS[name]}
+
+    def __orphan_keys(self, cls):
+        """
+        Returns the keys of the objects of a class whose parent object is missing.
+
+        The parent IDs referenced by the class are the keys of its attribute index, so
+        the orphans are found with a set difference against the parent class bucket
+        instead of a scan of the objects.
+
+        Args:
+            cls (type): Price, Product or ProductRelation.
+
+        Returns:
+            set: The keys of the orphaned objects.
+
+        Raises:
+            ValueError: If objects of cls have no parent.
+        """
+        parents = {"Price": [("product_id", "Product")], "Product": [("store_id", "Store")],
+                   "ProductRelation": [("product_id", "Product"), ("related_product_id", "Product")]}
+        name = cls.__name__
+        if name not in parents:
+            raise ValueError(f"{name} objects cannot be orphaned")
+        self.__materialize(name)
+        keys = set()
+        for attr, parent in parents[name]:
+            self.__materialize(parent)
+            index = self.__indexes.get(name, {}).get(attr, {})
+            for value in index.keys() - {key.split('.', 1)[1] for key in self.__classes.get(parent, {})}:
+                keys.update(index[value])
+        return keys
+
+    def orphans(self, cls, after=None, limit=100):
+        """
+        Returns one page of the prices, products or relations whose parent is missing.
+
+        Args:
+            cls (type): Price, Product or ProductRelation.
+            after (str, optional): The ID of the last object of the previous page.
+            limit (int, optional): The maximum number of objects to return. Defaults to 100.
+
+        Returns:
+            list: The orphaned objects of the page, ordered by ID.
+        """
+        objs = sorted((self.__objects[key] for key in self.__orphan_keys(cls)), key=lambda obj: obj.id)
+        if after is not None:
+            objs = [obj for obj in objs if obj.id > after]
+        return objs[:limit]
+
+    def count_orphans(self, cls):
+        """
+        Counts the prices, products or relations whose parent is missing.
+
+        Args:
+            cls (type): Price, Product or ProductRelation.
+
+        Returns:
+            int: The number of orphaned objects.
+        """
+        return len(self.__orphan_keys(cls))
+
+    def delete_orphans(self, cls, ids=None):
+        """
+        Deletes orphaned prices, products or relations, then saves once.
+
+        Only objects that are still orphaned are deleted. Orphaned products are
+        deleted with their prices, deals and relations.
+
+        Args:
+            cls (type): Price, Product or ProductRelation.
+            ids (iterable, optional): The IDs of the objects to delete. Defaults to every orphan.
+
+        Returns:
+            int: The number of orphaned objects deleted.
+        """
+        keys = self.__orphan_keys(cls)
+        if ids is not None:
+            keys &= {cls.__name__ + '.' + i for i in ids}
+        if cls.__name__ == "Product":
+            self.__cascade("Product", [key.split('.', 1)[1] for key in keys])
+        else:
+            for key in keys:
+                self.__remove(key)
+        if keys:
+            self.save()
+        return len(keys)
+
+    def reassign_orphans(self, cls, ids, parent_id):
+        """
+        Attaches orphaned prices to a product or orphaned products to a store, then saves once.
+
+        The latest price snapshot and the deals of a product receiving prices are refreshed.
+
+        Args:
+            cls (type): Price or Product.
+            ids (iterable): The IDs of the objects to reassign.
+            parent_id (str): The ID of the product or store.
+
+        Returns:
+            int: The number of objects reassigned.
+
+        Raises:
+            ValueError: If cls is neither Price nor Product, or the parent does not exist.
+        """
+        parents = {"Price": ("product_id", "Product"), "Product": ("store_id", "Store")}
+        if cls.__name__ not in parents:
+            raise ValueError(f"Cannot reassign {cls.__name__} objects")
+        attr, parent_name = parents[cls.__name__]
+        parent_key = parent_name + '.' + parent_id
+        self.__materialize(key=parent_key)
+        if parent_key not in self.__objects:
+            raise ValueError(f"{parent_name} {parent_id} not found")
+        keys = self.__orphan_keys(cls) & {cls.__name__ + '.' + i for i in ids}
+        for key in keys:
+            setattr(self.__objects[key], attr, parent_id)
+            self.__index(key, self.__objects[key])
+            self.__mark(key)
+        if cls.__name__ == "Price" and keys:
+            parent = self.__objects[parent_key]
+            parent.refresh_latest_price()
+            self.__mark(parent_key)
+            self.refresh_deals([parent_id], datetime.min)
+        if keys:
+            self.save()
+        return len(keys)
+
+    def __drop(self, key):
+        """
+        Removes the object stored under a key, materializing it first.
+
+        Args:
+            key (str): The key of the object, <class name>.id.
+
+        Returns:
+            int: 1 if an object was removed, else 0.
+        """
+        self.__materialize(key=key)
+        if key not in self.__objects:
+            return 0
+        self.__remove(key)
+        return 1
+
+    def __remove(self, key):
+        """
+        Removes the object stored under a key and its index entries.
+
+        Args:
+            key (str): The key of the object, <class name>.id.
+        """
+        if key in self.__objects:
+            self.__unindex(key)
+            del self.__objects[key]
+            del self.__classes[key.split('.')[0]][key]
+            self.__dirty.discard(key)
+            self.__deleted.add(key)
 
     def close(self):
         """
         Closes the storage by calling the reload method to deserialize the JSON file into objects.
+        The related objects cached during the request are dropped.
         """
+        self.__related.clear()
         self.reload()
 
     def rollback(self):
@@ -180,23 +1042,41 @@ class FileStorage:
         """
         self.reload()
 
-    def get(self, cls, **kwargs):
+    def get(self, cls, load=(), **kwargs):
         """
         Retrieves objects of a specified class that match given attribute values.
         Args:
             cls (type): The class type of the objects to retrieve.
+            load (iterable, optional): Accepted for compatibility with DBStorage.
             **kwargs: Arbitrary keyword arguments representing the attribute names 
                       and their corresponding values to filter the objects.
         Returns:
             list: A list of objects that match the specified class and attribute values.
                   Returns None if the class is not found or no matching objects are found.
+
+        The candidates are taken from the smallest attribute index matching the keyword
+        arguments, or from the class bucket if none of them is indexed.
         """        
+        from models.class_store import classes
         if cls not in classes.values():
             return None
 
-        all_cls = self.all(cls)
+        self.__materialize(cls.__name__)
+        indexes = self.__indexes.get(cls.__name__, {})
+        candidates = None
+        for key, v in kwargs.items():
+            if key not in INDEXED_ATTRIBUTES:
+                continue
+            try:
+                objs = indexes.get(key, {}).get(v, {})
+            except TypeError:
+                continue
+            if candidates is None or len(objs) < len(candidates):
+                candidates = objs
+        if candidates is None:
+            candidates = self.__classes.get(cls.__name__, {})
         filtered_results = []
-        for value in all_cls.values():
+        for value in list(candidates.values()):
             obj_flag = False
             for key, v in kwargs.items():
                 try:
@@ -215,46 +1095,122 @@ class FileStorage:
             return None
         return filtered_results 
 
-    def count(self, cls=None):
-        #TODO: This can be done better without using all
+    def related(self, cls, attr, value):
+        """
+        Returns the objects of a class whose attribute equals a value, for the relationship
+        properties of the models.
+
+        The objects are read from the attribute indexes, which map each store to its
+        products and each product to its prices, and kept until an object is added,
+        changed or removed, or the storage is closed at the end of the request, so
+        reading the store of many products of the same store costs one lookup.
+
+        Args:
+            cls (type): The class of the related objects.
+            attr (str): The attribute referring to the owner, e.g. 'product_id'.
+            value (str): The value of the attribute, e.g. the ID of the product.
+
+        Returns:
+            list: The related objects, empty if there are none.
+        """
+        key = (cls.__name__, attr, value)
+        objs = self.__related.get(key)
+        if objs is None:
+            objs = self.get(cls, **{attr: value}) or []
+            self.__related[key] = objs
+        return list(objs)
+
+    def count(self, cls=None, **kwargs):
         """
         Count the number of objects in storage.
         Args:
             cls (type, optional): The class type to count instances of. If None, count instances of all classes.
+            **kwargs: Arbitrary keyword arguments used as filter criteria when cls is given.
         Returns:
             int: The number of objects in storage.
         """
-        all_class = classes.values()
-
         if not cls:
-            count = 0
-            for clas in all_class:
-                count += len(self.all(clas))
+            count = len(self.__objects) + sum(len(records) for records in self.__pending.values())
+        elif kwargs:
+            count = len(self.get(cls, **kwargs) or [])
         else:
-            count = len(self.all(cls))
+            count = len(self.__classes.get(cls.__name__, {})) + len(self.__pending.get(cls.__name__, {}))
 
         return count
 
-    def search(self, cls, **kwargs):
+    def counts(self):
+        """
+        Returns the number of objects of every class, from the class indexes.
+
+        Returns:
+            dict: The number of objects by class name.
+        """
+        from models.class_store import classes
+        return {name: len(self.__classes.get(name, {})) + len(self.__pending.get(name, {}))
+                for name in classes}
+
+    def page(self, cls, order_by='id', after=None, limit=100, load=(), **kwargs):
+        """
+        Retrieves one page of objects using keyset pagination.
+
+        Objects whose order_by attribute is None come last, ordered by id.
+
+        Args:
+            cls (type): The class type of the objects to retrieve.
+            order_by (str, optional): The attribute to order by. Defaults to 'id'.
+            after (list, optional): The [order_by value, id] of the last object of the previous page.
+            limit (int, optional): The maximum number of objects to return. Defaults to 100.
+            load (iterable, optional): Accepted for compatibility with DBStorage.
+            **kwargs: Arbitrary keyword arguments used as filter criteria.
+
+        Returns:
+            list: The objects of the page.
+        """
+        if kwargs:
+            objs = self.get(cls, **kwargs) or []
+        else:
+            objs = list(self.all(cls).values())
+        def sort_key(value, obj_id):
+            return (value is None, value or '', obj_id)
+
+        objs = sorted(objs, key=lambda obj: sort_key(getattr(obj, order_by), obj.id))
+        if after is not None:
+            after = sort_key(after[-1], after[-1]) if order_by == 'id' else sort_key(*after)
+            objs = [obj for obj in objs if sort_key(getattr(obj, order_by), obj.id) > after]
+        return objs[:limit]
+
+    def search(self, cls, load=(), **kwargs):
         """
         Search for an object in the database by specified keyword arguments.
         Args:
             cls (type): The class type of the objects to search for.
+            load (iterable, optional): Accepted for compatibility with DBStorage.
             **kwargs: Arbitrary keyword arguments to filter the objects.
         Returns:
             list: A list of objects that match the search criteria, sorted by match score.
                   Returns None if no objects match the criteria.
         Raises:
             Exception: If an error occurs while accessing object attributes.
+
+        Products are looked up in the word index of their names, so only the products
+        sharing enough words with the name to reach SCORETHRESHOLD are scored, and are
+        then filtered by the other keyword arguments.
         """        
+        from models.class_store import classes
         if cls not in classes.values():
             return None
 
         all_cls = self.all(cls)
-        filtered_results = []
-        for value in all_cls.values():
-            score = 0
+        if cls.__name__ == 'Product':
+            candidates = [all_cls[key] for key in self.__search.search(kwargs['name']) if key in all_cls]
+        else:
+            candidates = all_cls.values()
+        filtered = []
+        for value in candidates:
+            obj_flag = True
             for key, v in kwargs.items():
+                if key == 'name':
+                    continue
                 try:
                     x = getattr(value, key, None)
                     if x is not None and x == v:
@@ -265,13 +1221,338 @@ class FileStorage:
                     obj_flag=False
                 if obj_flag == False:
                     break
-            score = match_score(kwargs['name'], value.name)
-            if score >= SCORETHRESHOLD:
-                filtered_results.append((score, value))
+            if obj_flag == True:
+                filtered.append(value)
+        filtered_results = rank(kwargs['name'], filtered)
         if (len(filtered_results) < 1):
             return None
-        return [i[1] for i in sorted(filtered_results, key=lambda a: a[0])]
+        return filtered_results
+
+    def rebuild_search_index(self):
+        """
+        Rebuilds the word index of the product names from the stored products.
+
+        Returns:
+            bool: Always True.
+        """
+        self.__materialize('Product')
+        self.__search.clear()
+        for key, obj in list(self.__classes.get('Product', {}).items()):
+            self.__index(key, obj)
+        return True
     
+    def refresh_latest_prices(self):
+        """
+        Rebuilds the latest price snapshot of every product.
+
+        Returns:
+            int: The number of products that have a latest price.
+        """
+        from models.price import Price
+        from models.product import Product
+        latest = {}
+        for price in self.all(Price).values():
+            current = latest.get(price.product_id)
+            if current is None or price.fetched_at > current.fetched_at:
+                latest[price.product_id] = price
+        for product in self.all(Product).values():
+            product.latest_price_id = None
+            product.latest_amount = None
+            product.latest_fetched_at = None
+            product.latest_is_discount = None
+            price = latest.get(product.id)
+            if price is not None:
+                product.record_price(price)
+        self.compact()
+        return len(latest)
+
+    def refresh_deals(self, product_ids=None, since=None):
+        """
+        Rebuilds the daily deals of products from their price history.
+
+        Deals are added or updated for every day since `since` with a discounted
+        price, and deals of days without one are deleted. The changes are written
+        by the next save.
+
+        Args:
+            product_ids (iterable, optional): The IDs of the products. Defaults to every
+                                              product with a discounted price since `since`.
+            since (datetime, optional): The start of the first day refreshed. Defaults to
+                                        the start of yesterday.
+
+        Returns:
+            int: The number of deals of the products since `since`.
+        """
+        from models.price import Price
+        from models.product import Product
+        if since is None:
+            since = deals_since()
+        since = datetime.combine(since.date(), datetime.min.time())
+        if product_ids is None:
+            product_ids = {price.product_id for price in self.all(Price).values()
+                           if price.is_discount and price.fetched_at is not None and price.fetched_at >= since}
+        products = []
+        prices = {}
+        existing = {}
+        for product_id in set(product_ids):
+            product = self.get(Product, id=product_id)
+            if not product:
+                continue
+            products.append(product[0])
+            prices[product_id] = sorted(self.get(Price, product_id=product_id) or [],
+                                        key=lambda p: p.fetched_at, reverse=True)
+            for deal in self.get(Deal, product_id=product_id) or []:
+                if deal.day >= deal_day(since):
+                    existing[(deal.product_id, deal.day)] = deal
+        planned = Deal.plan(products, prices, since)
+        for key, values in planned.items():
+            deal = existing.pop(key, None)
+            if deal is None:
+                deal = Deal(**values)
+            else:
+                for attr, value in values.items():
+                    setattr(deal, attr, value)
+            self.__add(deal)
+        for deal in existing.values():
+            self.delete(deal)
+        return len(planned)
+
+    def get_daily_deals(self, dateleft, dateright):
+        """
+        Reads the materialized daily deals between two dates.
+
+        The deals are read from the day index, one day at a time, and only the
+        most recent deal of each product is kept.
+
+        Args:
+            dateleft (date or datetime): The first day.
+            dateright (date or datetime): The last day.
+
+        Returns:
+            list: The Deal objects, ordered by ascending amount.
+        """
+        if type(dateleft) is datetime:
+            dateleft = dateleft.date()
+        if type(dateright) is datetime:
+            dateright = dateright.date()
+        latest = {}
+        day = dateleft
+        while day <= dateright:
+            for deal in self.get(Deal, day=deal_day(day)) or []:
+                latest[deal.product_id] = deal
+            day += timedelta(days=1)
+        return sorted(latest.values(), key=lambda deal: deal.amount)
+
+    def __price_history(self, product_id):
+        """
+        Returns the prices of a product in the order segments are built from.
+
+        Args:
+            product_id (str): The ID of the product.
+
+        Returns:
+            list: The Price objects, sorted by fetched_at and ID.
+        """
+        from models.price import Price
+        return sorted(self.get(Price, product_id=product_id) or [], key=lambda p: (p.fetched_at, p.id))
+
+    def price_segments(self, product_id):
+        """
+        Returns the price history of a product as segments.
+
+        Consecutive prices with the same amount and discount flag form one
+        segment, whether or not the history was compacted.
+
+        Args:
+            product_id (str): The ID of the product.
+
+        Returns:
+            list: The segments of `to_segment`, most recent first.
+        """
+        runs = price_runs(self.__price_history(product_id))
+        return [to_segment(run) for run in reversed(runs)]
+
+    def compact_prices(self, product_ids=None):
+        """
+        Collapses the runs of consecutive equal prices of products into single prices.
+
+        The last price of each run is kept with the start of the run as its
+        first_seen_at, and the other prices are deleted. Latest price snapshots
+        and daily deals pointing to a deleted price are moved to the kept one.
+        The file is written once at the end.
+
+        Args:
+            product_ids (iterable, optional): The IDs of the products. Defaults to every product.
+
+        Returns:
+            dict: The number of products, segments and deleted prices, and the seconds it took.
+        """
+        from models.price import Price
+        from models.product import Product
+        started = perf_counter()
+        if product_ids is None:
+            product_ids = [obj.id for obj in self.all(Product).values()]
+        product_ids = list(set(product_ids))
+        stats = {'products': len(product_ids), 'segments': 0, 'deleted': 0}
+        for product_id in product_ids:
+            plan = plan_compaction(self.__price_history(product_id))
+            stats['segments'] += plan['segments']
+            if not plan['deleted']:
+                continue
+            for row in plan['updates']:
+                price = self.__objects["Price." + row['id']]
+                price.first_seen_at = row['first_seen_at']
+                self.__mark("Price." + price.id)
+            product = self.__objects.get("Product." + product_id)
+            if product is not None and product.latest_price_id in plan['deleted']:
+                product.latest_price_id = plan['deleted'][product.latest_price_id]
+                self.__mark("Product." + product_id)
+            for deal in self.get(Deal, product_id=product_id) or []:
+                if deal.price_id in plan['deleted']:
+                    deal.price_id = plan['deleted'][deal.price_id]
+                    self.__mark("Deal." + deal.id)
+            for price_id in plan['deleted']:
+                self.__remove("Price." + price_id)
+            stats['deleted'] += len(plan['deleted'])
+        self.save()
+        stats['seconds'] = round(perf_counter() - started, 4)
+        return stats
+
+    def archive_prices(self, before=None):
+        """
+        Moves the prices fetched before a date to the monthly archive files.
+
+        The latest price of a product is never archived, so `latest_price` keeps
+        working. The prices are written to the archive before being removed, and
+        the file is written once at the end.
+
+        Args:
+            before (datetime, optional): Defaults to FLAYERFX_ARCHIVE_DAYS days ago.
+
+        Returns:
+            dict: The number of archived prices, the cutoff date and the seconds it took.
+        """
+        from models.price import Price
+        from models.product import Product
+        started = perf_counter()
+        if before is None:
+            before = archive_horizon()
+        latest = {product.latest_price_id for product in self.all(Product).values()}
+        prices = [price for price in self.all(Price).values()
+                  if price.fetched_at is not None and price.fetched_at < before and price.id not in latest]
+        price_archive.write([{column: getattr(price, column, None) for column in COLUMNS} for price in prices],
+                            before)
+        for price in prices:
+            self.__remove("Price." + price.id)
+        self.save()
+        return {'archived': len(prices), 'before': before.isoformat(),
+                'seconds': round(perf_counter() - started, 4)}
+
+    def price_history(self, product_id, since=None, until=None):
+        """
+        Returns the prices of a product fetched in a date range.
+
+        The archive is only read when the range starts before the archive cutoff.
+
+        Args:
+            product_id (str): The ID of the product.
+            since (datetime, optional): The earliest fetched_at. Defaults to the whole history.
+            until (datetime, optional): The latest fetched_at. Defaults to now.
+
+        Returns:
+            list: The Price objects, most recent first; archived ones have `archived` set.
+        """
+        from models.price import Price
+        prices = [price for price in self.get(Price, product_id=product_id) or []
+                  if (since is None or (price.fetched_at is not None and price.fetched_at >= since))
+                  and (until is None or (price.fetched_at is not None and price.fetched_at <= until))]
+        cutoff = price_archive.cutoff()
+        if cutoff is not None and (since is None or since < cutoff):
+            prices.extend(to_price(row) for row in price_archive.history(product_id, since, until))
+        return sorted(prices, key=lambda p: p.fetched_at or datetime.min, reverse=True)
+
+    def price_stats(self, product_ids, count=ROLLING_COUNT):
+        """
+        Computes the price statistics of many products.
+
+        Args:
+            product_ids (iterable): The IDs of the products.
+            count (int, optional): The number of most recent prices in the rolling average.
+
+        Returns:
+            dict: For each product ID, its price count, min, max, rolling_avg and last_change.
+        """
+        from models.price import Price
+        return {product_id: stats_from_prices(self.get(Price, product_id=product_id) or [], count)
+                for product_id in set(product_ids)}
+
+    @_serialized
+    def bulk_ingest(self, store_id, items, batch_size=BATCH_SIZE):
+        """
+        Ingests scraped items of a store.
+
+        The products of the store are resolved by reference once, each batch is
+        planned with `plan_batch` and applied in memory, the daily deals of the
+        products whose discounted prices were written are refreshed, and the file
+        is written a single time at the end, or only the changed objects are journaled.
+
+        Args:
+            store_id (str): The ID of the store the items belong to.
+            items (list): Scraped items in the `data_structure` format.
+            batch_size (int, optional): The number of items handled per batch.
+
+        Returns:
+            dict: The ingestion report with the per-batch counts and wall times.
+        """
+        from models.price import Price
+        from models.product import Product
+        stats = new_stats(store_id)
+        started = perf_counter()
+        known = {}
+        deals = {}
+        for product in self.get(Product, store_id=store_id) or []:
+            known[int(product.reference)] = {'id': product.id,
+                                             'latest_price_id': product.latest_price_id,
+                                             'latest_amount': product.latest_amount,
+                                             'latest_fetched_at': product.latest_fetched_at,
+                                             'latest_is_discount': product.latest_is_discount}
+        for start in range(0, len(items), batch_size):
+            batch_started = perf_counter()
+            batch = items[start:start + batch_size]
+            plan = plan_batch(store_id, batch, known, datetime.utcnow())
+            self.__add([Product(**row) for row in plan['products']])
+            self.__add([Price(**row) for row in plan['prices']])
+            for row in plan['bumps']:
+                self.__materialize(key="Price." + row['id'])
+                price = self.__objects.get("Price." + row['id'])
+                if price is not None:
+                    price.fetched_at = row['fetched_at']
+                    price.updated_at = row['updated_at']
+                    self.__mark("Price." + price.id)
+            for product_id, row in plan['snapshots'].items():
+                product = self.__objects.get("Product." + product_id)
+                if product is not None:
+                    for key, value in row.items():
+                        if key != 'id':
+                            setattr(product, key, value)
+                    self.__mark("Product." + product_id)
+            for product_id, fetched_at in plan['deals'].items():
+                deals[product_id] = min(fetched_at, deals.get(product_id, fetched_at))
+            batch_stats = {'items': len(batch),
+                           'products_created': len(plan['products']),
+                           'prices_created': len(plan['prices']),
+                           'prices_bumped': len(plan['bumps']),
+                           'skipped': plan['skipped'],
+                           'seconds': round(perf_counter() - batch_started, 4)}
+            for key in ['items', 'products_created', 'prices_created', 'prices_bumped', 'skipped']:
+                stats[key] += batch_stats[key]
+            stats['batches'].append(batch_stats)
+        if deals:
+            self.refresh_deals(deals.keys(), min(deals.values()))
+        self.save()
+        stats['seconds'] = round(perf_counter() - started, 4)
+        return stats
+
     def get_deals(self, dateleft, dateright):
         """
         Get deals between two dates.
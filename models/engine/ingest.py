@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+"""
+Module: ingest
+This module holds the storage independent part of the bulk scrape ingestion.
+It decides, for a batch of scraped items, which products have to be created,
+which prices have to be inserted and which latest prices only need their
+fetched_at bumped. The storage engines apply the resulting plan with batched
+statements in their `bulk_ingest` method.
+Public Functions:
+    item_fetched_at(item, default): Returns the fetch date of a scraped item as a datetime.
+    plan_batch(store_id, items, known, now): Plans the inserts and updates for a batch of items.
+    new_stats(store_id): Returns an empty ingestion report.
+Usage:
+    known = {reference: {'id': ..., 'latest_price_id': ..., 'latest_amount': ...,
+                         'latest_fetched_at': ..., 'latest_is_discount': ...}}
+    plan = plan_batch(store_id, items, known, datetime.utcnow())
+"""
+
+from datetime import datetime, timezone
+import uuid
+
+import dateutil.parser
+
+# Number of scraped items resolved and written per batch
+BATCH_SIZE = 500
+
+
+def item_fetched_at(item, default):
+    """
+    Returns the fetch date of a scraped item.
+
+    Dates with a UTC offset are converted to naive UTC, like the stored dates.
+
+    Args:
+        item (dict): The scraped item, optionally holding a 'fetched_at' key.
+        default (datetime): The date used when the item has no valid fetch date.
+
+    Returns:
+        datetime: The fetch date of the item.
+    """
+    value = item.get('fetched_at')
+    if type(value) is str:
+        try:
+            value = dateutil.parser.parse(value)
+        except (ValueError, dateutil.parser._parser.ParserError):
+            return default
+    if type(value) is not datetime:
+        return default
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def new_stats(store_id):
+    """
+    Returns an empty ingestion report.
+
+    Args:
+        store_id (str): The ID of the store being ingested.
+
+    Returns:
+        dict: The report with zeroed counters and no batches.
+    """
+    return {'store_id': store_id, 'items': 0, 'products_created': 0,
+            'prices_created': 0, 'prices_bumped': 0, 'skipped': 0,
+            'batches': [], 'seconds': 0.0}
+
+
+def plan_batch(store_id, items, known, now):
+    """
+    Plans the writes needed to ingest a batch of scraped items.
+
+    An item whose amount matches the latest price of its product, and which was
+    fetched after it, only bumps the fetched_at of that price. Any other item
+    inserts a new price, creating the product first if its reference is unknown.
+    `known` is updated in place so repeated references in later items and
+    batches see the planned state.
+
+    Args:
+        store_id (str): The ID of the store the items belong to.
+        items (list): Scraped items in the `data_structure` format.
+        known (dict): Maps product references to the product ID and latest price snapshot.
+        now (datetime): The timestamp used for created_at/updated_at and missing fetch dates.
+
+    Returns:
+        dict: A plan with the keys
+            - 'products' (list): Mappings of the products to insert.
+            - 'prices' (list): Mappings of the prices to insert.
+            - 'bumps' (list): Mappings of the prices whose fetched_at is updated.
+            - 'snapshots' (dict): Product ID to the latest price mapping of existing products.
+            - 'deals' (dict): Product ID to the earliest fetched_at of its inserted or bumped
+                              discounted prices, whose daily deals have to be refreshed.
+            - 'skipped' (int): Number of items that could not be planned.
+    """
+    products = []
+    prices = {}
+    bumps = {}
+    snapshots = {}
+    created = {}
+    deals = {}
+    skipped = 0
+    for item in items:
+        try:
+            reference = int(item['item_reference'])
+            amount = item['item_price']
+            is_discount = item.get('item_discount') is not None
+            fetched_at = item_fetched_at(item, now)
+        except (KeyError, TypeError, ValueError):
+            skipped += 1
+            continue
+        product = known.get(reference)
+        if product is None:
+            product = {'id': str(uuid.uuid4()), 'latest_price_id': None,
+                       'latest_amount': None, 'latest_fetched_at': None,
+                       'latest_is_discount': None}
+            products.append({'id': product['id'], 'store_id': store_id,
+                             'name': item.get('item_name'), 'link': item.get('item_link'),
+                             'reference': reference, 'created_at': now, 'updated_at': now})
+            created[product['id']] = product
+            known[reference] = product
+        latest_fetched_at = product['latest_fetched_at']
+        if product['latest_price_id'] is not None and product['latest_amount'] == amount \
+          and latest_fetched_at is not None and latest_fetched_at < fetched_at:
+            price_id = product['latest_price_id']
+            if price_id in prices:
+                prices[price_id]['fetched_at'] = fetched_at
+            else:
+                bumps[price_id] = {'id': price_id, 'fetched_at': fetched_at, 'updated_at': now}
+            product['latest_fetched_at'] = fetched_at
+            if product['latest_is_discount']:
+                deals[product['id']] = min(fetched_at, deals.get(product['id'], fetched_at))
+        else:
+            price_id = str(uuid.uuid4())
+            prices[price_id] = {'id': price_id, 'product_id': product['id'], 'amount': amount,
+                                'is_discount': is_discount, 'fetched_at': fetched_at,
+                                'first_seen_at': fetched_at, 'created_at': now, 'updated_at': now}
+            if is_discount:
+                deals[product['id']] = min(fetched_at, deals.get(product['id'], fetched_at))
+            if latest_fetched_at is None or fetched_at >= latest_fetched_at:
+                product['latest_price_id'] = price_id
+                product['latest_amount'] = amount
+                product['latest_fetched_at'] = fetched_at
+                product['latest_is_discount'] = is_discount
+            else:
+                continue
+        if product['id'] not in created:
+            snapshots[product['id']] = {'id': product['id'],
+                                        'latest_price_id': product['latest_price_id'],
+                                        'latest_amount': product['latest_amount'],
+                                        'latest_fetched_at': product['latest_fetched_at'],
+                                        'latest_is_discount': product['latest_is_discount']}
+    # New products carry their final snapshot in the inserted row
+    for row in products:
+        product = created[row['id']]
+        for key in ['latest_price_id', 'latest_amount', 'latest_fetched_at', 'latest_is_discount']:
+            row[key] = product[key]
+    return {'products': products, 'prices': list(prices.values()),
+            'bumps': list(bumps.values()), 'snapshots': snapshots, 'deals': deals,
+            'skipped': skipped}
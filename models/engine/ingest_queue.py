@@ -0,0 +1,297 @@
+#!/usr/bin/python3
+"""
+Module: ingest_queue
+This module defines the IngestQueue class, a durable SQLite backed queue for
+scrape payloads. The API enqueues payloads and returns immediately, and any
+number of `ingest_worker.py` processes claim and process them.
+Classes:
+    IngestQueue: A bounded, persistent queue with leases and idempotency keys.
+    QueueFull: Raised when the queue holds its maximum number of pending jobs.
+Public Functions:
+    payload_key(payload): Returns the default idempotency key of a payload.
+Usage:
+    Jobs are processed at least once: a job whose worker dies keeps its lease
+    until it expires and is then handed to another worker. An explicit
+    idempotency key deduplicates its payload for `window` seconds after the job
+    finished; the payload hash used without a key only while the job is pending,
+    so a scraper posting an unchanged catalogue again still bumps its prices.
+    Example:
+        queue = IngestQueue()
+        job_id, created = queue.enqueue(payload, key="store-2024-01-01")
+        job = queue.claim("worker-1")
+        queue.complete(job['id'], result)
+Environment Variables:
+    FLAYERFX_QUEUE_PATH: Path of the queue database. Defaults to "queue.db".
+    FLAYERFX_QUEUE_MAX_DEPTH: Maximum number of queued and running jobs. Defaults to 50.
+    FLAYERFX_QUEUE_LEASE: Seconds a worker owns a claimed job. Defaults to 600.
+    FLAYERFX_QUEUE_MAX_ATTEMPTS: Attempts before a job is marked failed. Defaults to 5.
+"""
+
+from contextlib import closing
+from hashlib import sha256
+import json
+from os import getenv
+import sqlite3
+from time import time
+
+
+class QueueFull(Exception):
+    """Raised when the ingestion queue is at its maximum depth."""
+    pass
+
+
+def payload_key(payload):
+    """
+    Returns the default idempotency key of a payload.
+
+    Args:
+        payload (dict): The scrape payload.
+
+    Returns:
+        str: The SHA-256 of the canonical JSON form of the payload.
+    """
+    return sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IngestQueue:
+    """
+    IngestQueue class storing scrape payloads in a SQLite database.
+    Attributes:
+        path (str): Path of the queue database.
+        max_depth (int): Maximum number of queued and running jobs.
+        lease (int): Seconds a claimed job belongs to its worker.
+        max_attempts (int): Attempts before a job is marked failed.
+        window (int): Seconds a finished job still deduplicates an explicit idempotency key.
+    Methods:
+        enqueue(payload, key=None): Adds a payload unless its key is already known.
+        claim(worker): Leases the oldest available job to a worker.
+        complete(job_id, result=None): Marks a job as done.
+        fail(job_id, error, delay=30): Re-queues a job or marks it failed.
+        get(job_id): Returns a job without its payload.
+        depth(): Returns the number of queued and running jobs.
+        stats(): Returns the number of jobs per status.
+        prune(older_than): Deletes finished jobs older than a number of seconds.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, path=None, max_depth=None, lease=None, max_attempts=None, window=3600):
+        """
+        Instantiate an IngestQueue object and create its table.
+
+        Args:
+            path (str, optional): Path of the queue database.
+            max_depth (int, optional): Maximum number of queued and running jobs.
+            lease (int, optional): Seconds a claimed job belongs to its worker.
+            max_attempts (int, optional): Attempts before a job is marked failed.
+            window (int, optional): Seconds a finished job still deduplicates an explicit key.
+        """
+        self.path = path or getenv('FLAYERFX_QUEUE_PATH', 'queue.db')
+        self.max_depth = int(max_depth or getenv('FLAYERFX_QUEUE_MAX_DEPTH', 50))
+        self.lease = int(lease or getenv('FLAYERFX_QUEUE_LEASE', 600))
+        self.max_attempts = int(max_attempts or getenv('FLAYERFX_QUEUE_MAX_ATTEMPTS', 5))
+        self.window = window
+        with closing(self.__connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                idempotency_key TEXT NOT NULL UNIQUE,
+                                payload TEXT NOT NULL,
+                                status TEXT NOT NULL,
+                                attempts INTEGER NOT NULL DEFAULT 0,
+                                available_at REAL NOT NULL,
+                                leased_until REAL,
+                                worker TEXT,
+                                created_at REAL NOT NULL,
+                                finished_at REAL,
+                                error TEXT,
+                                result TEXT)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_status_available "
+                         "ON jobs (status, available_at)")
+
+    def __connect(self):
+        """Opens a connection that waits on locks held by other processes."""
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def enqueue(self, payload, key=None):
+        """
+        Adds a payload to the queue.
+
+        A payload whose idempotency key belongs to a pending job, or whose explicit
+        key belongs to a job that finished less than `window` seconds ago, is not
+        added again. The finished job keeps its ID and status under a renamed key.
+
+        Args:
+            payload (dict): The scrape payload.
+            key (str, optional): The idempotency key. Defaults to the payload hash,
+                                 which only deduplicates pending jobs.
+
+        Returns:
+            tuple: The job ID and True if a new job was created, False for a duplicate.
+
+        Raises:
+            QueueFull: If the queue already holds `max_depth` pending jobs.
+        """
+        window = self.window if key else 0
+        key = key or payload_key(payload)
+        now = time()
+        conn = self.__connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT id, status, finished_at FROM jobs WHERE idempotency_key = ?",
+                               (key,)).fetchone()
+            if row is not None:
+                if row['status'] in (self.QUEUED, self.RUNNING) or \
+                  (row['finished_at'] or 0) > now - window:
+                    conn.execute("COMMIT")
+                    return row['id'], False
+                conn.execute("UPDATE jobs SET idempotency_key = idempotency_key || ':' || id WHERE id = ?",
+                             (row['id'],))
+            depth = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)",
+                                 (self.QUEUED, self.RUNNING)).fetchone()[0]
+            if depth >= self.max_depth:
+                conn.execute("ROLLBACK")
+                raise QueueFull(f"Ingestion queue is full ({depth} jobs)")
+            cursor = conn.execute("INSERT INTO jobs (idempotency_key, payload, status, available_at, created_at) "
+                                  "VALUES (?, ?, ?, ?, ?)",
+                                  (key, json.dumps(payload, default=str), self.QUEUED, now, now))
+            conn.execute("COMMIT")
+            return cursor.lastrowid, True
+        except sqlite3.Error:
+            # BEGIN IMMEDIATE itself fails when the database stays locked
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def claim(self, worker):
+        """
+        Leases the oldest available job to a worker.
+
+        Queued jobs and running jobs whose lease expired are both available.
+        Expired jobs that already used all their attempts are marked failed.
+
+        Args:
+            worker (str): A name identifying the worker.
+
+        Returns:
+            dict or None: The job with its decoded payload, or None if the queue is empty.
+        """
+        now = time()
+        conn = self.__connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("UPDATE jobs SET status = ?, finished_at = ?, error = 'Lease expired' "
+                         "WHERE status = ? AND leased_until < ? AND attempts >= ?",
+                         (self.FAILED, now, self.RUNNING, now, self.max_attempts))
+            row = conn.execute("SELECT id, idempotency_key, payload, attempts FROM jobs "
+                               "WHERE (status = ? AND available_at <= ?) OR (status = ? AND leased_until < ?) "
+                               "ORDER BY available_at, id LIMIT 1",
+                               (self.QUEUED, now, self.RUNNING, now)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute("UPDATE jobs SET status = ?, attempts = attempts + 1, leased_until = ?, worker = ? "
+                         "WHERE id = ?", (self.RUNNING, now + self.lease, worker, row['id']))
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return {'id': row['id'], 'key': row['idempotency_key'],
+                'attempts': row['attempts'] + 1, 'payload': json.loads(row['payload'])}
+
+    def complete(self, job_id, result=None):
+        """
+        Marks a job as done.
+
+        Args:
+            job_id (int): The ID of the job.
+            result (dict, optional): A JSON serializable summary of the processing.
+        """
+        with closing(self.__connect()) as conn:
+            conn.execute("UPDATE jobs SET status = ?, finished_at = ?, leased_until = NULL, result = ?, "
+                         "payload = '{}' WHERE id = ?",
+                         (self.DONE, time(), json.dumps(result, default=str), job_id))
+
+    def fail(self, job_id, error, delay=30):
+        """
+        Re-queues a failed job, or marks it failed once it used all its attempts.
+
+        Args:
+            job_id (int): The ID of the job.
+            error (str): A description of the failure.
+            delay (int, optional): Seconds before the job becomes available again.
+        """
+        now = time()
+        with closing(self.__connect()) as conn:
+            conn.execute("UPDATE jobs SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                         "finished_at = CASE WHEN attempts >= ? THEN ? ELSE NULL END, "
+                         "available_at = ?, leased_until = NULL, error = ? WHERE id = ?",
+                         (self.max_attempts, self.FAILED, self.QUEUED,
+                          self.max_attempts, now, now + delay, error, job_id))
+
+    def get(self, job_id):
+        """
+        Returns a job without its payload.
+
+        Args:
+            job_id (int): The ID of the job.
+
+        Returns:
+            dict or None: The job, or None if it does not exist.
+        """
+        with closing(self.__connect()) as conn:
+            row = conn.execute("SELECT id, idempotency_key, status, attempts, created_at, finished_at, error, result "
+                               "FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def depth(self):
+        """
+        Returns the number of queued and running jobs.
+
+        Returns:
+            int: The number of pending jobs.
+        """
+        with closing(self.__connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)",
+                                (self.QUEUED, self.RUNNING)).fetchone()[0]
+
+    def stats(self):
+        """
+        Returns the number of jobs per status.
+
+        Returns:
+            dict: A dictionary mapping each status to its job count.
+        """
+        counts = {self.QUEUED: 0, self.RUNNING: 0, self.DONE: 0, self.FAILED: 0}
+        with closing(self.__connect()) as conn:
+            for row in conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"):
+                counts[row['status']] = row['n']
+        return counts
+
+    def prune(self, older_than=7 * 24 * 3600):
+        """
+        Deletes finished jobs.
+
+        Args:
+            older_than (int, optional): Age in seconds of the finished jobs to delete.
+
+        Returns:
+            int: The number of deleted jobs.
+        """
+        with closing(self.__connect()) as conn:
+            cursor = conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                                  (self.DONE, self.FAILED, time() - older_than))
+            return cursor.rowcount
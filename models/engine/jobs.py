@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+"""
+Module: jobs
+This module runs long storage operations, e.g. deleting a large store, in
+background threads of the current process and keeps their status and
+progress, so a request can return at once with the ID of the job and the
+client can poll it. With the JSON storage, whose objects are shared by every
+thread and reloaded by every request teardown, jobs run inline in the thread
+that submits them.
+Classes:
+    BackgroundJobs: A thread pool keeping the status and progress of its jobs.
+Usage:
+    The job function receives a `progress(done, total)` callback as the `progress` keyword argument.
+    Example:
+        job_id = background_jobs.submit('delete_store', storage.bulk_delete, Store, [store_id])
+        print(background_jobs.get(job_id)['progress'])
+Environment Variables:
+    FLAYERFX_JOB_WORKERS: Number of threads running background jobs. Defaults to 2.
+    FLAYERFX_BACKGROUND_DELETE: Number of products above which a deletion runs as a background job. Defaults to 1000.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from os import getenv
+from threading import Lock
+from uuid import uuid4
+
+from logger import logHandler
+
+# Number of threads running background jobs
+JOB_WORKERS = int(getenv('FLAYERFX_JOB_WORKERS', 2))
+# Number of products above which deleting a store runs as a background job
+BACKGROUND_DELETE = int(getenv('FLAYERFX_BACKGROUND_DELETE', 1000))
+# Number of finished jobs kept for polling
+KEEP_FINISHED = 100
+
+
+class BackgroundJobs:
+    """
+    BackgroundJobs class running functions in a thread pool and tracking them.
+    Attributes:
+        workers (int): The number of threads.
+    Methods:
+        submit(name, function, *args, **kwargs): Runs a function in the background.
+        get(job_id): Returns the status of a job.
+        list(): Returns the status of every tracked job.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, workers=JOB_WORKERS):
+        """
+        Instantiate an idle job pool.
+
+        Args:
+            workers (int, optional): The number of threads running jobs.
+        """
+        self.workers = workers
+        self.__executor = ThreadPoolExecutor(workers)
+        self.__jobs = {}
+        self.__lock = Lock()
+
+    def submit(self, name, function, *args, **kwargs):
+        """
+        Runs a function in a background thread.
+
+        The function is called with args and kwargs, plus a `progress(done, total)`
+        callback as the `progress` keyword argument; its return value becomes the
+        result of the job. The storage session of the thread is closed once the
+        function returns. With the JSON storage the function runs before submit
+        returns, and the storage is left to the teardown of the request.
+
+        Args:
+            name (str): The name of the job, e.g. 'delete_store'.
+            function (callable): The function to run.
+
+        Returns:
+            str: The ID of the job.
+        """
+        job_id = uuid4().hex
+        with self.__lock:
+            self.__jobs[job_id] = {'id': job_id, 'name': name, 'status': self.QUEUED,
+                                   'progress': {'done': 0, 'total': None}, 'result': None, 'error': None,
+                                   'created_at': datetime.utcnow(), 'finished_at': None}
+            self.__prune()
+        from models import storage_t
+        if 'db' in storage_t:
+            self.__executor.submit(self.__run, job_id, function, args, kwargs)
+        else:
+            # A thread changing the shared objects would lose its changes to the next reload
+            self.__run(job_id, function, args, kwargs, close=False)
+        return job_id
+
+    def __run(self, job_id, function, args, kwargs, close=True):
+        """Runs a job and records its outcome, closing the storage session unless told not to."""
+        from models import storage
+
+        def progress(done, total=None):
+            with self.__lock:
+                self.__jobs[job_id]['progress'] = {'done': done, 'total': total}
+
+        self.__update(job_id, status=self.RUNNING)
+        try:
+            result = function(*args, progress=progress, **kwargs)
+            self.__update(job_id, status=self.DONE, result=result, finished_at=datetime.utcnow())
+        except Exception as e:
+            logHandler.error(f"Background job {job_id} failed: {e!r}")
+            self.__update(job_id, status=self.FAILED, error=repr(e), finished_at=datetime.utcnow())
+        finally:
+            if close:
+                storage.close()
+
+    def __update(self, job_id, **values):
+        """Updates the fields of a job."""
+        with self.__lock:
+            self.__jobs[job_id].update(values)
+
+    def __prune(self):
+        """Forgets the oldest finished jobs beyond KEEP_FINISHED."""
+        finished = [job for job in self.__jobs.values() if job['finished_at'] is not None]
+        finished.sort(key=lambda job: job['finished_at'])
+        for job in finished[:max(0, len(finished) - KEEP_FINISHED)]:
+            del self.__jobs[job['id']]
+
+    def get(self, job_id):
+        """
+        Returns the status of a job.
+
+        Args:
+            job_id (str): The ID of the job.
+
+        Returns:
+            dict or None: A copy of the job, or None if it is unknown.
+        """
+        with self.__lock:
+            job = self.__jobs.get(job_id)
+            return None if job is None else dict(job, progress=dict(job['progress']))
+
+    def list(self):
+        """
+        Returns the status of every tracked job, most recent first.
+
+        Returns:
+            list: Copies of the jobs.
+        """
+        with self.__lock:
+            jobs = [dict(job, progress=dict(job['progress'])) for job in self.__jobs.values()]
+        return sorted(jobs, key=lambda job: job['created_at'], reverse=True)
+
+
+# The background jobs of the current process
+background_jobs = BackgroundJobs()
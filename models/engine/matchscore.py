@@ -1,7 +1,9 @@
 #!/usr/bin/python3
 """
-Contains the Match Score function
+Contains the Match Score function and the name normalization shared by the
+product search and the cross-store product matching
 """
+import re
 
 # Threshold score for filtering search results
 SCORETHRESHOLD = 70
@@ -21,4 +23,29 @@ def match_score(search_string, product_name):
     # Bonus: check for substring match
     if search_string in product_name:
         score += 10  # Add bonus points for exact substring match
-    return score
\ No newline at end of file
+    return score
+
+def normalize_name(name):
+    """
+    Normalizes a product name for comparisons.
+
+    Args:
+        name (str): The product name.
+
+    Returns:
+        str: The lower-cased name with only its letters and digits, separated by single spaces.
+    """
+    return ' '.join(re.findall(r'[^\W_]+', (name or '').lower()))
+
+
+def name_tokens(name):
+    """
+    Returns the tokens of a product name used to find matching candidates.
+
+    Args:
+        name (str): The product name.
+
+    Returns:
+        set: The words of the normalized name longer than one character.
+    """
+    return {token for token in normalize_name(name).split() if len(token) > 1}
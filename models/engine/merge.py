@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+"""
+Module: merge
+This module holds the storage independent part of merging duplicate products,
+i.e. products of the same store sharing a reference number. It decides which
+product of each group is kept and which ones are merged into it; the storage
+engines move the prices and delete the merged products in their
+`merge_products` method.
+Public Functions:
+    plan_merge(rows): Groups duplicate products and picks the product kept in each group.
+    newest_snapshot(rows): Returns the most recent latest price snapshot of a group.
+    new_report(groups, dry_run): Returns the merge report of a plan.
+Usage:
+    rows = [{'id': ..., 'store_id': ..., 'reference': ..., 'created_at': ...}, ...]
+    groups = plan_merge(rows)
+    report = new_report(groups, dry_run=True)
+"""
+
+from datetime import datetime
+
+# Number of merged groups listed in a merge report
+REPORT_LIMIT = 100
+
+
+def plan_merge(rows):
+    """
+    Groups products by store and reference and picks the product kept in each group.
+
+    The oldest product of a group, by created_at then ID, is kept so its ID, which
+    clients may have stored, survives the merge. Products without a reference and
+    references used by a single product are left out.
+
+    Args:
+        rows (iterable): The products, as dicts or rows with id, store_id, reference
+                         and created_at.
+
+    Returns:
+        list: One dict per group of duplicates with its store_id, reference, the ID of
+              the product kept as 'keep' and the IDs of the products merged as 'merge'.
+    """
+    by_key = {}
+    for row in rows:
+        row = row if type(row) is dict else row._asdict()
+        if row['reference'] is None:
+            continue
+        by_key.setdefault((row['store_id'], row['reference']), []).append(row)
+    groups = []
+    for (store_id, reference), products in by_key.items():
+        if len(products) < 2:
+            continue
+        products.sort(key=lambda row: (row['created_at'] or datetime.min, row['id']))
+        groups.append({'store_id': store_id, 'reference': reference, 'keep': products[0]['id'],
+                       'merge': [row['id'] for row in products[1:]]})
+    groups.sort(key=lambda group: (group['store_id'], str(group['reference'])))
+    return groups
+
+
+def newest_snapshot(rows):
+    """
+    Returns the most recent latest price snapshot among the products of a group.
+
+    Args:
+        rows (iterable): The products of the group, as dicts with the latest_price_id,
+                         latest_amount, latest_fetched_at and latest_is_discount keys.
+
+    Returns:
+        dict or None: The snapshot values, or None if no product has a latest price.
+    """
+    rows = [row for row in rows if row['latest_price_id'] is not None]
+    if not rows:
+        return None
+    row = max(rows, key=lambda row: row['latest_fetched_at'] or datetime.min)
+    return {'latest_price_id': row['latest_price_id'], 'latest_amount': row['latest_amount'],
+            'latest_fetched_at': row['latest_fetched_at'], 'latest_is_discount': row['latest_is_discount']}
+
+
+def new_report(groups, dry_run):
+    """
+    Returns the merge report of a plan, before any price is counted.
+
+    Args:
+        groups (list): The groups returned by `plan_merge`.
+        dry_run (bool): Whether the merge only reports what it would change.
+
+    Returns:
+        dict: The report with the number of stores, groups and products to delete, zeroed
+              price, deal and relation counters, and the first REPORT_LIMIT groups.
+    """
+    return {'dry_run': dry_run, 'stores': len({group['store_id'] for group in groups}),
+            'groups': len(groups), 'products_deleted': sum(len(group['merge']) for group in groups),
+            'prices_moved': 0, 'deals_deleted': 0, 'relations_deleted': 0,
+            'merges': groups[:REPORT_LIMIT], 'seconds': 0.0}
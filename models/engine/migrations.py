@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+"""
+Module: migrations
+This module keeps existing SQLite and MySQL databases in line with the models.
+`Base.metadata.create_all` only creates missing tables, so columns and indexes
+added to existing models have to be added to existing tables here.
+Public Functions:
+    add_missing_columns(engine, metadata): Adds model columns missing from existing tables.
+    add_missing_indexes(engine, metadata): Creates model indexes missing from existing tables.
+Usage:
+    Called by DBStorage.reload after the tables have been created.
+    Example:
+        added = add_missing_columns(engine, Base.metadata)
+        created = add_missing_indexes(engine, Base.metadata)
+"""
+
+from sqlalchemy import inspect, text
+
+from logger import logHandler
+
+
+def add_missing_columns(engine, metadata):
+    """
+    Adds the columns declared on the models that are missing from the existing tables.
+
+    Only nullable columns without server defaults are expected here, which is
+    what every column added after the first release is.
+
+    Args:
+        engine (Engine): The SQLAlchemy engine of the database.
+        metadata (MetaData): The metadata holding the model tables.
+
+    Returns:
+        list: A list of (table name, column name) tuples for the columns that were added.
+    """
+    inspector = inspect(engine)
+    added = []
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            logHandler.info(f"Adding column {table.name}.{column.name} ({column_type})")
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            added.append((table.name, column.name))
+    return added
+
+
+def add_missing_indexes(engine, metadata):
+    """
+    Creates the indexes declared on the models that are missing from the existing tables.
+
+    Args:
+        engine (Engine): The SQLAlchemy engine of the database.
+        metadata (MetaData): The metadata holding the model tables.
+
+    Returns:
+        list: The names of the indexes that were created.
+    """
+    inspector = inspect(engine)
+    created = []
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            logHandler.info(f"Creating index {index.name} on {table.name}")
+            index.create(bind=engine)
+            created.append(index.name)
+    return created
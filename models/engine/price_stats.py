@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+"""
+Module: price_stats
+This module computes the price statistics of many products at once: the
+number of prices, the lowest and highest amounts, the rolling average of the
+most recent prices and the date the price last changed. Databases supporting
+window functions (SQLite 3.25+, MySQL 8+, MariaDB 10.2+) compute them in one
+query per chunk of products; other databases read the prices of the chunk in
+one query and the statistics are computed in Python, as FileStorage does.
+Public Functions:
+    empty_stats(): Returns the statistics of a product without prices.
+    stats_from_prices(prices, count=ROLLING_COUNT): Computes the statistics of the prices of a product.
+    supports_window_functions(engine): Tells whether a database engine has window functions.
+    window_stats_query(price_cls, product_ids, count=ROLLING_COUNT): Builds the window function query.
+Usage:
+    The storages compute the statistics with `storage.price_stats(product_ids)`.
+    Example:
+        stats = storage.price_stats([product.id for product in products])
+        print(stats[product.id]['rolling_avg'], stats[product.id]['last_change'])
+"""
+
+from sqlalchemy import case, func, or_, select
+
+from models.deal import ROLLING_COUNT
+
+
+def empty_stats():
+    """
+    Returns the statistics of a product without prices.
+
+    Returns:
+        dict: A zero count and rolling average, and no min, max or last change.
+    """
+    return {'count': 0, 'min': None, 'max': None, 'rolling_avg': 0, 'last_change': None}
+
+
+def stats_from_prices(prices, count=ROLLING_COUNT):
+    """
+    Computes the statistics of the prices of a product.
+
+    The last change is the first observation of the latest run of prices with
+    the same amount: the first_seen_at of its oldest price, or its fetched_at.
+
+    Args:
+        prices (iterable): The prices of the product, with their id, amount, fetched_at
+                           and first_seen_at.
+        count (int, optional): The number of most recent prices averaged.
+
+    Returns:
+        dict: The count, min, max, rolling_avg and last_change of the prices.
+    """
+    ordered = sorted(prices, key=lambda p: (p.fetched_at is not None, p.fetched_at or 0, p.id))
+    if not ordered:
+        return empty_stats()
+    amounts = [p.amount for p in ordered if p.amount is not None]
+    window = [p.amount for p in ordered[-count:] if p.amount is not None]
+    last_change = None
+    previous = None
+    for i, price in enumerate(ordered):
+        if i == 0 or price.amount != previous:
+            last_change = getattr(price, 'first_seen_at', None) or price.fetched_at
+        previous = price.amount
+    return {'count': len(ordered), 'min': min(amounts) if amounts else None,
+            'max': max(amounts) if amounts else None,
+            'rolling_avg': sum(window) / len(window) if window else 0, 'last_change': last_change}
+
+
+def supports_window_functions(engine):
+    """
+    Tells whether the database of an engine supports ROW_NUMBER and LAG.
+
+    Args:
+        engine (Engine): The SQLAlchemy engine of the database, already connected once.
+
+    Returns:
+        bool: True for SQLite 3.25+, MySQL 8+ and MariaDB 10.2+.
+    """
+    version = engine.dialect.server_version_info or ()
+    if engine.dialect.name == 'sqlite':
+        return version >= (3, 25)
+    if engine.dialect.name == 'mysql':
+        return version >= ((10, 2) if getattr(engine.dialect, 'is_mariadb', False) else (8, 0))
+    return engine.dialect.name in ('postgresql', 'mssql', 'oracle')
+
+
+def window_stats_query(price_cls, product_ids, count=ROLLING_COUNT):
+    """
+    Builds the query computing the statistics of products with window functions.
+
+    The prices are numbered from the most recent one and paired with the amount
+    of the previous price, then grouped by product.
+
+    Args:
+        price_cls (type): The Price class.
+        product_ids (list): The IDs of the products.
+        count (int, optional): The number of most recent prices averaged.
+
+    Returns:
+        Select: Rows of product_id, count, min, max, rolling_avg and last_change.
+    """
+    Price = price_cls
+    ranked = select(
+        Price.product_id.label('product_id'),
+        Price.amount.label('amount'),
+        func.coalesce(Price.first_seen_at, Price.fetched_at).label('seen'),
+        func.row_number().over(partition_by=Price.product_id,
+                               order_by=(Price.fetched_at.desc(), Price.id.desc())).label('position'),
+        func.lag(Price.amount).over(partition_by=Price.product_id,
+                                    order_by=(Price.fetched_at, Price.id)).label('previous'),
+    ).where(Price.product_id.in_(product_ids)).subquery()
+    changed = or_(ranked.c.previous.is_(None), ranked.c.previous != ranked.c.amount)
+    return select(
+        ranked.c.product_id,
+        func.count().label('count'),
+        func.min(ranked.c.amount).label('min'),
+        func.max(ranked.c.amount).label('max'),
+        func.avg(case((ranked.c.position <= count, ranked.c.amount))).label('rolling_avg'),
+        func.max(case((changed, ranked.c.seen))).label('last_change'),
+    ).group_by(ranked.c.product_id)
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+"""
+Module: query_counter
+This module counts the SQL statements a database engine executes on behalf of
+each thread, so the web applications can log how many statements a request
+needed and warn about views loading relationships one object at a time.
+Classes:
+    QueryCounter: Per-thread statement counts of the engines it is attached to.
+Usage:
+    DBStorage attaches the shared `query_counter` to its engine; the Flask
+    applications start and stop it around every request.
+    Example:
+        query_counter.start()
+        storage.get(Product, store_id=store_id, load=('store',))
+        print(query_counter.stop())
+Environment Variables:
+    FLAYERFX_QUERY_WARN: Number of statements above which a request is logged as a warning. Defaults to 50.
+"""
+
+from os import getenv
+from threading import local
+
+from sqlalchemy import event
+
+# Number of SQL statements above which a request is logged as a warning
+QUERY_WARN = int(getenv('FLAYERFX_QUERY_WARN', 50))
+
+
+class QueryCounter:
+    """
+    QueryCounter class counting the statements executed by the current thread.
+    Statements are only counted between `start` and `stop`.
+    Attributes:
+        threshold (int): The number of statements above which a request is too chatty.
+    Methods:
+        attach(engine): Counts the statements executed by an engine.
+        start(): Starts counting for the current thread from zero.
+        stop(): Stops counting for the current thread and returns the count.
+        count(): Returns the statements counted so far for the current thread.
+    """
+
+    def __init__(self, threshold=QUERY_WARN):
+        """
+        Instantiate a counter.
+
+        Args:
+            threshold (int, optional): The number of statements above which a request is too chatty.
+        """
+        self.threshold = threshold
+        self.__local = local()
+
+    def attach(self, engine):
+        """
+        Counts the statements executed by an engine.
+
+        Args:
+            engine (Engine): The SQLAlchemy engine.
+        """
+        if not event.contains(engine, 'before_cursor_execute', self.__before_cursor_execute):
+            event.listen(engine, 'before_cursor_execute', self.__before_cursor_execute)
+
+    def __before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        """Counts a statement if the current thread started counting."""
+        if getattr(self.__local, 'count', None) is not None:
+            self.__local.count += 1
+
+    def start(self):
+        """
+        Starts counting the statements of the current thread from zero.
+        """
+        self.__local.count = 0
+
+    def stop(self):
+        """
+        Stops counting the statements of the current thread.
+
+        Returns:
+            int: The number of statements counted since `start`, 0 if not started.
+        """
+        count = self.count()
+        self.__local.count = None
+        return count
+
+    def count(self):
+        """
+        Returns the number of statements counted so far for the current thread.
+
+        Returns:
+            int: 0 if the thread is not counting.
+        """
+        return getattr(self.__local, 'count', None) or 0
+
+
+# The counter attached to the engine of the storage
+query_counter = QueryCounter()
@@ -0,0 +1,331 @@
+#!/usr/bin/python3
+"""
+Module: search_index
+This module holds the full-text indexes behind `storage.search`. Each index
+turns a search string into the IDs of the products whose name shares words
+with it, ranked by the index, without scanning the products table. The
+storages then score these candidates with `match_score` and keep the ones
+reaching SCORETHRESHOLD, as before.
+Classes:
+    SQLiteSearchIndex: An FTS5 table kept in sync with the products table by triggers.
+    MySQLSearchIndex: A FULLTEXT index on the name of the products.
+    MemorySearchIndex: An inverted index of the words of product names, used by FileStorage.
+Public Functions:
+    search_words(text): Returns the words `match_score` compares.
+    search_index_for(engine): Returns the search index of a database engine.
+    rank(search_string, products, inclusive=True): Scores products and keeps the ones reaching SCORETHRESHOLD.
+Usage:
+    The indexes are created and kept up to date by the storages; a search index
+    that drifted, e.g. after a VACUUM of an SQLite database, is rebuilt with
+    `storage.rebuild_search_index()` or the `rebuild_search` console command.
+    Example:
+        index = search_index_for(engine)
+        index.setup()
+        ids = index.search(session, "whole milk 1l")
+Environment Variables:
+    FLAYERFX_SEARCH_LIMIT: Maximum number of candidates a database index returns. Defaults to 1000.
+"""
+
+from os import getenv
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+
+from models.engine.matchscore import match_score, SCORETHRESHOLD
+
+from logger import logHandler
+
+# Maximum number of candidates returned by a database index for one search
+SEARCH_LIMIT = int(getenv('FLAYERFX_SEARCH_LIMIT', 1000))
+# Bonus `match_score` gives when the search string is part of the product name
+SUBSTRING_BONUS = 10
+
+
+def search_words(text):
+    """
+    Returns the words of a search string or product name as `match_score` splits them.
+
+    Args:
+        text (str): The search string or product name.
+
+    Returns:
+        set: The lower-cased words.
+    """
+    return set((text or '').lower().split())
+
+
+def rank(search_string, products, inclusive=True):
+    """
+    Scores products against a search string with `match_score`.
+
+    Args:
+        search_string (str): The search string.
+        products (iterable): The candidate products.
+        inclusive (bool, optional): Whether a score equal to SCORETHRESHOLD is kept; the
+                                    database storages have always required a higher score.
+
+    Returns:
+        list: The products reaching SCORETHRESHOLD, sorted by ascending score.
+    """
+    scored = [(match_score(search_string, product.name), product) for product in products]
+    return [product for score, product in sorted(scored, key=lambda a: a[0])
+            if score > SCORETHRESHOLD or (inclusive and score == SCORETHRESHOLD)]
+
+
+def search_index_for(engine):
+    """
+    Returns the search index matching the dialect of a database engine.
+
+    Args:
+        engine (Engine): The SQLAlchemy engine of the database.
+
+    Returns:
+        SQLiteSearchIndex or MySQLSearchIndex or None: None if the dialect has no search index.
+    """
+    if engine.dialect.name == 'sqlite':
+        return SQLiteSearchIndex(engine)
+    if engine.dialect.name == 'mysql':
+        return MySQLSearchIndex(engine)
+    return None
+
+
+class SQLiteSearchIndex:
+    """
+    SQLiteSearchIndex class using an FTS5 table whose content is the products table.
+    The FTS5 table refers to the products by rowid, which a VACUUM may change;
+    `rebuild` re-reads every product name.
+    Attributes:
+        engine (Engine): The SQLAlchemy engine of the database.
+        available (bool): False if the SQLite library was built without FTS5.
+    Methods:
+        setup(): Creates the FTS5 table and its triggers if missing.
+        rebuild(): Re-reads the names of every product.
+        search(session, search_string, limit=SEARCH_LIMIT): Returns the IDs of the matching products.
+    """
+    TABLE = 'products_fts'
+    STATEMENTS = (
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5(name, content='products', content_rowid='rowid')",
+        f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_ai AFTER INSERT ON products BEGIN
+              INSERT INTO {TABLE}(rowid, name) VALUES (new.rowid, new.name);
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_ad AFTER DELETE ON products BEGIN
+              INSERT INTO {TABLE}({TABLE}, rowid, name) VALUES ('delete', old.rowid, old.name);
+            END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {TABLE}_au AFTER UPDATE OF name ON products BEGIN
+              INSERT INTO {TABLE}({TABLE}, rowid, name) VALUES ('delete', old.rowid, old.name);
+              INSERT INTO {TABLE}(rowid, name) VALUES (new.rowid, new.name);
+            END""",
+    )
+
+    def __init__(self, engine):
+        """
+        Instantiate the index of a database.
+
+        Args:
+            engine (Engine): The SQLAlchemy engine of the database.
+        """
+        self.engine = engine
+        self.available = False
+
+    def setup(self):
+        """
+        Creates the FTS5 table and the triggers keeping it in sync with the products table.
+
+        The names of the existing products are indexed when the table is created.
+
+        Returns:
+            bool: True if the index can be used.
+        """
+        try:
+            with self.engine.begin() as conn:
+                created = not inspect(conn).has_table(self.TABLE)
+                for statement in self.STATEMENTS:
+                    conn.execute(text(statement))
+            if created:
+                logHandler.info(f"Creating search index {self.TABLE}")
+                self.rebuild()
+            self.available = True
+        except DBAPIError as e:
+            logHandler.warning(f"Full-text search is not available, using LIKE filters: {e}")
+            self.available = False
+        return self.available
+
+    def rebuild(self):
+        """
+        Re-reads the names of every product into the FTS5 table.
+        """
+        with self.engine.begin() as conn:
+            conn.execute(text(f"INSERT INTO {self.TABLE}({self.TABLE}) VALUES ('rebuild')"))
+
+    def search(self, session, search_string, limit=SEARCH_LIMIT):
+        """
+        Returns the IDs of the products whose name holds any word of a search string.
+
+        Args:
+            session (Session): The session the query runs in, so pending changes are seen.
+            search_string (str): The search string.
+            limit (int, optional): The maximum number of IDs returned.
+
+        Returns:
+            list: The product IDs, best BM25 rank first.
+        """
+        words = search_words(search_string)
+        if not words:
+            return []
+        query = ' OR '.join('"' + word.replace('"', '""') + '"' for word in sorted(words))
+        rows = session.execute(text(
+            f"SELECT products.id FROM {self.TABLE} JOIN products ON products.rowid = {self.TABLE}.rowid "
+            f"WHERE {self.TABLE} MATCH :query ORDER BY {self.TABLE}.rank LIMIT :limit"),
+            {'query': query, 'limit': limit})
+        return [row[0] for row in rows]
+
+
+class MySQLSearchIndex:
+    """
+    MySQLSearchIndex class using a FULLTEXT index on products.name, maintained by MySQL itself.
+    Words shorter than the server's minimum token size (3 by default with InnoDB)
+    are not indexed; a search made only of such words is not handled by the index.
+    Attributes:
+        engine (Engine): The SQLAlchemy engine of the database.
+        available (bool): False if the index could not be created.
+    Methods:
+        setup(): Creates the FULLTEXT index if missing.
+        rebuild(): Drops and recreates the FULLTEXT index.
+        search(session, search_string, limit=SEARCH_LIMIT): Returns the IDs of the matching products.
+    """
+    INDEX = 'ft_products_name'
+    MIN_TOKEN_SIZE = 3
+
+    def __init__(self, engine):
+        """
+        Instantiate the index of a database.
+
+        Args:
+            engine (Engine): The SQLAlchemy engine of the database.
+        """
+        self.engine = engine
+        self.available = False
+
+    def setup(self):
+        """
+        Creates the FULLTEXT index on the product names if missing.
+
+        Returns:
+            bool: True if the index can be used.
+        """
+        try:
+            existing = {index['name'] for index in inspect(self.engine).get_indexes('products')}
+            if self.INDEX not in existing:
+                logHandler.info(f"Creating search index {self.INDEX} on products")
+                with self.engine.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE products ADD FULLTEXT INDEX {self.INDEX} (name)"))
+            self.available = True
+        except DBAPIError as e:
+            logHandler.warning(f"Full-text search is not available, using LIKE filters: {e}")
+            self.available = False
+        return self.available
+
+    def rebuild(self):
+        """
+        Drops and recreates the FULLTEXT index on the product names.
+        """
+        with self.engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE products DROP INDEX {self.INDEX}, "
+                              f"ADD FULLTEXT INDEX {self.INDEX} (name)"))
+
+    def search(self, session, search_string, limit=SEARCH_LIMIT):
+        """
+        Returns the IDs of the products whose name holds any indexed word of a search string.
+
+        Args:
+            session (Session): The session the query runs in.
+            search_string (str): The search string.
+            limit (int, optional): The maximum number of IDs returned.
+
+        Returns:
+            list or None: The product IDs, most relevant first, or None if no word of the
+                          search string is long enough to be indexed.
+        """
+        words = search_words(search_string)
+        if not words:
+            return []
+        if all(len(word) < self.MIN_TOKEN_SIZE for word in words):
+            return None
+        rows = session.execute(text(
+            "SELECT id FROM products WHERE MATCH(name) AGAINST (:query IN NATURAL LANGUAGE MODE) LIMIT :limit"),
+            {'query': ' '.join(sorted(words)), 'limit': limit})
+        return [row[0] for row in rows]
+
+
+class MemorySearchIndex:
+    """
+    MemorySearchIndex class mapping the words of product names to the keys of the products.
+    Attributes:
+        postings (dict): The keys of the products holding each word.
+    Methods:
+        add(key, name): Indexes the name of a product.
+        remove(key, name): Removes the name of a product from the index.
+        clear(): Empties the index.
+        search(search_string): Returns the keys of the products that can reach SCORETHRESHOLD.
+    """
+
+    def __init__(self):
+        """
+        Instantiate an empty index.
+        """
+        self.postings = {}
+
+    def add(self, key, name):
+        """
+        Indexes the name of a product.
+
+        Args:
+            key (str): The key of the product, Product.<id>.
+            name (str): The name of the product.
+        """
+        for word in search_words(name):
+            self.postings.setdefault(word, set()).add(key)
+
+    def remove(self, key, name):
+        """
+        Removes the name of a product from the index.
+
+        Args:
+            key (str): The key of the product, Product.<id>.
+            name (str): The name the product was indexed with.
+        """
+        for word in search_words(name):
+            keys = self.postings.get(word)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.postings[word]
+
+    def clear(self):
+        """
+        Empties the index.
+        """
+        self.postings.clear()
+
+    def search(self, search_string):
+        """
+        Returns the keys of the products sharing enough words with a search string.
+
+        A product sharing too few words to reach SCORETHRESHOLD, even with the
+        substring bonus of `match_score`, is not returned.
+
+        Args:
+            search_string (str): The search string.
+
+        Returns:
+            list: The keys of the candidate products.
+        """
+        words = search_words(search_string)
+        if not words:
+            return []
+        shared = {}
+        for word in words:
+            for key in self.postings.get(word, ()):
+                shared[key] = shared.get(key, 0) + 1
+        return [key for key, count in shared.items()
+                if count * 100 / len(words) + SUBSTRING_BONUS >= SCORETHRESHOLD]
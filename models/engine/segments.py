@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+"""
+Module: segments
+This module holds the storage independent part of the price history
+compaction. A run of consecutive prices of a product with the same amount and
+discount flag is one segment of its history: the price was seen unchanged from
+the first observation of the run to the fetch date of its last price. The
+compaction keeps the last price of each run, which the latest price snapshot
+and the daily deals may already point to, and stores the start of the run in
+its first_seen_at column.
+Public Functions:
+    first_seen(price): Returns the first time a price was observed.
+    price_runs(prices): Groups prices into runs of consecutive equal observations.
+    to_segment(run): Returns a run of prices as a segment dictionary.
+    plan_compaction(prices): Plans the updates and deletions collapsing runs into single prices.
+Usage:
+    prices = sorted(product.prices, key=lambda p: (p.fetched_at, p.id))
+    segments = [to_segment(run) for run in price_runs(prices)]
+    plan = plan_compaction(prices)
+"""
+
+
+def first_seen(price):
+    """
+    Returns the first time a price was observed.
+
+    Prices written before first_seen_at existed were created when first seen,
+    and their fetched_at was bumped while the amount stayed the same, so the
+    earlier of created_at and fetched_at stands for it.
+
+    Args:
+        price (Price or Row): A price with fetched_at, created_at and first_seen_at.
+
+    Returns:
+        datetime: The first observation of the price.
+    """
+    if getattr(price, 'first_seen_at', None) is not None:
+        return price.first_seen_at
+    created_at = getattr(price, 'created_at', None)
+    if created_at is None or price.fetched_at is None:
+        return price.fetched_at or created_at
+    return min(created_at, price.fetched_at)
+
+
+def price_runs(prices):
+    """
+    Groups prices into runs of consecutive observations of the same price.
+
+    Args:
+        prices (iterable): Prices sorted by product ID and ascending fetched_at.
+
+    Returns:
+        list: Lists of prices of the same product, amount and discount flag.
+    """
+    runs = []
+    for price in prices:
+        if runs:
+            last = runs[-1][-1]
+            if last.product_id == price.product_id and last.amount == price.amount \
+              and bool(last.is_discount) == bool(price.is_discount):
+                runs[-1].append(price)
+                continue
+        runs.append([price])
+    return runs
+
+
+def to_segment(run):
+    """
+    Returns a run of prices as a segment of the price history.
+
+    Args:
+        run (list): Consecutive prices of a product with the same amount and discount flag.
+
+    Returns:
+        dict: The segment with its product_id, price_id (the last price of the run),
+              amount, is_discount, first_seen, last_seen and the number of prices merged.
+    """
+    last = run[-1]
+    return {'product_id': last.product_id, 'price_id': last.id, 'amount': last.amount,
+            'is_discount': last.is_discount, 'first_seen': min(first_seen(p) for p in run),
+            'last_seen': last.fetched_at, 'prices': len(run)}
+
+
+def plan_compaction(prices):
+    """
+    Plans the collapse of every run of prices into its last price.
+
+    Args:
+        prices (iterable): Prices sorted by product ID and ascending fetched_at.
+
+    Returns:
+        dict: A plan with the keys
+            - 'updates' (list): {'id', 'first_seen_at'} mappings of the kept prices.
+            - 'deleted' (dict): The ID of each deleted price mapped to the ID of the kept price.
+            - 'segments' (int): The number of runs.
+    """
+    updates = []
+    deleted = {}
+    runs = price_runs(prices)
+    for run in runs:
+        if len(run) < 2:
+            continue
+        kept = run[-1]
+        updates.append({'id': kept.id, 'first_seen_at': min(first_seen(p) for p in run)})
+        for price in run[:-1]:
+            deleted[price.id] = kept.id
+    return {'updates': updates, 'deleted': deleted, 'segments': len(runs)}
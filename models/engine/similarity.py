@@ -0,0 +1,301 @@
+#!/usr/bin/python3
+"""
+Module: similarity
+This module scores the products of a store against a query product in one
+pass. The names of the products of a store are turned once into TF-IDF
+weighted character trigram vectors, kept as an inverted index of rows and
+weights per trigram, next to an array of their latest prices. A query then
+costs one array update per trigram of its name instead of one
+`difflib.SequenceMatcher` run per product.
+Classes:
+    StoreMatrix: The name features and latest prices of the products of a store.
+    SimilarityIndex: A cache of StoreMatrix objects per store.
+Public Functions:
+    similarity_score(name1, amount1, name2, amount2): The score of `calculate_similarity_score`.
+    name_ngrams(name, n=3): Returns the character n-gram counts of a product name.
+Usage:
+    NumPy is used when it is installed; otherwise the same computation runs
+    on Python lists.
+    Example:
+        index = SimilarityIndex()
+        matches = index.matrix(store.id).top(product.name, product.latest_amount, limit=10)
+Environment Variables:
+    FLAYERFX_SIMILAR_TTL: Seconds a store matrix is reused. Defaults to 300.
+"""
+
+from difflib import SequenceMatcher
+import math
+from os import getenv
+from threading import Lock
+from time import time
+
+from models.engine.data_version import data_version
+from models.engine.matchscore import normalize_name
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Seconds a store matrix is reused before being rebuilt
+MATRIX_TTL = int(getenv('FLAYERFX_SIMILAR_TTL', 300))
+# Number of candidates per requested match rescored with the exact score
+RERANK_FACTOR = 5
+
+
+def similarity_score(name1, amount1, name2, amount2):
+    """
+    Scores two products the way `calculate_similarity_score` does.
+
+    Args:
+        name1 (str): The name of the first product.
+        amount1 (float or None): The latest price of the first product.
+        name2 (str): The name of the second product.
+        amount2 (float or None): The latest price of the second product.
+
+    Returns:
+        float: The name similarity minus the relative difference of the prices.
+    """
+    score = SequenceMatcher(None, name1, name2).ratio()
+    if amount1 is None or amount2 is None or max(amount1, amount2) <= 0:
+        return score
+    return score - abs(amount1 - amount2) / max(amount1, amount2)
+
+
+def name_ngrams(name, n=3):
+    """
+    Returns the character n-grams of a product name.
+
+    Args:
+        name (str): The product name.
+        n (int, optional): The length of the n-grams.
+
+    Returns:
+        dict: The number of occurrences of each n-gram of the padded normalized name.
+    """
+    padded = f" {normalize_name(name)} "
+    grams = {}
+    for i in range(max(len(padded) - n + 1, 1)):
+        gram = padded[i:i + n]
+        grams[gram] = grams.get(gram, 0) + 1
+    return grams
+
+
+class StoreMatrix:
+    """
+    StoreMatrix class holding the TF-IDF trigram vectors and latest prices of the products of a store.
+    Attributes:
+        store_id (str): The ID of the store.
+        ids (list): The product IDs, one per row.
+        names (list): The product names, one per row.
+        amounts (list or ndarray): The latest prices, NaN when unknown.
+        postings (dict): For each trigram, the rows holding it and their normalized weights.
+        idf (dict): The inverse document frequency of each trigram.
+        built_at (float): The time the matrix was built.
+        version (str): The data version the matrix was built for.
+    Methods:
+        scores(name, amount): Returns the approximate score of every row.
+        top(name, amount, limit=10, threshold=0.5): Returns the best rows with their exact score.
+    """
+
+    def __init__(self, store_id, products):
+        """
+        Builds the matrix of the products of a store.
+
+        Args:
+            store_id (str): The ID of the store.
+            products (iterable): The products of the store.
+        """
+        self.store_id = store_id
+        self.ids = []
+        self.names = []
+        amounts = []
+        rows = []
+        df = {}
+        for product in products:
+            grams = name_ngrams(product.name)
+            self.ids.append(product.id)
+            self.names.append(product.name or "")
+            amounts.append(product.latest_amount if product.latest_amount is not None else math.nan)
+            rows.append(grams)
+            for gram in grams:
+                df[gram] = df.get(gram, 0) + 1
+        count = len(rows)
+        self.idf = {gram: math.log((1 + count) / (1 + n)) + 1 for gram, n in df.items()}
+        self.__unseen_idf = math.log(1 + count) + 1
+        postings = {}
+        for row, grams in enumerate(rows):
+            weights = {gram: tf * self.idf[gram] for gram, tf in grams.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for gram, weight in weights.items():
+                entry = postings.setdefault(gram, ([], []))
+                entry[0].append(row)
+                entry[1].append(weight / norm)
+        if np is not None:
+            self.amounts = np.array(amounts, dtype=float)
+            self.postings = {gram: (np.array(r, dtype=np.int64), np.array(w, dtype=float))
+                             for gram, (r, w) in postings.items()}
+        else:
+            self.amounts = amounts
+            self.postings = postings
+        self.built_at = time()
+        self.version = None
+
+    def __len__(self):
+        """Returns the number of products in the matrix."""
+        return len(self.ids)
+
+    def __query(self, name):
+        """
+        Returns the normalized TF-IDF weights of the trigrams of a name.
+
+        Trigrams missing from the store still count towards the norm, so a
+        name sharing few trigrams with the store scores low.
+
+        Args:
+            name (str): The name of the query product.
+
+        Returns:
+            dict: The weight of each trigram present in the store.
+        """
+        weights = {gram: tf * self.idf.get(gram, self.__unseen_idf) for gram, tf in name_ngrams(name).items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        return {gram: w / norm for gram, w in weights.items() if gram in self.postings}
+
+    def scores(self, name, amount):
+        """
+        Returns the approximate score of every product of the store.
+
+        The cosine similarity of the trigram vectors stands for the name
+        similarity, lowered by the relative price difference as in `similarity_score`.
+
+        Args:
+            name (str): The name of the query product.
+            amount (float or None): The latest price of the query product.
+
+        Returns:
+            list or ndarray: The score of each row.
+        """
+        query = self.__query(name)
+        if np is not None:
+            scores = np.zeros(len(self.ids))
+            for gram, weight in query.items():
+                rows, weights = self.postings[gram]
+                scores[rows] += weight * weights
+            if amount is not None and amount > 0:
+                known = ~np.isnan(self.amounts)
+                highest = np.maximum(self.amounts[known], amount)
+                scores[known] -= np.abs(self.amounts[known] - amount) / highest
+            return scores
+        scores = [0.0] * len(self.ids)
+        for gram, weight in query.items():
+            rows, weights = self.postings[gram]
+            for row, w in zip(rows, weights):
+                scores[row] += weight * w
+        if amount is not None and amount > 0:
+            for row, other in enumerate(self.amounts):
+                if not math.isnan(other):
+                    scores[row] -= abs(other - amount) / max(other, amount)
+        return scores
+
+    def top(self, name, amount, limit=10, threshold=0.5, exclude=None):
+        """
+        Returns the products of the store most similar to a query product.
+
+        The approximate scores of all rows are computed at once, then the
+        `limit * RERANK_FACTOR` best rows are rescored with `similarity_score`
+        and filtered with the threshold.
+
+        Args:
+            name (str): The name of the query product.
+            amount (float or None): The latest price of the query product.
+            limit (int, optional): The maximum number of products returned.
+            threshold (float, optional): The minimum exact score of a returned product.
+            exclude (str, optional): A product ID never returned.
+
+        Returns:
+            list: (product ID, score) tuples, best first.
+        """
+        if not self.ids or limit <= 0:
+            return []
+        scores = self.scores(name, amount)
+        candidates = limit * RERANK_FACTOR
+        if np is not None:
+            if candidates < len(scores):
+                rows = np.argpartition(-scores, candidates)[:candidates]
+            else:
+                rows = np.arange(len(scores))
+            rows = rows.tolist()
+        else:
+            rows = sorted(range(len(scores)), key=scores.__getitem__, reverse=True)[:candidates]
+        matches = []
+        for row in rows:
+            if self.ids[row] == exclude:
+                continue
+            other = self.amounts[row]
+            other = None if math.isnan(other) else float(other)
+            score = similarity_score(name or "", amount, self.names[row], other)
+            if score >= threshold:
+                matches.append((self.ids[row], score))
+        matches.sort(key=lambda match: match[1], reverse=True)
+        return matches[:limit]
+
+
+class SimilarityIndex:
+    """
+    SimilarityIndex class caching one StoreMatrix per store.
+    Attributes:
+        ttl (int): Seconds a matrix is reused.
+        matrices (dict): The cached matrices by store ID.
+    Methods:
+        matrix(store_id): Returns the matrix of a store, rebuilding it when stale.
+        invalidate(store_id=None): Drops the cached matrix of a store, or of every store.
+    """
+
+    def __init__(self, ttl=MATRIX_TTL):
+        """
+        Instantiate an empty SimilarityIndex.
+
+        Args:
+            ttl (int, optional): Seconds a matrix is reused.
+        """
+        self.ttl = ttl
+        self.matrices = {}
+        self.__lock = Lock()
+
+    def matrix(self, store_id):
+        """
+        Returns the matrix of a store.
+
+        A cached matrix is rebuilt once it is older than `ttl` seconds or when
+        the data version changed since it was built.
+
+        Args:
+            store_id (str): The ID of the store.
+
+        Returns:
+            StoreMatrix: The matrix of the products of the store.
+        """
+        from models import storage
+        from models.product import Product
+        version = data_version.current()
+        matrix = self.matrices.get(store_id)
+        if matrix is not None and matrix.version == version and time() - matrix.built_at < self.ttl:
+            return matrix
+        with self.__lock:
+            matrix = StoreMatrix(store_id, storage.get(Product, store_id=store_id) or [])
+            matrix.version = version
+            self.matrices[store_id] = matrix
+        return matrix
+
+    def invalidate(self, store_id=None):
+        """
+        Drops cached matrices.
+
+        Args:
+            store_id (str, optional): The store whose matrix is dropped. Defaults to every store.
+        """
+        if store_id is None:
+            self.matrices.clear()
+        else:
+            self.matrices.pop(store_id, None)
@@ -9,8 +9,9 @@ Classes:
 
 Public Functions:
     __init__(*args, **kwargs): Initializes a new instance of the Price class.
-    update(value=None): Updates the fetched_at attribute with the given value.
+    update(value=None): Updates the fetched_at attribute and the product's latest price snapshot.
     product: Retrieves the associated product (if 'db' not in storage_t).
+    first_seen: Returns the first time the price was observed.
 
 Usage:
     This module is used to create and manage price entries in the system. It supports both
@@ -30,10 +31,11 @@ Usage:
 from datetime import datetime
 import dateutil.parser
 
-from sqlalchemy import Boolean, Column, DateTime, Float, String, ForeignKey
+from sqlalchemy import Boolean, Column, DateTime, Float, Index, String, ForeignKey
 from sqlalchemy.orm import relationship
 
 from models.base_model import BaseModel, Base
+from models.engine.segments import first_seen
 from models import storage, storage_t
 
 
@@ -48,23 +50,36 @@ class Price(BaseModel, Base):
         fetched_at (datetime): The timestamp when the price was fetched.
         amount (float): The amount of the price.
         is_discount (bool): Indicates if the price is a discount.
+        first_seen_at (datetime): The first observation of the price, set by ingestion and the compaction.
+        archived (bool): True if the price was read from the archive and is not in the prices table.
     Methods:
         __init__(*args, **kwargs): Initializes a new instance of the Price class.
         update(value=None): Updates the fetched_at attribute with the given value.
         product: Retrieves the associated product (if 'db' not in storage_t).
+        first_seen: Returns the first time the price was observed.
     """
     if 'db' in storage_t:
         __tablename__ = 'prices'
+        __table_args__ = (
+            # Price history of a product ordered by fetch date
+            Index('ix_prices_productid_fetched_at', 'productid', 'fetched_at'),
+            # Recent discounted prices grouped by product, read from the index alone
+            Index('ix_prices_is_discount_fetched_at', 'is_discount', 'fetched_at', 'productid'),
+        )
         product_id = Column('productid', String(60), ForeignKey('products.id'), nullable=False)
         product = relationship('Product', back_populates='prices')
         fetched_at = Column(DateTime, default=datetime.utcnow)
         amount = Column('amount', Float)
         is_discount = Column('is_discount', Boolean(1))
+        first_seen_at = Column('first_seen_at', DateTime, nullable=True)
     else:
         product_id = ""
         fetched_at = datetime.now()
         amount = 0.0
         is_discount = False
+        first_seen_at = None
+    # True on the prices read from the archive by `storage.price_history`
+    archived = False
 
     def __init__(self, *args, **kwargs):
         """
@@ -75,6 +90,17 @@ class Price(BaseModel, Base):
             **kwargs: Arbitrary keyword arguments.
         """
         super().__init__(*args, **kwargs)
+
+    @property
+    def first_seen(self):
+        """
+        Returns the first time the price was observed.
+
+        Returns:
+            datetime: first_seen_at if set, otherwise the earlier of created_at and fetched_at.
+        """
+        return first_seen(self)
+
     def update(self, value=None):
         """
         Updates the 'fetched_at' attribute of the instance.
@@ -86,6 +112,8 @@ class Price(BaseModel, Base):
         Raises:
         ValueError: If the string cannot be parsed as a date.
         dateutil.parser._parser.ParserError: If the string cannot be parsed as a date.
+
+        The latest price snapshot of the associated product is updated with the new value.
         """
         if type(value) is str:
             try:
@@ -98,6 +126,9 @@ class Price(BaseModel, Base):
             setattr(self, 'fetched_at', value)
         else:
             setattr(self, 'fetched_at', datetime.now())
+        product = self.product
+        if product is not None and type(self.fetched_at) is datetime:
+            product.record_price(self)
     if 'db' not in storage_t:
         @property
         def product(self):
@@ -105,13 +136,14 @@ class Price(BaseModel, Base):
             Retrieves the product associated with the current instance.
 
             This method fetches the product from the storage using the product ID 
-            of the current instance. If the product is not found, it returns None.
+            of the current instance, cached by the storage until the next change.
+            If the product is not found, it returns None.
 
             Returns:
                 Product or None: The product instance if found, otherwise None.
             """
             from models.product import Product
-            prdct = storage.get(Product, id = self.product_id)
+            prdct = storage.related(Product, 'id', self.product_id)
             if not prdct:
                 return None
             return prdct[0]
@@ -16,14 +16,21 @@ Usage:
     latest_price = product.latest_price
     price_count = product.price_count
     sorted_prices = product.prices_sorted
+    # Reading the denormalized latest price without loading the history
+    snapshot = product.latest_snapshot
     # Accessing related store
     store = product.store
 """
 
-from sqlalchemy import Column, Integer, String, ForeignKey
+from datetime import datetime
+from difflib import SequenceMatcher
+
+from sqlalchemy import Boolean, Column, DateTime, Float, Index, Integer, String, ForeignKey
 from sqlalchemy.orm import relationship
 
-from models.base_model import BaseModel, Base
+from models.base_model import BaseModel, Base, time
+from models.engine.matchscore import normalize_name
+from models.engine.price_stats import ROLLING_COUNT
 from models.price import Price
 from models import storage, storage_t
 from models.product_relation import ProductRelation
@@ -41,17 +48,36 @@ class Product(BaseModel, Base):
         name (Column): Name of the product.
         reference (Column): Reference number of the product.
         prices (relationship): Relationship to the Price model with cascading delete options.
+        deals (relationship): Relationship to the materialized daily deals of the product (if 'db' in storage_t).
+        latest_price_ref (relationship): Relationship to the price of the latest price snapshot (if 'db' in storage_t).
+        latest_price_id (Column): ID of the most recent price of the product.
+        latest_amount (Column): Amount of the most recent price of the product.
+        latest_fetched_at (Column): Fetch date of the most recent price of the product.
+        latest_is_discount (Column): Discount flag of the most recent price of the product.
     Methods:
         __init__(*args, **kwargs): Initializes a Product instance.
         to_dict(with_latest_price=True, save_fs=None): Converts the product instance to a dictionary.
         prices (property): Retrieves the list of prices related to the product (if 'db' not in storage_t).
         store (property): Retrieves the store related to the product (if 'db' not in storage_t).
         latest_price (property): Retrieves the latest price of the product.
+        latest_snapshot (property): Retrieves the latest price of the product as a dictionary without loading it.
+        record_price(price): Moves the latest price snapshot to price if it is the most recent one.
+        refresh_latest_price(ignore=None): Recomputes the latest price snapshot from the price history.
+        price_stats(count=ROLLING_COUNT): Retrieves the price count, min, max, rolling average and last change.
         price_count (property): Retrieves the count of prices related to the product.
+        rolling_avg(count=ROLLING_COUNT): Retrieves the average of the most recent prices.
         prices_sorted (property): Retrieves the list of prices sorted by the fetched_at attribute in descending order.
+        price_segments (property): Retrieves the price history as runs of consecutive equal prices.
+        price_history(since=None, until=None): Retrieves the prices of a date range from the storage and the archive.
     """
     if 'db' in storage_t:
         __tablename__ = 'products'
+        __table_args__ = (
+            # Keyset pagination of the products of a store ordered by name
+            Index('ix_products_storeid_name', 'storeid', 'name'),
+            # Resolution of scraped items and Store.get_by_reference by (store, reference)
+            Index('ix_products_storeid_reference', 'storeid', 'reference'),
+        )
         store_id = Column('storeid', String(60), ForeignKey('stores.id'), nullable=False)
         store = relationship('Store', back_populates='products')
         link = Column('link', String(255))
@@ -62,11 +88,23 @@ class Product(BaseModel, Base):
                               cascade="all, delete, delete-orphan")
         relations = relationship("ProductRelation", foreign_keys=[ProductRelation.product_id], back_populates="product")
         reverse_relations = relationship("ProductRelation", foreign_keys=[ProductRelation.related_product_id], back_populates="related_product")
+        deals = relationship("Deal", back_populates="product", cascade="all, delete, delete-orphan")
+        # The price the snapshot refers to, so listings can load it with storage.get(load=('latest_price',))
+        latest_price_ref = relationship("Price", primaryjoin="foreign(Product.latest_price_id) == Price.id",
+                                        viewonly=True)
+        latest_price_id = Column('latest_price_id', String(60), nullable=True)
+        latest_amount = Column('latest_amount', Float, nullable=True)
+        latest_fetched_at = Column('latest_fetched_at', DateTime, nullable=True)
+        latest_is_discount = Column('latest_is_discount', Boolean(1), nullable=True)
     else:
         store_id = ""
         link = ""
         name = ""
         reference = 0
+        latest_price_id = None
+        latest_amount = None
+        latest_fetched_at = None
+        latest_is_discount = None
 
     def __init__(self, *args, **kwargs):
         """
@@ -84,19 +122,13 @@ class Product(BaseModel, Base):
             """
             Returns a list of prices related to the Product.
 
-            This method retrieves all prices from the storage and filters them
-            to include only those that are associated with the current product
-            instance.
+            This method looks the prices up in the product_id index of the
+            storage, so only the prices of the current product are visited.
 
             Returns:
                 list: A list of Price objects related to the Product.
             """
-            price_list = []
-            all_prices = storage.all(Price)
-            for price in all_prices.values():
-                if price.product_id == self.id:
-                    price_list.append(price)
-            return price_list
+            return storage.related(Price, 'product_id', self.id)
         @property
         def store(self):
             """
@@ -106,10 +138,24 @@ class Product(BaseModel, Base):
                 Store or None: The store object if found, otherwise None.
             """
             from models.store import Store
-            sto = storage.get(Store, id=self.store_id)
+            sto = storage.related(Store, 'id', self.store_id)
             if not sto:
                 return None
             return sto[0]
+        @property
+        def relations(self):
+            """
+            Returns:
+                list: The ProductRelation objects whose product is this product.
+            """
+            return storage.related(ProductRelation, 'product_id', self.id)
+        @property
+        def reverse_relations(self):
+            """
+            Returns:
+                list: The ProductRelation objects whose related product is this product.
+            """
+            return storage.related(ProductRelation, 'related_product_id', self.id)
     else:
         pass
 
@@ -119,32 +165,121 @@ class Product(BaseModel, Base):
         Args:
             with_latest_price (bool): If True, include the latest price in the dictionary.
             save_fs (optional): Additional parameter to pass to the superclass's to_dict method.
+                                The latest price is never included when saving to the file storage,
+                                since it is a read-only property rebuilt from the snapshot columns.
         Returns:
             dict: A dictionary representation of the product instance, optionally including the latest price.
         """
 
         a = super().to_dict(save_fs)
-        if with_latest_price:
-            a['latest_price'] = self.latest_price.to_dict() if self.latest_price else None
+        if with_latest_price and not save_fs:
+            a['latest_price'] = self.latest_snapshot
         return a
 
     @property
     def latest_price(self):
         """
-        Returns the latest price from the sorted prices list.
+        Returns the latest price of the product.
+
+        The price is looked up by the id kept in the latest price snapshot,
+        so only a single price row is loaded instead of the whole history.
+
+        Returns:
+            Price or None: The latest price if available, otherwise None.
+        """
+        if not self.latest_price_id:
+            return None
+        if 'db' in storage_t:
+            # Eagerly loaded or already in the session, unless the snapshot moved since
+            price = self.latest_price_ref
+            if price is not None and price.id == self.latest_price_id:
+                return price
+            p = storage.get(Price, id=self.latest_price_id)
+        else:
+            p = storage.related(Price, 'id', self.latest_price_id)
+        if not p:
+            return None
+        return p[0]
+
+    @property
+    def latest_snapshot(self):
+        """
+        Returns the latest price snapshot of the product as a dictionary.
 
-        This property retrieves the first element from the `prices_sorted` list,
-        which is assumed to be sorted in descending order. If the list is empty,
-        it returns None.
+        The dictionary has the same shape as `Price.to_dict` for the fields kept
+        on the product, which is all the listing endpoints need.
 
         Returns:
-            float or None: The latest price if available, otherwise None.
+            dict or None: The latest price snapshot if available, otherwise None.
         """
-        p = self.prices_sorted
-        if len(p) < 1:
+        if not self.latest_price_id:
             return None
+        fetched_at = self.latest_fetched_at
+        if type(fetched_at) is datetime:
+            fetched_at = fetched_at.strftime(time)
+        return {'__class__': 'Price',
+                'id': self.latest_price_id,
+                'product_id': self.id,
+                'amount': self.latest_amount,
+                'fetched_at': fetched_at,
+                'is_discount': self.latest_is_discount}
+
+    def record_price(self, price):
+        """
+        Updates the latest price snapshot with a new or bumped price.
+
+        The snapshot is moved to the price when it is at least as recent as the
+        current latest price. If the current latest price was moved back in time
+        the snapshot is recomputed from the price history.
+
+        Args:
+            price (Price): The price that was inserted or had its fetched_at updated.
+        """
+        if price.fetched_at is None:
+            price.fetched_at = datetime.utcnow()
+        if self.latest_price_id is None or self.latest_fetched_at is None \
+          or price.fetched_at >= self.latest_fetched_at:
+            self.latest_price_id = price.id
+            self.latest_amount = price.amount
+            self.latest_fetched_at = price.fetched_at
+            self.latest_is_discount = price.is_discount
+        elif price.id == self.latest_price_id:
+            self.refresh_latest_price()
+
+    def refresh_latest_price(self, ignore=None):
+        """
+        Recomputes the latest price snapshot from the full price history.
+
+        Args:
+            ignore (list, optional): IDs of prices to leave out, e.g. prices being deleted.
+        """
+        ignore = ignore or []
+        prices = [p for p in self.prices_sorted if p.id not in ignore]
+        if len(prices) < 1:
+            self.latest_price_id = None
+            self.latest_amount = None
+            self.latest_fetched_at = None
+            self.latest_is_discount = None
         else:
-            return p[0]
+            self.latest_price_id = prices[0].id
+            self.latest_amount = prices[0].amount
+            self.latest_fetched_at = prices[0].fetched_at
+            self.latest_is_discount = prices[0].is_discount
+
+    def price_stats(self, count=ROLLING_COUNT):
+        """
+        Returns the price statistics of the product, computed by the storage.
+
+        Listings should call `storage.price_stats` once for all their products instead.
+
+        Args:
+            count (int, optional): The number of most recent prices in the rolling average.
+
+        Returns:
+            dict: The price count, min, max, rolling_avg and last_change.
+        """
+        return storage.price_stats([self.id], count)[self.id]
+
     @property
     def price_count(self):
         """
@@ -153,7 +288,8 @@ class Product(BaseModel, Base):
         Returns:
             int: The count of prices.
         """
-        return len(self.prices)    
+        return self.price_stats()['count']
+
     @property
     def prices_sorted(self):
         """
@@ -164,20 +300,40 @@ class Product(BaseModel, Base):
         """
         return sorted(self.prices, key=lambda i:i.fetched_at, reverse=True)
 
-    def rolling_avg(self, count=10):
+    def price_history(self, since=None, until=None):
+        """
+        Returns the prices of the product fetched in a date range, including archived prices.
+
+        Args:
+            since (datetime, optional): The earliest fetched_at. Defaults to the whole history.
+            until (datetime, optional): The latest fetched_at. Defaults to now.
+
+        Returns:
+            list: The Price objects sorted by fetched_at in descending order.
+        """
+        return storage.price_history(self.id, since, until)
+
+    @property
+    def price_segments(self):
+        """
+        Returns the price history of the product as segments.
+
+        Returns:
+            list: A dictionary per run of consecutive equal prices with its amount, is_discount,
+                  first_seen and last_seen, most recent first.
+        """
+        return storage.price_segments(self.id)
+
+    def rolling_avg(self, count=ROLLING_COUNT):
         """
         Returns the rolling average of the prices.
 
-        This property calculates the average of all prices associated with the product.
+        This method averages the `count` most recent prices of the product without loading them.
 
         Returns:
-            float: The average price of the product.
+            float: The average price of the product, 0 without prices.
         """
-        if self.price_count == 0:
-            return 0
-        if self.price_count < count:
-            count = self.price_count
-        return sum([p.amount for p in self.prices_sorted[:count]]) / count
+        return self.price_stats(count)['rolling_avg']
 
     def get_related_products(self, min_similarity=0.0):
         """
@@ -203,36 +359,85 @@ class Product(BaseModel, Base):
         """
         Compares two products and returns a similarity score.
         
-        This method should be implemented to consider various factors such as:
-        - Product name similarity
-        - Price history similarity
-        - Other relevant attributes
+        The score is the similarity of the normalized names, lowered by the
+        relative difference of the latest prices when both products have one,
+        as in `calculate_similarity_score` of the scraper views.
         
         Returns:
             float: A similarity score between 0.0 and 1.0
         """
-        # Implement your comparison logic here
-        # This is a placeholder implementation
-        return 0.5
+        score = SequenceMatcher(None, normalize_name(product1.name), normalize_name(product2.name)).ratio()
+        if product1.latest_amount and product2.latest_amount:
+            score -= abs(product1.latest_amount - product2.latest_amount) / \
+                max(product1.latest_amount, product2.latest_amount)
+        return max(score, 0.0)
+
+    @staticmethod
+    def relation_key(product_id, related_product_id):
+        """
+        Returns the key of the relation between two products, whatever their order.
+
+        Args:
+            product_id (str): The ID of a product.
+            related_product_id (str): The ID of the other product.
+
+        Returns:
+            tuple: The two IDs in ascending order.
+        """
+        return tuple(sorted((product_id, related_product_id)))
 
     @classmethod
-    def update_product_relations(cls, product, potential_matches, threshold=0.7):
+    def update_product_relations(cls, product, potential_matches, threshold=0.7,
+                                 existing=None, commit=True):
         """
         Updates product relations based on similarity comparisons.
         
+        A pair of products has a single relation, stored with the smaller ID as
+        product_id. The score of an existing relation is updated instead of
+        adding a second one, and an existing relation whose score falls below
+        the threshold is deleted.
+        
         Args:
             product (Product): The product to update relations for
             potential_matches (list): List of potential matching products
             threshold (float): Minimum similarity score to create a relation
+            existing (dict, optional): The known relations by `relation_key`. Loaded from the
+                                       storage if not given, and updated with the new relations.
+            commit (bool, optional): If False, the relations are returned without being added
+                                     to the storage, so the caller can write them in bulk, and
+                                     the deleted relations are left for the caller to save.
+        
+        Returns:
+            list: The relations created or whose score changed.
         """
+        if existing is None:
+            existing = {cls.relation_key(r.product_id, r.related_product_id): r
+                        for r in (product.relations or []) + (product.reverse_relations or [])}
+        relations = []
+        deleted = False
         for potential_match in potential_matches:
             if product.id != potential_match.id and product.store_id != potential_match.store_id:
                 similarity = cls.compare_products(product, potential_match)
-                if similarity >= threshold:
+                key = cls.relation_key(product.id, potential_match.id)
+                relation = existing.get(key)
+                if relation is not None and similarity < threshold:
+                    storage.delete(relation)
+                    del existing[key]
+                    deleted = True
+                elif relation is not None:
+                    if relation.similarity_score != similarity:
+                        relation.similarity_score = similarity
+                        relations.append(relation)
+                elif similarity >= threshold:
                     relation = ProductRelation(
-                        product_id=product.id,
-                        related_product_id=potential_match.id,
+                        product_id=key[0],
+                        related_product_id=key[1],
                         similarity_score=similarity
                     )
-                    storage.new(relation)
-        storage.save()
+                    existing[key] = relation
+                    relations.append(relation)
+        if commit and (relations or deleted):
+            if relations:
+                storage.new(relations)
+            storage.save()
+        return relations
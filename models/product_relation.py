@@ -32,3 +32,26 @@ class ProductRelation(BaseModel, Base):
     def __init__(self, *args, **kwargs):
         """Initializes a new ProductRelation instance."""
         super().__init__(*args, **kwargs)
+
+    if 'db' not in storage_t:
+        @property
+        def product(self):
+            """
+            Returns:
+                Product or None: The product of the relation.
+            """
+            from models import storage
+            from models.product import Product
+            prdct = storage.related(Product, 'id', self.product_id)
+            return prdct[0] if prdct else None
+
+        @property
+        def related_product(self):
+            """
+            Returns:
+                Product or None: The matching product of the relation.
+            """
+            from models import storage
+            from models.product import Product
+            prdct = storage.related(Product, 'id', self.related_product_id)
+            return prdct[0] if prdct else None
@@ -61,12 +61,7 @@ class Store(BaseModel, Base):
             Returns:
                 list: A list of Product instances that are related to the Store.
             """
-            product_list = []
-            all_products = models.storage.all(Product)
-            for product in all_products.values():
-                if product.store_id == self.id:
-                    product_list.append(product)
-            return product_list
+            return models.storage.related(Product, 'store_id', self.id)
         def get_by_reference(self, product_references):
             """
             Returns:
@@ -74,7 +69,10 @@ class Store(BaseModel, Base):
             """
             if type(product_references) is not list:
                 product_references = [product_references]
-            return [i for i in self.products if i.reference in product_references]
+            product_list = []
+            for reference in dict.fromkeys(product_references):
+                product_list.extend(models.storage.get(Product, store_id=self.id, reference=reference) or [])
+            return product_list
     else:
         def get_by_reference(self, product_references):
             """
@@ -0,0 +1,17 @@
+#!/usr/bin/python3
+"""
+Test configuration: the storage and its files live in a temporary directory
+and the storage engines get their logger before models is imported.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('FLAYERFX_TYPE_STORAGE', 'json')
+os.chdir(tempfile.mkdtemp(prefix='flayerfx-tests-'))
+
+from logger import init_logger  # noqa: E402
+
+init_logger(None)
@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+"""
+Tests of the JSON storage journal: in-place edits, torn lines and compaction,
+run against the same storage with and without FLAYERFX_FILE_JOURNAL.
+"""
+import json
+import os
+
+import pytest
+
+from models import storage, storage_t
+from models.engine import file_storage
+from models.price import Price
+from models.product import Product
+from models.store import Store
+
+pytestmark = pytest.mark.skipif('db' in storage_t, reason="JSON storage only")
+
+FILE = "file.json"
+JOURNAL = "file.json.journal"
+
+
+@pytest.fixture(params=[False, True], ids=['rewrite', 'journal'])
+def journal(request, monkeypatch):
+    """Runs a test with and without the journal, from an empty storage."""
+    monkeypatch.setattr(file_storage, 'JOURNAL', request.param)
+    for path in (FILE, JOURNAL):
+        if os.path.exists(path):
+            os.remove(path)
+    storage.reload()
+    for obj in list(storage.all().values()):
+        storage.delete(obj)
+    storage.compact()
+    storage.reload()
+    return request.param
+
+
+def new_product(name='Brookside Milk 500ml'):
+    store = Store(name='Naivas')
+    product = Product(store_id=store.id, name=name, link='l', reference=1)
+    storage.new([store, product])
+    storage.save()
+    return product
+
+
+def test_in_place_edit_is_saved(journal):
+    product = new_product()
+    product.name = 'Fresha Yoghurt 250ml'
+    storage.save()
+    storage.reload()
+    assert storage.get(Product, id=product.id)[0].name == 'Fresha Yoghurt 250ml'
+    assert [p.id for p in storage.search(Product, name='Fresha Yoghurt 250ml') or []] == [product.id]
+    assert os.path.exists(JOURNAL) == journal
+
+
+def test_snapshot_changed_in_place_is_saved(journal):
+    product = new_product()
+    other = Product(store_id=product.store_id, name='Other', link='l', reference=2)
+    storage.new(other)
+    price = Price(product_id=product.id, amount=10.0)
+    storage.new(price)
+    storage.save()
+    # As in the price view: the price moves to another product, whose snapshot changes in place
+    price.product_id = other.id
+    storage.get(Product, id=product.id)[0].refresh_latest_price(ignore=[price.id])
+    storage.get(Product, id=other.id)[0].record_price(price)
+    price.save()
+    storage.reload()
+    assert storage.get(Product, id=other.id)[0].latest_price_id == price.id
+    assert storage.get(Product, id=product.id)[0].latest_price_id is None
+
+
+def test_torn_last_line_is_ignored(journal):
+    if not journal:
+        pytest.skip("the journal only exists in journal mode")
+    product = new_product()
+    with open(JOURNAL, 'a') as f:
+        f.write(json.dumps({'key': 'Product.' + product.id, 'deleted': True})[:20])
+    storage.reload()
+    assert storage.get(Product, id=product.id) is not None
+    product = storage.get(Product, id=product.id)[0]
+    product.name = 'After the torn line'
+    storage.save()
+    storage.reload()
+    assert storage.get(Product, id=product.id)[0].name == 'After the torn line'
+
+
+def test_uncommitted_records_are_ignored(journal):
+    if not journal:
+        pytest.skip("the journal only exists in journal mode")
+    product = new_product()
+    with open(JOURNAL, 'a') as f:
+        f.write('\n' + json.dumps({'key': 'Product.' + product.id, 'deleted': True}) + '\n')
+    storage.reload()
+    assert storage.get(Product, id=product.id) is not None
+
+
+def test_compaction_removes_the_journal(journal, monkeypatch):
+    if not journal:
+        pytest.skip("the journal only exists in journal mode")
+    monkeypatch.setattr(file_storage, 'COMPACT_AFTER', 3)
+    product = new_product()
+    assert os.path.exists(JOURNAL)
+    product.name = 'Compacted'
+    storage.save()
+    assert not os.path.exists(JOURNAL)
+    storage.reload()
+    assert storage.get(Product, id=product.id)[0].name == 'Compacted'
+
+
+def test_journal_left_by_an_interrupted_compaction_is_replayed(journal):
+    if not journal:
+        pytest.skip("the journal only exists in journal mode")
+    product = new_product()
+    product.name = 'Renamed'
+    storage.save()
+    with open(JOURNAL) as f:
+        records = f.read()
+    # A crash between the rename of the compacted file and the removal of the journal
+    storage.compact()
+    with open(JOURNAL, 'w') as f:
+        f.write(records)
+    storage.reload()
+    assert storage.get(Product, id=product.id)[0].name == 'Renamed'
+    assert storage.count(Product) == 1
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+"""
+Tests of the durable ingestion queue: deduplication, depth limit, leases and attempts.
+"""
+import pytest
+
+from models.engine import ingest_queue as queue_module
+from models.engine.ingest_queue import IngestQueue, QueueFull
+
+PAYLOAD = {'store': 'Naivas', 'prices': [{'item_name': 'Milk', 'item_link': 'l',
+                                          'item_price': 60.0, 'item_reference': 1}]}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces the clock of the queue by a settable one."""
+    now = [1000.0]
+    monkeypatch.setattr(queue_module, 'time', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    return IngestQueue(path=str(tmp_path / 'queue.db'), max_depth=3, lease=60, max_attempts=2)
+
+
+def test_enqueue_claim_complete(queue):
+    job_id, created = queue.enqueue(PAYLOAD)
+    assert created
+    job = queue.claim('w1')
+    assert job['id'] == job_id and job['attempts'] == 1 and job['payload'] == PAYLOAD
+    assert queue.claim('w2') is None
+    queue.complete(job_id, {'items': 1})
+    assert queue.get(job_id)['status'] == IngestQueue.DONE
+    assert queue.get(job_id)['result'] == {'items': 1}
+    assert queue.depth() == 0
+
+
+def test_payload_hash_only_deduplicates_pending_jobs(queue, clock):
+    job_id, created = queue.enqueue(PAYLOAD)
+    assert queue.enqueue(PAYLOAD) == (job_id, False)
+    queue.complete(queue.claim('w1')['id'])
+    clock[0] += 1
+    new_id, created = queue.enqueue(PAYLOAD)
+    assert created and new_id != job_id
+    assert queue.get(job_id)['status'] == IngestQueue.DONE
+
+
+def test_explicit_key_deduplicates_within_window(queue, clock):
+    job_id, created = queue.enqueue(PAYLOAD, key='naivas-1')
+    queue.complete(queue.claim('w1')['id'])
+    assert queue.enqueue(PAYLOAD, key='naivas-1') == (job_id, False)
+    clock[0] += queue.window + 1
+    new_id, created = queue.enqueue(PAYLOAD, key='naivas-1')
+    assert created and new_id != job_id
+    assert queue.get(job_id)['status'] == IngestQueue.DONE
+
+
+def test_depth_limit(queue):
+    for number in range(3):
+        queue.enqueue(PAYLOAD, key=f"key-{number}")
+    with pytest.raises(QueueFull):
+        queue.enqueue(PAYLOAD, key='key-3')
+    queue.complete(queue.claim('w1')['id'])
+    assert queue.enqueue(PAYLOAD, key='key-3')[1]
+
+
+def test_expired_lease_is_claimed_again(queue, clock):
+    job_id, created = queue.enqueue(PAYLOAD)
+    assert queue.claim('w1')['attempts'] == 1
+    clock[0] += 30
+    assert queue.claim('w2') is None
+    clock[0] += 31
+    job = queue.claim('w2')
+    assert job['id'] == job_id and job['attempts'] == 2
+
+
+def test_expired_lease_fails_after_max_attempts(queue, clock):
+    job_id, created = queue.enqueue(PAYLOAD)
+    queue.claim('w1')
+    clock[0] += 61
+    queue.claim('w2')
+    clock[0] += 61
+    assert queue.claim('w3') is None
+    job = queue.get(job_id)
+    assert job['status'] == IngestQueue.FAILED and job['error'] == 'Lease expired'
+
+
+def test_fail_requeues_until_max_attempts(queue, clock):
+    job_id, created = queue.enqueue(PAYLOAD)
+    queue.fail(queue.claim('w1')['id'], 'boom', delay=30)
+    assert queue.get(job_id)['status'] == IngestQueue.QUEUED
+    assert queue.claim('w1') is None
+    clock[0] += 31
+    queue.fail(queue.claim('w1')['id'], 'boom again')
+    job = queue.get(job_id)
+    assert job['status'] == IngestQueue.FAILED and job['error'] == 'boom again'
+    assert queue.depth() == 0
+
+
+def test_full_queue_answers_503(tmp_path, monkeypatch):
+    from api.v1.views import scrapers
+    from flask_app import app
+    monkeypatch.setattr(scrapers, 'storage_t', 'db_sqllite')
+    monkeypatch.setattr(scrapers, 'ingest_queue', IngestQueue(path=str(tmp_path / 'queue.db'), max_depth=1))
+    monkeypatch.setattr(scrapers, 'ValidateScrapeJSON', lambda payload: 0)
+    client = app.test_client()
+    response = client.post('/api/v1/generic_scrape', json=PAYLOAD)
+    assert response.status_code == 202
+    response = client.post('/api/v1/generic_scrape', json=PAYLOAD, headers={'Idempotency-Key': 'other'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(scrapers.retry_after)
@@ -0,0 +1,44 @@
+#!/usr/bin/python3
+"""
+Tests of the monthly price archive: removing the prices of deleted products
+and moving the prices of merged products.
+"""
+import os
+from datetime import datetime
+
+import pytest
+
+from models.engine.archive import PriceArchive
+
+
+def row(price_id, product_id, fetched_at):
+    dates = {column: fetched_at for column in ('fetched_at', 'first_seen_at', 'created_at', 'updated_at')}
+    return dict(dates, id=price_id, product_id=product_id, amount=1.0, is_discount=False)
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """An archive holding prices of products a, b and c over two months."""
+    archive = PriceArchive(str(tmp_path))
+    archive.write([row('1', 'a', datetime(2024, 1, 5)), row('2', 'a', datetime(2024, 2, 5)),
+                   row('3', 'b', datetime(2024, 1, 9)), row('4', 'c', datetime(2024, 2, 9))],
+                  datetime(2024, 3, 1))
+    return archive
+
+
+def test_drop_removes_the_prices_and_empty_months(archive):
+    assert archive.drop(['a', 'c', 'missing']) == 3
+    assert archive.history('a') == []
+    assert sorted(archive.index()['months']) == ['b']
+    assert [r['id'] for r in archive.history('b')] == ['3']
+    assert not os.path.exists(os.path.join(archive.directory, "prices-2024-02.json.gz"))
+    assert archive.drop(['a']) == 0
+
+
+def test_reassign_moves_the_prices_to_the_kept_product(archive):
+    assert archive.count(['a', 'b']) == 3
+    assert archive.reassign({'a': 'b'}) == 2
+    assert archive.history('a') == []
+    assert [r['id'] for r in archive.history('b')] == ['1', '3', '2']
+    assert archive.index()['months']['b'] == ['2024-01', '2024-02']
+    assert archive.cutoff() == datetime(2024, 3, 1)